@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Cost of finding the handler of a button tap in the conversation tree of the bot,
+with the CallbackRouters (compact callback data, dict lookup) and with the regex
+CallbackQueryHandlers they replaced (callback data str(ChatState.X), one pattern per handler).
+The tree is the one built by cringe.build_conversation: the regex version is obtained
+by replacing every router with a regex handler per route, in the same order.
+
+Run from the src folder: python -m benchmarks.bench_dispatch """
+
+import argparse
+from datetime import datetime
+import re
+import time
+import warnings
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import CallbackQueryHandler, ConversationHandler
+
+from callbacks import CallbackRouter, encode
+from states import ChatState
+
+warnings.filterwarnings("ignore")
+import cringe
+
+
+#(path of conversation states from the outer conversation to the inner one, button pressed)
+TAPS = [
+    (["conv_handler:SELECTING_ACTION"], ChatState.QUIT_CRINGETTE),
+    (["conv_handler:SELECTING_ACTION"], ChatState.SEARCH_FOR_RECIPES),
+    (["conv_handler:SELECTING_ACTION", "view_recipes_conv:SELECTING_ACTION"], ChatState.VIEW_NEXT),
+    (["conv_handler:SELECTING_ACTION", "view_recipes_conv:SELECTING_ACTION"], ChatState.QUIT_VIZ),
+    (["conv_handler:SELECTING_ACTION", "search_recipes_conv:SELECTING_ACTION"], ChatState.VIEW_RECIPE_PHOTOS),
+    (["conv_handler:SELECTING_ACTION", "search_recipes_conv:WAIT_CONFIRM"], ChatState.QUIT_SEARCH),
+    (["conv_handler:SELECTING_ACTION", "new_recipe_conv:ASK_CONFIRM"], ChatState.DONT_DO_IT),
+    (["conv_handler:SELECTING_ACTION", "new_recipe_conv:SELECTING_ACTION", "recipe_conv:SELECTING_ACTION"],
+        ChatState.DELETE_RECIPE_METHOD),
+]
+
+
+def conversations(handler: ConversationHandler) -> dict:
+    """ Map the names of @handler and of its nested conversations to the conversations """
+
+    found = {handler.name: handler}
+    for handlers in [handler.entry_points, *handler.states.values()]:
+        for nested in handlers:
+            if isinstance(nested, ConversationHandler):
+                found.update(conversations(nested))
+    return found
+
+def to_regex(handler: ConversationHandler):
+    """ Replace the CallbackRouters of @handler with regex handlers, as they were before the routers """
+
+    for handlers in [handler.entry_points, *handler.states.values()]:
+        handlers[:] = [
+            new for old in handlers for new in (
+                [CallbackQueryHandler(callback, pattern = f"^{re.escape(str(state))}$")
+                    for state, callback in old.routes.items()] if isinstance(old, CallbackRouter) else [old])]
+
+        for nested in handlers:
+            if isinstance(nested, ConversationHandler):
+                to_regex(nested)
+
+def tap(user_id: int, data: str) -> Update:
+    user = User(user_id, "Bench", False)
+    message = Message(1, datetime.now(), Chat(user_id, Chat.PRIVATE))
+    return Update(user_id, callback_query = CallbackQuery(str(user_id), user, "bench", message = message, data = data))
+
+def measure(handler: ConversationHandler, legacy: bool, rounds: int) -> list:
+    """ Set up a user in each state of TAPS and return the ns spent looking up the handler of each tap """
+
+    convs, updates = conversations(handler), list()
+
+    for user_id, (path, state) in enumerate(TAPS, 1):
+        for step in path:
+            name, conv_state = step.split(":")
+            convs[name].conversations[(user_id, user_id)] = ChatState[conv_state]
+        updates.append(tap(user_id, str(state) if legacy else encode(state)))
+
+    timings = list()
+
+    for update in updates:
+        if not handler.check_update(update):
+            raise RuntimeError(f"No handler for {update.callback_query.data}")
+
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            handler.check_update(update)
+        timings.append((time.perf_counter_ns() - start) / rounds)
+
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("dispatch benchmark")
+    parser.add_argument("--rounds", type = int, default = 20000, help = "lookups per tap")
+    args = parser.parse_args()
+
+    regex = cringe.build_conversation()
+    to_regex(regex)
+    before = measure(regex, legacy = True, rounds = args.rounds)
+    after = measure(cringe.build_conversation(), legacy = False, rounds = args.rounds)
+
+    print(f"{'button':<24}{'regex ns':>12}{'router ns':>12}{'speedup':>10}")
+    for (_, state), old, new in zip(TAPS, before, after):
+        print(f"{state.name:<24}{old:>12.0f}{new:>12.0f}{old / new:>9.1f}x")
+    print(f"{'mean':<24}{sum(before) / len(before):>12.0f}{sum(after) / len(after):>12.0f}"
+          f"{sum(before) / sum(after):>9.1f}x")
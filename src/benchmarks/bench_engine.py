@@ -0,0 +1,82 @@
+#! /usr/bin/env python3 
+# -*- coding: utf-8 -*-
+
+""" Read/write concurrency of the SQLite engine profiles. 
+Some reader threads browse recipes while a writer keeps saving new ones. 
+
+Run from the src folder: python -m benchmarks.bench_engine """
+
+import argparse
+import logging
+import os, random, tempfile, threading, time 
+
+from db.engine import EngineProfile
+from db.managers import DBManager
+import db.entities as ent
+
+
+def new_recipe(owner: int, index: int) -> ent.Recipe:
+    recipe = ent.Recipe(name = f"recipe {index}", owner = owner)
+    recipe.add_ingredient_list([f"ingredient {random.randrange(500)}" for _ in range(10)])
+    recipe.visibility = True
+    return recipe
+
+def run(profile_name: str, profile: EngineProfile, num_readers: int, num_recipes: int, duration: float):
+    with tempfile.TemporaryDirectory() as folder:
+        db_manager = DBManager(os.path.join(folder, "bench.db"), engine_profile = profile)
+        reads, writes, p95 = measure(db_manager, num_readers, num_recipes, duration)
+
+    print(
+        f"{profile_name:>8}: {reads / duration:8.1f} reads/s  "
+        f"{writes / duration:8.1f} writes/s  p95 read {p95:6.2f} ms")
+
+def measure(db_manager: DBManager, num_readers: int, num_recipes: int, duration: float) -> tuple:
+    """ Return number of reads, number of writes and 95th percentile of the read latency (ms) """
+
+    for index in range(num_recipes):
+        db_manager.add_recipe(new_recipe(1, index))
+
+    stop = threading.Event()
+    reads, writes, latencies = [0] * num_readers, [0], list() 
+
+    def reader(n: int):
+        while not stop.is_set():
+            start = time.perf_counter()
+            db_manager.get_recipes_by_ids(random.sample(range(1, num_recipes + 1), 10))
+            latencies.append(time.perf_counter() - start)
+            reads[n] += 1
+
+    def writer():
+        index = num_recipes
+        while not stop.is_set():
+            db_manager.add_recipe(new_recipe(2, index))
+            index += 1
+            writes[0] += 1
+
+    threads = [threading.Thread(target = reader, args = (n,)) for n in range(num_readers)]
+    threads.append(threading.Thread(target = writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float("nan")
+    return sum(reads), writes[0], p95
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--recipes", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for name, profile in (
+            ("default", EngineProfile.default()), 
+            ("wal", EngineProfile.wal(pool_size = args.readers + 1))):
+        run(name, profile, args.readers, args.recipes, args.duration)
@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Cost of rendering the messages and keyboards of the bot: the recipe page shown at each
+page flip (text and keyboard) and a few constant statements, with the templates and keyboards
+built at import and with the previous approach, which emojized texts and built keyboards on every call.
+
+Run from the src folder: python -m benchmarks.bench_render """
+
+import argparse
+import time
+import warnings
+
+from emoji import emojize
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+warnings.filterwarnings("ignore")
+import db.entities as ent
+from callbacks import encode
+import keyboardz as kb
+from states import ChatState
+from statements import Statements as stm, RecipeInsertionStatements as ins_stm, RecipeVisualisationStatements as viz_stm
+
+
+RECIPE = ent.Recipe(name = "pasta e fagioli", owner = 1).add_ingredient_list(
+    ["pasta", "fagioli", "sedano", "carota", "cipolla", "olio", "sale"])
+
+
+def emojized_every_time(text: str) -> str:
+    return emojize(text, use_aliases = True)
+
+def keyboard_every_time(curr_index: int, max_index: int, payload: tuple) -> InlineKeyboardMarkup:
+    """ VizKB.render as it was: every button emojized and built on each render """
+
+    def render_buttons(keys: list, payload: tuple = ()) -> list:
+        return [
+            InlineKeyboardButton(text = emojize(text, use_aliases = True), callback_data = encode(cbd, *payload))
+            for text, cbd in keys]
+
+    prev, next_ = ("Prev", ChatState.VIEW_PREV), ("Next", ChatState.VIEW_NEXT)
+    moves = [prev, next_] if 0 < curr_index < max_index else [next_] if curr_index < max_index else [prev]
+    return InlineKeyboardMarkup([
+        render_buttons(moves, payload),
+        render_buttons([
+            ("Mostra ricetta", ChatState.VIEW_RECIPE_METHOD),
+            ("Mostra foto", ChatState.VIEW_RECIPE_PHOTOS),
+            ("Cancella", ChatState.DELETE_RECIPE)]),
+        render_buttons([("Indietro", ChatState.COME_BACK), ("Chiudi", ChatState.QUIT_VIZ)])])
+
+def page_every_time(index: int, payload: tuple):
+    ingredients = "\n• ".join(sorted(i.name.capitalize() for i in RECIPE.ingredients))
+    text = emojized_every_time(
+        f"<b>{RECIPE.name.capitalize()}</b>\n\nIngredienti:\n• {ingredients}\n\nRicetta {index + 1}/10")
+    return text, keyboard_every_time(index, 9, payload)
+
+def page_templates(index: int, payload: tuple):
+    return viz_stm.view_recipe_in_list(RECIPE, index + 1, 10), kb.VizKB(ChatState.VIEW_MINE).render(index, 9, payload)
+
+
+CASES = [
+    ("recipe page (search)",
+        lambda: page_every_time(4, ()),
+        lambda: page_templates(4, ())),
+    ("recipe page (browse)",
+        lambda: page_every_time(4, ("m", 123, 4, "225afa17")),
+        lambda: page_templates(4, ("m", 123, 4, "225afa17"))),
+    ("keep_going",
+        lambda: emojized_every_time("E ora che intenzioni hai di bello?"),
+        ins_stm.keep_going),
+    ("helper",
+        lambda: emojized_every_time(stm.HELPER),
+        stm.helper),
+    ("main_message",
+        lambda: emojized_every_time("Ciao, Bench!\nChe vuoi fare?"),
+        lambda: stm.main_message("Bench")),
+]
+
+
+def measure(function, rounds: int) -> float:
+    """ Mean µs per call of @function """
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("render benchmark")
+    parser.add_argument("--rounds", type = int, default = 20000, help = "renders per case")
+    args = parser.parse_args()
+
+    print(f"{'render':<24}{'every time µs':>15}{'templates µs':>15}{'speedup':>10}")
+    for name, before, after in CASES:
+        old, new = measure(before, args.rounds), measure(after, args.rounds)
+        print(f"{name:<24}{old:>15.2f}{new:>15.2f}{old / new:>9.1f}x")
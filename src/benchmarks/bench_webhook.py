@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Update-to-reply latency of the bot in webhook mode, without Telegram.
+The harness serves a fake Bot API, starts the bot in webhook mode pointing to it
+and POSTs synthetic /start updates from distinct chats: the latency of an update is the time
+between its POST and the first reply the bot sends to that chat.
+
+Run from the src folder: python -m benchmarks.bench_webhook
+To measure a bot started by hand, run it with --webhook --api-url http://127.0.0.1:<api port>
+and pass its webhook url with --bot-url. """
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os, socket, subprocess, sys, tempfile, threading, time
+from urllib.parse import parse_qsl
+from urllib.request import Request, urlopen
+
+
+TOKEN = "123456:BENCHMARK"
+FIRST_CHAT = 10**6
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """ Answers every Bot API method successfully, recording when the first reply to each chat arrives """
+
+    replies = dict()        # chat id -> time of the first reply
+    lock = threading.Lock()
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8", "replace")
+
+        try:
+            params = json.loads(body) if body else dict()
+        except ValueError:
+            params = dict(parse_qsl(body))
+
+        if (chat_id := params.get("chat_id")) is not None:
+            with self.lock:
+                self.replies.setdefault(int(chat_id), time.perf_counter())
+
+        self.__answer(self.__result(method, params))
+
+    do_GET = do_POST
+
+    def __answer(self, result):
+        payload = json.dumps(dict(ok = True, result = result)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @staticmethod
+    def __result(method: str, params: dict):
+        if method == "getMe":
+            return dict(id = 1, is_bot = True, first_name = "Bench", username = "bench_bot")
+        if method.startswith("send") or method == "editMessageText":
+            return dict(
+                message_id = int(time.time() * 1000) % 2**31,
+                date = int(time.time()),
+                chat = dict(id = int(params.get("chat_id", 0)), type = "private"),
+                text = params.get("text", ""))
+        return True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def synthetic_update(index: int) -> bytes:
+    chat = dict(id = FIRST_CHAT + index, type = "private", first_name = "Bench")
+    return json.dumps(dict(
+        update_id = index + 1,
+        message = dict(
+            message_id = index + 1,
+            date = int(time.time()),
+            chat = chat,
+            text = "/start",
+            entities = [dict(type = "bot_command", offset = 0, length = 6)],
+            **{"from": dict(id = chat["id"], is_bot = False, first_name = "Bench")}))).encode("utf-8")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f"Nothing is listening on port {port}")
+
+def post_update(bot_url: str, index: int, timeout: float) -> float:
+    """ POST the @index-th update and return its update-to-reply latency in ms, None if no reply came """
+
+    chat_id, start = FIRST_CHAT + index, time.perf_counter()
+    request = Request(bot_url, data = synthetic_update(index), headers = {"Content-Type": "application/json"})
+    urlopen(request, timeout = timeout).read()
+
+    while time.perf_counter() - start < timeout:
+        if (replied := FakeBotAPI.replies.get(chat_id)) is not None:
+            return (replied - start) * 1000
+        time.sleep(0.001)
+
+def run(bot_url: str, num_updates: int, concurrency: int, timeout: float):
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        latencies = list(executor.map(lambda index: post_update(bot_url, index, timeout), range(num_updates)))
+
+    elapsed = time.perf_counter() - start
+    replied = sorted(latency for latency in latencies if latency is not None)
+
+    print(f"{len(replied)}/{num_updates} updates answered in {elapsed:.2f} s ({len(replied) / elapsed:.1f} updates/s)")
+    if replied:
+        print(
+            f"latency ms: mean {sum(replied) / len(replied):.2f}  p50 {replied[len(replied) // 2]:.2f}  "
+            f"p95 {replied[int(len(replied) * 0.95)]:.2f}  max {replied[-1]:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("webhook benchmark")
+    parser.add_argument("--updates", type = int, default = 500)
+    parser.add_argument("--concurrency", type = int, default = 8, help = "updates in flight at the same time")
+    parser.add_argument("--timeout", type = float, default = 10, help = "seconds to wait for a reply")
+    parser.add_argument("--api-port", type = int, default = None, help = "port of the fake Bot API")
+    parser.add_argument("--bot-url", type = str, default = None, help = "webhook url of a bot already running")
+    parser.add_argument("--workers", type = int, default = 4, help = "dispatcher workers of the spawned bot")
+    parser.add_argument("--global-rate", type = float, default = 0, 
+        help = "outbound rate limit of the spawned bot (default: disabled, to measure the bot alone)")
+    args = parser.parse_args()
+
+    api = ThreadingHTTPServer(("127.0.0.1", args.api_port or free_port()), FakeBotAPI)
+    threading.Thread(target = api.serve_forever, daemon = True).start()
+
+    if args.bot_url:
+        run(args.bot_url, args.updates, args.concurrency, args.timeout)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            webhook_port = free_port()
+            bot = subprocess.Popen([
+                sys.executable, "cringe.py",
+                "--token", TOKEN,
+                "--data", os.path.join(folder, "bench.db"),
+                "--workers", str(args.workers),
+                "--api-url", f"http://127.0.0.1:{api.server_address[1]}",
+                "--sweep-interval", "0",
+                "--global-rate", str(args.global_rate),
+                "--webhook", "--webhook-port", str(webhook_port), "--webhook-path", "bench"],
+                stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+            try:
+                wait_for(webhook_port)
+                run(f"http://127.0.0.1:{webhook_port}/bench", args.updates, args.concurrency, args.timeout)
+            finally:
+                bot.terminate()
+                bot.wait()
+
+    api.shutdown()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+from telegram import Update
+from telegram.ext import CallbackContext, Handler
+
+from states import ChatState
+
+
+#callback data is "<code>" or "<code>:<payload>:<payload>...", where the code stands for the ChatState
+SEPARATOR = ":"
+#Telegram limit on the length of callback data
+MAX_LENGTH = 64
+
+#the codes are carried by the buttons already sent to the chats: they must never change,
+#new states get a new code and the codes of removed states are not reused
+CODES = {
+    ChatState.NEW_RECIPE_REQUEST: "1",
+    ChatState.VIEW_RECIPES: "2",
+    ChatState.SEARCH_FOR_RECIPES: "3",
+    ChatState.INGREDIENTS: "4",
+    ChatState.RECIPE: "5",
+    ChatState.RECIPE_ACQUISITION: "6",
+    ChatState.SELECTING_NAME: "7",
+    ChatState.OBTAINING_DATA: "8",
+    ChatState.OBTAINING_PHOTO: "9",
+    ChatState.OBTAINING_RECIPE: "10",
+    ChatState.OBTAINING_INGREDIENTS: "11",
+    ChatState.SAVE_INGREDIENTS: "12",
+    ChatState.EDIT_INGREDIENTS: "13",
+    ChatState.DELETE_INGREDIENTS: "14",
+    ChatState.DELETE_RECIPE: "15",
+    ChatState.SAVE_RECIPE: "16",
+    ChatState.SAVE_RECIPE_METHOD: "17",
+    ChatState.DELETE_RECIPE_METHOD: "18",
+    ChatState.MISSING_INFO: "19",
+    ChatState.SAVE_DATA: "20",
+    ChatState.DELETE_DATA: "21",
+    ChatState.ASK_CONFIRM: "22",
+    ChatState.CONFIRM_YES: "23",
+    ChatState.DO_IT: "24",
+    ChatState.DONT_DO_IT: "25",
+    ChatState.SAVE_AS_PRIVATE: "26",
+    ChatState.SAVE_AS_PUBLIC: "27",
+    ChatState.INIT_VIZ: "28",
+    ChatState.VIEW_MINE: "29",
+    ChatState.VIEW_ALL: "30",
+    ChatState.VIEW_NEXT: "31",
+    ChatState.VIEW_PREV: "32",
+    ChatState.EDIT_RECIPE: "33",
+    ChatState.SAVE_BOOKMARK: "34",
+    ChatState.VIEW_RECIPE_METHOD: "35",
+    ChatState.VIEW_RECIPE_PHOTOS: "36",
+    ChatState.CONFIRM_DELETE_RECIPE: "37",
+    ChatState.WHICH_SEARCH: "38",
+    ChatState.SEARCH_BY_HASHTAG: "39",
+    ChatState.SEARCH_BY_INGREDIENT: "40",
+    ChatState.SEARCH_BY_NAME: "41",
+    ChatState.INPUT_TIME: "42",
+    ChatState.OK: "43",
+    ChatState.WAIT_CONFIRM: "44",
+    ChatState.STOPPING: "45",
+    ChatState.COME_BACK: "46",
+    ChatState.QUIT_VIZ: "47",
+    ChatState.QUIT_SEARCH: "48",
+    ChatState.SELECTING_ACTION: "49",
+    ChatState.SELECTING_LEVEL: "50",
+    ChatState.QUIT_CRINGETTE: "-1",
+}
+
+STATES = {code: state for state, code in CODES.items()}
+#buttons sent before the compact codes carry str(ChatState.X)
+STATES.update({str(state): state for state in ChatState})
+
+
+def encode(state: ChatState, *payload) -> str:
+    """ Return the callback data of a button leading to @state, carrying the (optional) @payload values """
+
+    data = SEPARATOR.join([CODES[state], *map(str, payload)])
+
+    if len(data) > MAX_LENGTH:
+        raise ValueError(f"Callback data longer than {MAX_LENGTH} bytes: {data}")
+    return data
+
+def decode(data: str) -> tuple:
+    """ Return the ChatState (None if unknown) and the list of payload values carried by the callback @data """
+
+    code, _, payload = data.partition(SEPARATOR)
+    return STATES.get(code), payload.split(SEPARATOR) if payload else list()
+
+def callback_state(update: Update) -> ChatState:
+    """ The ChatState of the button pressed by the user """
+    return decode(update.callback_query.data)[0]
+
+
+class CallbackRouter(Handler):
+    """ Handles the callback queries of the buttons leading to the states in @routes (ChatState -> callback),
+    finding the callback with a dict lookup instead of trying a regex handler at a time.
+    The payload of the button is passed to the callback as context.args. """
+
+    def __init__(self, routes: dict):
+        super().__init__(self.__unrouted)
+        self.__routes = dict(routes)
+
+    @property
+    def routes(self) -> dict:
+        return self.__routes
+
+    def check_update(self, update: object):
+        if isinstance(update, Update) and update.callback_query and update.callback_query.data:
+            state, payload = decode(update.callback_query.data)
+
+            if (callback := self.__routes.get(state)) is not None:
+                return callback, payload
+
+    def collect_additional_context(self, context: CallbackContext, update: Update, dispatcher, check_result):
+        context.args = check_result[1]
+
+    def handle_update(self, update: Update, dispatcher, check_result, context: CallbackContext = None):
+        self.collect_additional_context(context, update, dispatcher, check_result)
+        return check_result[0](update, context)
+
+    @staticmethod
+    def __unrouted(update: Update, context: CallbackContext):
+        raise RuntimeError("CallbackRouter callbacks are looked up in its routes")
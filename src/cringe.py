@@ -2,22 +2,31 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
 import logging
+import os
 import sys  
 
 from telegram import Update, ParseMode
 from telegram.ext import (
-    Updater,
     CommandHandler,
     MessageHandler,
     Filters,
     ConversationHandler,
     CallbackContext,
-    CallbackQueryHandler, 
     Defaults
 )
 
 from db.managers import DBManager, PersistencyManager
+from dispatching import build_updater
+from callbacks import CallbackRouter
+from outbox import outbox, track_bottom
+from persistence import SessionPersistence
+from throttling import Throttler
+from db.engine import EngineProfile
+from db.photos import PhotoDownloader, PhotoProcessor
+from db.sweeper import OrphanSweeper
+from db.backups import latest_snapshot, restore_snapshot
 import insert as ins, view, search
 
 import keyboardz as kb 
@@ -67,10 +76,10 @@ def new_conversation(update: Update, context: CallbackContext) -> ChatState:
 #stop nested conversation 
 def stop_nested(update: Update, context: CallbackContext) -> None:
     """Completely end conversation from within nested conversation."""
-    context.bot.edit_message_reply_markup(
-        chat_id = context.user_data[de.CHAT_ID], 
-        message_id = context.user_data[de.LAST].message_id)
-    update.message.reply_text('Okay, bye.')
+    box = outbox(context)
+    box.strip_keyboard()
+    box.send(text = 'Okay, bye.')
+    box.flush()
 
     context.user_data.clear() 
 
@@ -79,13 +88,10 @@ def stop_nested(update: Update, context: CallbackContext) -> None:
 #stop conversation 
 def stop(update: Update, context: CallbackContext):
     """End Conversation by command."""
-    context.bot.edit_message_reply_markup(
-        chat_id = context.user_data[de.CHAT_ID],
-        message_id = context.user_data[de.LAST].message_id)
-    context.bot.send_message(
-        text = "Okay, bye a fairy codday.", 
-        chat_id = context.user_data[de.CHAT_ID]
-    )
+    box = outbox(context)
+    box.strip_keyboard()
+    box.send(text = "Okay, bye a fairy codday.")
+    box.flush()
 
     #clear session
     context.user_data.clear() 
@@ -115,25 +121,9 @@ def helper(update: Update, context: CallbackContext) -> ChatState:
     return ChatState.SELECTING_ACTION
 
 
-def r(state: ChatState = None, states: list = None):
-    if state:
-        return f"^{str(state)}$"
-    elif states:
-        strings = "|".join([str(state) for state in states])
-        return f"^{strings}$"
-    else:
-        raise RuntimeError("Cannot use r function without arguments")
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser("LE CRINGETTE BOT")
-    parser.add_argument("--token", action="store", type=str, required=True)
-    parser.add_argument("--data", action="store", type=str, default="./my_recipes.db")
-    args = parser.parse_args()
-
-    defaults = Defaults(parse_mode=ParseMode.HTML)
-    updater = Updater(args.token, use_context=True, defaults = defaults)
-    dispatcher = updater.dispatcher
+def build_conversation(persistent: bool = False) -> ConversationHandler:
+    """ Build the conversation handler of the bot, with its nested conversations. 
+    @persistent conversations are saved by the persistence of the dispatcher """
 
     command_new_recipe = CommandHandler("nuova", ins.request_recipe_name)
     command_view_recipes = CommandHandler("view", view.init_visualization)
@@ -142,18 +132,21 @@ if __name__ == "__main__":
 
     #ingredient acquisition
     ingredient_conv = ConversationHandler(
+        name = "ingredient_conv", persistent = persistent, 
         entry_points = [
-            CallbackQueryHandler(ins.add_ingredient, pattern = r(ChatState.INGREDIENTS)),
+            CallbackRouter({ChatState.INGREDIENTS: ins.add_ingredient}),
         ], 
         states = {
             ChatState.SELECTING_ACTION: [
                 #process text messages  (ingredients)
                 MessageHandler(Filters.text & ~Filters.command, ins.save_input),
-                #entrypoint ingredient list request 
-                CallbackQueryHandler(ins.add_ingredient, pattern = r(ChatState.OBTAINING_DATA)),
-                #ingredient list memorization 
-                CallbackQueryHandler(ins.save_ingredients, pattern = r(ChatState.SAVE_INGREDIENTS)),
-                CallbackQueryHandler(ins.discard_ingredients, pattern = r(ChatState.DELETE_INGREDIENTS))
+                CallbackRouter({
+                    #entrypoint ingredient list request 
+                    ChatState.OBTAINING_DATA: ins.add_ingredient, 
+                    #ingredient list memorization 
+                    ChatState.SAVE_INGREDIENTS: ins.save_ingredients, 
+                    ChatState.DELETE_INGREDIENTS: ins.discard_ingredients
+                })
             ]
         }, 
         fallbacks = [], 
@@ -163,8 +156,9 @@ if __name__ == "__main__":
     )
     #recipe method & photos acquisition 
     recipe_conv = ConversationHandler(
+        name = "recipe_conv", persistent = persistent, 
         entry_points = [
-            CallbackQueryHandler(ins.add_recipe_method, pattern = r(ChatState.OBTAINING_RECIPE))
+            CallbackRouter({ChatState.OBTAINING_RECIPE: ins.add_recipe_method})
         ], 
         states = {
             ChatState.SELECTING_ACTION: [
@@ -172,8 +166,10 @@ if __name__ == "__main__":
                 MessageHandler(Filters.text & ~Filters.command, ins.save_input),
                 MessageHandler(Filters.photo, ins.add_photo), 
 
-                CallbackQueryHandler(ins.save_recipe_method, pattern = r(ChatState.SAVE_RECIPE_METHOD)), 
-                CallbackQueryHandler(ins.discard_recipe_method, pattern = r(ChatState.DELETE_RECIPE_METHOD))
+                CallbackRouter({
+                    ChatState.SAVE_RECIPE_METHOD: ins.save_recipe_method, 
+                    ChatState.DELETE_RECIPE_METHOD: ins.discard_recipe_method
+                })
             ]
         }, 
         fallbacks = [], 
@@ -183,33 +179,42 @@ if __name__ == "__main__":
     )
     #recipe acquisition 
     new_recipe_conv = ConversationHandler(
+        name = "new_recipe_conv", persistent = persistent, 
         entry_points = [
-            CallbackQueryHandler(ins.request_recipe_name, pattern=r(ChatState.NEW_RECIPE_REQUEST))
+            CallbackRouter({ChatState.NEW_RECIPE_REQUEST: ins.request_recipe_name})
         ], 
         states = { 
             ChatState.SELECTING_ACTION: [
                 ingredient_conv, 
                 recipe_conv, 
                 
-                CallbackQueryHandler(ins.cancel_recipe, pattern = r(ChatState.DELETE_RECIPE)),
-                CallbackQueryHandler(ins.save_recipe, pattern = r(ChatState.SAVE_RECIPE))
+                CallbackRouter({
+                    ChatState.DELETE_RECIPE: ins.cancel_recipe, 
+                    ChatState.SAVE_RECIPE: ins.save_recipe
+                })
             ],
             ChatState.SELECTING_NAME: [
                 #cattura nome ricetta e la inizializza
                 MessageHandler(Filters.text & ~Filters.command, ins.init_new_recipe), 
                 #annulla inserimento ricetta e torna al menù precedente 
-                CallbackQueryHandler(ins.cancel_recipe, pattern = r(ChatState.DELETE_RECIPE))
+                CallbackRouter({ChatState.DELETE_RECIPE: ins.cancel_recipe})
             ], 
             ChatState.ASK_CONFIRM: [
-                CallbackQueryHandler(ins.confirm_operation, pattern = r(states=[
-                    ChatState.SAVE_AS_PUBLIC, ChatState.SAVE_AS_PRIVATE,    #save recipe in db as public / private 
-                    ChatState.DO_IT])),                                     #confirm recipe cancelation
-                CallbackQueryHandler(ins.abort_operation, pattern = r(ChatState.DONT_DO_IT)),
+                CallbackRouter({
+                    #save recipe in db as public / private 
+                    ChatState.SAVE_AS_PUBLIC: ins.confirm_operation, 
+                    ChatState.SAVE_AS_PRIVATE: ins.confirm_operation, 
+                    #confirm recipe cancelation
+                    ChatState.DO_IT: ins.confirm_operation, 
+                    ChatState.DONT_DO_IT: ins.abort_operation
+                })
             ], 
             ChatState.MISSING_INFO: [
                 MessageHandler(Filters.text & ~Filters.command, ins.save_input), 
-                CallbackQueryHandler(ins.save_missing_data, pattern = r(ChatState.SAVE_DATA)),
-                CallbackQueryHandler(ins.discard_missing_data, pattern = r(ChatState.DELETE_DATA))   
+                CallbackRouter({
+                    ChatState.SAVE_DATA: ins.save_missing_data, 
+                    ChatState.DELETE_DATA: ins.discard_missing_data
+                })
             ]
         }, 
         fallbacks = [
@@ -221,48 +226,52 @@ if __name__ == "__main__":
         }
     )
 
-    view_actions = [
+    view_actions = {
         #go to prev / next recipe 
-        CallbackQueryHandler(view.prev_next, pattern = r(states = [
-            ChatState.VIEW_PREV, ChatState.VIEW_NEXT
-        ])),
+        ChatState.VIEW_PREV: view.prev_next, 
+        ChatState.VIEW_NEXT: view.prev_next, 
         #edit current recipe 
-        CallbackQueryHandler(view.edit, pattern = r(ChatState.EDIT_RECIPE)), 
+        ChatState.EDIT_RECIPE: view.edit, 
         #delete current recipe from db 
-        CallbackQueryHandler(view.delete, pattern = r(ChatState.DELETE_RECIPE)), 
+        ChatState.DELETE_RECIPE: view.delete, 
         #save current recipe in user's bookmarks 
-        CallbackQueryHandler(view.bookmark, pattern = r(ChatState.SAVE_BOOKMARK)), 
+        ChatState.SAVE_BOOKMARK: view.bookmark, 
         #send message containing the current recipe procedure
-        CallbackQueryHandler(view.visualize_recipe_method, pattern = r(ChatState.VIEW_RECIPE_METHOD)),
+        ChatState.VIEW_RECIPE_METHOD: view.visualize_recipe_method, 
         #send an album containing the photos about the current recipe 
-        CallbackQueryHandler(view.visualize_recipe_photos, pattern = r(ChatState.VIEW_RECIPE_PHOTOS)),
+        ChatState.VIEW_RECIPE_PHOTOS: view.visualize_recipe_photos, 
         #quit visualization 
-        CallbackQueryHandler(view.come_back, pattern = r(ChatState.QUIT_VIZ)), 
-    ]
+        ChatState.QUIT_VIZ: view.come_back, 
+    }
 
     view_recipes_conv = ConversationHandler(
+        name = "view_recipes_conv", persistent = persistent, 
         entry_points = [
-            CallbackQueryHandler(view.init_visualization, pattern = r(ChatState.VIEW_RECIPES))
+            CallbackRouter({ChatState.VIEW_RECIPES: view.init_visualization})
         ], 
         states = {
             ChatState.INIT_VIZ : [
-                CallbackQueryHandler(view.come_back, pattern = r(ChatState.COME_BACK)), 
-                CallbackQueryHandler(view.init_view_recipes, pattern = r(states = [
-                    ChatState.VIEW_ALL, ChatState.VIEW_MINE
-                ]))
+                CallbackRouter({
+                    ChatState.COME_BACK: view.come_back, 
+                    ChatState.VIEW_ALL: view.init_view_recipes, 
+                    ChatState.VIEW_MINE: view.init_view_recipes
+                })
             ],
             ChatState.SELECTING_ACTION: [
-                *view_actions,
-                #back to all / mine recipes menu 
-                CallbackQueryHandler(view.init_visualization, pattern = r(ChatState.COME_BACK)), 
+                CallbackRouter({
+                    **view_actions,
+                    #back to all / mine recipes menu 
+                    ChatState.COME_BACK: view.init_visualization
+                })
             ], 
             ChatState.CONFIRM_DELETE_RECIPE: [
-                CallbackQueryHandler(view.perform_delete_operation, pattern = r(states=[
-                    ChatState.DO_IT, ChatState.DONT_DO_IT
-                ]))
+                CallbackRouter({
+                    ChatState.DO_IT: view.perform_delete_operation, 
+                    ChatState.DONT_DO_IT: view.perform_delete_operation
+                })
             ], 
             ChatState.WAIT_CONFIRM: [
-                CallbackQueryHandler(view.back2visualization, pattern = r(ChatState.OK))
+                CallbackRouter({ChatState.OK: view.back2visualization})
             ]
         }, 
         fallbacks = [
@@ -274,35 +283,46 @@ if __name__ == "__main__":
         }
     )
    
-    search_recipes_conv = ConversationHandler(entry_points = [
-            CallbackQueryHandler(search.welcome, pattern = r(ChatState.SEARCH_FOR_RECIPES))
+    search_recipes_conv = ConversationHandler(
+        name = "search_recipes_conv", persistent = persistent, 
+        entry_points = [
+            CallbackRouter({ChatState.SEARCH_FOR_RECIPES: search.welcome})
         ],
         states = {
             ChatState.WHICH_SEARCH: [
-                CallbackQueryHandler(search.init_search, pattern = r(states=[
-                    ChatState.SEARCH_BY_INGREDIENT, ChatState.SEARCH_BY_HASHTAG])), 
-                #back to main menu  
-                CallbackQueryHandler(search.quit, pattern = r(ChatState.QUIT_SEARCH)) 
+                CallbackRouter({
+                    ChatState.SEARCH_BY_NAME: search.init_search, 
+                    ChatState.SEARCH_BY_INGREDIENT: search.init_search, 
+                    ChatState.SEARCH_BY_HASHTAG: search.init_search, 
+                    #back to main menu  
+                    ChatState.QUIT_SEARCH: search.quit
+                })
             ], 
             ChatState.INPUT_TIME: [
                 MessageHandler(Filters.text & ~Filters.command, search.save_input),
-                CallbackQueryHandler(search.do_search, pattern = r(ChatState.SAVE_DATA)), 
-                CallbackQueryHandler(search.indecisive_search, pattern = r(ChatState.DELETE_DATA))
+                CallbackRouter({
+                    ChatState.SAVE_DATA: search.do_search, 
+                    ChatState.DELETE_DATA: search.indecisive_search
+                })
             ], 
             ChatState.WAIT_CONFIRM: [
-                #start search with given tokens 
-                CallbackQueryHandler(search.perform_search, pattern = r(ChatState.DO_IT)), 
-                #go back and insert new tokens
-                CallbackQueryHandler(search.init_search, pattern = r(ChatState.DONT_DO_IT)), 
-                #return to recipe visualization when user has terminated to visualize photos 
-                CallbackQueryHandler(view.back2visualization, pattern = r(ChatState.OK)), 
-                #
-                CallbackQueryHandler(search.quit, pattern = r(ChatState.QUIT_SEARCH))
+                CallbackRouter({
+                    #start search with given tokens 
+                    ChatState.DO_IT: search.perform_search, 
+                    #go back and insert new tokens
+                    ChatState.DONT_DO_IT: search.init_search, 
+                    #return to recipe visualization when user has terminated to visualize photos 
+                    ChatState.OK: view.back2visualization, 
+                    #
+                    ChatState.QUIT_SEARCH: search.quit
+                })
             ], 
             ChatState.SELECTING_ACTION: [
-                *view_actions,
-                CallbackQueryHandler(search.indecisive_search, pattern = r(ChatState.COME_BACK)), 
-                CallbackQueryHandler(search.quit, pattern = r(ChatState.QUIT_SEARCH)) 
+                CallbackRouter({
+                    **view_actions,
+                    ChatState.COME_BACK: search.indecisive_search, 
+                    ChatState.QUIT_SEARCH: search.quit
+                })
             ]
         },
         fallbacks = [
@@ -318,10 +338,11 @@ if __name__ == "__main__":
         new_recipe_conv, 
         view_recipes_conv,
         search_recipes_conv,
-        CallbackQueryHandler(stop, pattern = r(ChatState.QUIT_CRINGETTE))
+        CallbackRouter({ChatState.QUIT_CRINGETTE: stop})
     ]
 
     conv_handler = ConversationHandler(
+        name = "conv_handler", persistent = persistent, 
         entry_points = [
             CommandHandler('start', start), 
             MessageHandler(Filters.text & ~Filters.command, new_conversation)
@@ -335,16 +356,197 @@ if __name__ == "__main__":
         ]
     )
 
+    return conv_handler
+
+def export_recipes(args):
+    """ Write all the recipes of the db to a JSONL file, one recipe per line """
+
+    db_manager = DBManager(db_name=args.data)
+    output = sys.stdout if args.file == "-" else open(args.file, "w", encoding="utf-8")
+    num_recipes = 0
+
+    with output:
+        for num_recipes, recipe in enumerate(db_manager.export_recipes(batch_size=args.batch_size), 1):
+            output.write(json.dumps(recipe, ensure_ascii=False))
+            output.write("\n")
+
+    logger.info(f"{num_recipes} recipes exported")
+
+def import_recipes(args):
+    """ Load in the db the recipes of a JSONL file written by export_recipes """
+
+    db_manager = DBManager(db_name=args.data)
+    
+    with (sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")) as fi:
+        imported, skipped = db_manager.import_recipes(
+            (json.loads(line) for line in fi if line.strip()), batch_size=args.batch_size)
+
+    logger.info(f"{imported} recipes imported, {skipped} already present")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("LE CRINGETTE BOT")
+    parser.add_argument("--token", action="store", type=str)
+    parser.add_argument("--data", action="store", type=str, default="./my_recipes.db")
+    parser.add_argument("--api-url", action="store", type=str, default=None, 
+        help="base url of the Bot API server (default: Telegram's one)")
+    #webhook serving 
+    parser.add_argument("--webhook", action="store_true", 
+        help="receive updates through a webhook instead of long polling")
+    parser.add_argument("--webhook-listen", action="store", type=str, default="127.0.0.1", 
+        help="address the webhook server listens on")
+    parser.add_argument("--webhook-port", action="store", type=int, default=8443, help="port of the webhook server")
+    parser.add_argument("--webhook-path", action="store", type=str, default=None, 
+        help="url path of the webhook (default: the bot token)")
+    parser.add_argument("--webhook-url", action="store", type=str, default=None, 
+        help="public base url Telegram sends updates to, e.g. https://example.org:8443 "
+            "(required, unless a local Bot API server given with --api-url reaches the webhook server directly)")
+    parser.add_argument("--webhook-cert", action="store", type=str, default=None, help="TLS certificate (PEM)")
+    parser.add_argument("--webhook-key", action="store", type=str, default=None, help="TLS private key (PEM)")
+    parser.add_argument("--workers", action="store", type=int, default=4, 
+        help="number of dispatcher worker threads")
+    parser.add_argument("--chat-workers", action="store", type=int, default=8, 
+        help="number of threads handling the updates of different chats in parallel")
+    parser.add_argument("--photo-workers", action="store", type=int, default=4, 
+        help="number of threads downloading photos in background")
+    parser.add_argument("--photo-processes", action="store", type=int, default=2, 
+        help="number of processes resizing the downloaded photos")
+    #database tuning 
+    parser.add_argument("--db-profile", action="store", type=str, choices=["default", "wal"], default="wal", 
+        help="SQLite engine profile: 'default' keeps SQLite defaults, 'wal' lets readers run alongside writers")
+    parser.add_argument("--db-pool-size", action="store", type=int, default=None, 
+        help="connection pool size (wal profile only, default: workers + chat workers + 1)")
+    parser.add_argument("--db-mmap-size", action="store", type=int, default=256, help="memory-mapped I/O in MiB (wal profile only)")
+    parser.add_argument("--db-cache-size", action="store", type=int, default=64, help="page cache in MiB per connection (wal profile only)")
+    #orphan files cleanup 
+    parser.add_argument("--sweep-interval", action="store", type=float, default=60, 
+        help="seconds between two steps of the orphan files sweeper (0 disables it)")
+    parser.add_argument("--sweep-budget", action="store", type=float, default=0.05, 
+        help="seconds a single step of the orphan files sweeper can run")
+    #outbound rate limits 
+    parser.add_argument("--global-rate", action="store", type=float, default=30, 
+        help="messages per second the bot can send overall (0 disables rate limiting)")
+    parser.add_argument("--chat-rate", action="store", type=float, default=1, 
+        help="messages per second the bot can send to a single chat")
+    parser.add_argument("--chat-burst", action="store", type=float, default=5, 
+        help="messages the bot can send to a single chat at once, before --chat-rate applies")
+    #sessions 
+    parser.add_argument("--sessions", action="store", type=str, default=None, 
+        help="file where conversations are saved to survive a restart (default: next to --data)")
+    parser.add_argument("--session-flush-interval", action="store", type=float, default=10, 
+        help="seconds between two writes of the changed conversations (0 disables saving them)")
+    #backups 
+    parser.add_argument("--backup-dir", action="store", type=str, default=None, 
+        help="folder where to save periodic online backups (disabled if not given)")
+    parser.add_argument("--backup-interval", action="store", type=float, default=24, 
+        help="hours between two backups")
+    parser.add_argument("--backup-keep", action="store", type=int, default=7, 
+        help="number of snapshots to keep, older ones are pruned (0 keeps them all). "
+            "Do not delete snapshots by hand: newer ones reference their files")
+    parser.add_argument("--restore", action="store", type=str, default=None, metavar="SNAPSHOT", 
+        help="restore --data from a backup snapshot (or from the latest one in a backup folder) and exit")
+    #catalogue export/import 
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND", 
+        help="run a maintenance command on --data instead of starting the bot")
+    for command, description, handler in (
+            ("export", "stream all the recipes to a JSONL file", export_recipes), 
+            ("import", "bulk load the recipes of a JSONL file", import_recipes)):
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument("file", help="JSONL file, - for standard input/output")
+        subparser.add_argument("--batch-size", action="store", type=int, default=1000, 
+            help="recipes loaded per query (export) or inserted per transaction (import)")
+        subparser.set_defaults(handler=handler)
+    args = parser.parse_args()
+
+    if args.webhook and not args.webhook_url and not args.api_url:
+        parser.error("--webhook needs the public --webhook-url Telegram has to send the updates to")
+
+    if args.restore:
+        restore_snapshot(latest_snapshot(args.restore) or args.restore, args.data)
+        sys.exit(0)
+    elif args.command:
+        args.handler(args)
+        sys.exit(0)
+    elif not args.token:
+        parser.error("the following arguments are required: --token")
+
+    defaults = Defaults(parse_mode=ParseMode.HTML)
+    persistence = None if args.session_flush_interval <= 0 else SessionPersistence(
+        args.sessions or f"{os.path.splitext(args.data)[0]}.sessions.db")
+    updater = build_updater(
+        args.token, workers = args.workers, chat_workers = args.chat_workers, 
+        defaults = defaults, persistence = persistence, 
+        #the photo downloaders share the bot
+        extra_threads = args.photo_workers, 
+        throttler = Throttler(
+            global_rate = args.global_rate, global_burst = args.global_rate, 
+            chat_rate = args.chat_rate, chat_burst = args.chat_burst) if args.global_rate > 0 else None, 
+        base_url = f"{args.api_url.rstrip('/')}/bot" if args.api_url else None, 
+        base_file_url = f"{args.api_url.rstrip('/')}/file/bot" if args.api_url else None)
+    dispatcher = updater.dispatcher
+
+    conv_handler = build_conversation(persistent = persistence is not None)
+
+    #before the conversations: the outbox needs to know which message is at the bottom of the chat
+    dispatcher.add_handler(MessageHandler(Filters.all, track_bottom), group = -1)
     dispatcher.add_handler(conv_handler)
     dispatcher.add_error_handler(error)
 
-    db_manager = DBManager(db_name=args.data) 
-    dispatcher.bot_data[de.MANAGER] = PersistencyManager(db_manager)
+    engine_profile = EngineProfile.default() if args.db_profile == "default" else EngineProfile.wal(
+        pool_size = args.db_pool_size or args.workers + args.chat_workers + 1, 
+        mmap_mb = args.db_mmap_size, 
+        cache_mb = args.db_cache_size)
+    db_manager = DBManager(db_name=args.data, engine_profile=engine_profile) 
+    photo_downloader = PhotoDownloader(updater.bot, max_workers = args.photo_workers)
+    photo_processor = PhotoProcessor(max_workers = args.photo_processes)
+    dispatcher.bot_data[de.MANAGER] = PersistencyManager(db_manager, photo_downloader, photo_processor)
+
+    if args.sweep_interval > 0:
+        updater.job_queue.run_repeating(
+            OrphanSweeper(dispatcher.bot_data[de.MANAGER], time_budget = args.sweep_budget), 
+            interval = args.sweep_interval, 
+            first = args.sweep_interval, 
+            name = "orphan-sweeper")
+
+    if persistence is not None:
+        updater.job_queue.run_repeating(
+            lambda context: persistence.flush(), 
+            interval = args.session_flush_interval, 
+            name = "session-flush")
+
+    if args.backup_dir:
+        updater.job_queue.run_repeating(
+            lambda context: dispatcher.bot_data[de.MANAGER].backup(args.backup_dir, keep = args.backup_keep), 
+            interval = args.backup_interval * 3600, 
+            first = 60, 
+            name = "backup")
 
     # Start the Bot
-    updater.start_polling()
+    if args.webhook:
+        webhook_path = (args.webhook_path or args.token).strip("/")
+        #without a public url, the local Bot API server sends the updates straight to the webhook server
+        webhook_url = (
+            args.webhook_url.rstrip("/") if args.webhook_url else 
+            f"{'https' if args.webhook_cert else 'http'}://{args.webhook_listen}:{args.webhook_port}")
+        updater.start_webhook(
+            listen = args.webhook_listen, 
+            port = args.webhook_port, 
+            url_path = webhook_path, 
+            cert = args.webhook_cert, 
+            key = args.webhook_key, 
+            webhook_url = f"{webhook_url}/{webhook_path}")
+        #the default path is the token: never write it in the logs
+        logger.info(
+            f"Webhook server listening on {args.webhook_listen}:{args.webhook_port}/"
+            f"{'<token>' if webhook_path == args.token.strip('/') else webhook_path}")
+    else:
+        updater.start_polling()
 
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
     # SIGTERM or SIGABRT. This should be used most of the time, since
-    # start_polling() is non-blocking and will stop the bot gracefully.
-    updater.idle()
\ No newline at end of file
+    # start_polling() and start_webhook() are non-blocking and will stop the bot gracefully.
+    updater.idle()
+    if persistence is not None:
+        persistence.flush()
+    photo_downloader.shutdown()
+    photo_processor.shutdown()
\ No newline at end of file
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+
+#a snapshot is a folder <destination>/<timestamp> holding:
+#(snapshots reference the files held by the older ones: delete them with prune_snapshots, not by hand)
+DATABASE = "recipes.db"         #online copy of the db
+FILES = "files"                 #files added or changed since the previous snapshot
+MANIFEST = "manifest.json"      #every file of the snapshot -> (size, mtime, sha256, snapshot holding its copy)
+
+#folders not worth saving, relative to the base folder
+EXCLUDED = (os.path.join("img", "tmp"),)
+
+
+def backup_database(db_name: str, destination: str, pages: int = 256, sleep: float = 0.05):
+    """ Copy the SQLite database @db_name to @destination while it is in use,
+    @pages pages at a time, sleeping @sleep seconds between two steps so that writers are not blocked """
+
+    source, target = sqlite3.connect(db_name), sqlite3.connect(destination)
+
+    try:
+        source.backup(target, pages = pages, sleep = sleep)
+    finally:
+        target.close()
+        source.close()
+
+def check_database(db_name: str):
+    """ Raise RuntimeError if the SQLite database @db_name is corrupted """
+
+    connection = sqlite3.connect(f"file:{db_name}?mode=ro", uri = True)
+
+    try:
+        if (result := [row[0] for row in connection.execute("PRAGMA integrity_check")]) != ["ok"]:
+            raise RuntimeError(f"Integrity check of {db_name} failed: {'; '.join(result)}")
+    finally:
+        connection.close()
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as fi:
+        for chunk in iter(lambda: fi.read(2**16), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def latest_snapshot(destination: str) -> str:
+    """ Return the path of the most recent complete snapshot in @destination, None if there is none """
+
+    if (snapshots := _snapshots(destination)):
+        return os.path.join(destination, snapshots[-1])
+
+def prune_snapshots(destination: str, keep: int) -> list:
+    """ Delete the oldest snapshots in @destination, keeping the @keep most recent ones.
+    The file copies held by a deleted snapshot and still referenced by the kept ones are first moved
+    to the oldest kept snapshot referencing them, so every kept snapshot can still be verified and restored.
+    Incomplete snapshots older than the kept ones are deleted as well. Returns the paths of the deleted snapshots. """
+
+    if keep <= 0 or len(snapshots := _snapshots(destination)) <= keep:
+        return list()
+
+    kept = snapshots[-keep:]
+    doomed = sorted(
+        name for name in os.listdir(destination) 
+            if name < kept[0] and os.path.isdir(os.path.join(destination, name)))
+    manifests, changed = dict(), set()
+
+    for name in kept:
+        with open(os.path.join(destination, name, MANIFEST)) as fi:
+            manifests[name] = json.load(fi)
+
+    #oldest first: a copy is re-homed in the first kept snapshot referencing it
+    for name in kept:
+        for relpath, entry in manifests[name]["files"].items():
+            if (holder := entry[3]) not in doomed:
+                continue
+
+            _link_or_copy(
+                os.path.join(destination, holder, FILES, relpath), os.path.join(destination, name, FILES, relpath))
+
+            for other in kept:
+                if (other_entry := manifests[other]["files"].get(relpath)) and other_entry[3] == holder:
+                    other_entry[3] = name
+                    changed.add(other)
+
+    #the old snapshots are deleted only once every manifest points to the new copies
+    for name in changed:
+        _write_manifest(os.path.join(destination, name), manifests[name])
+
+    for name in doomed:
+        shutil.rmtree(os.path.join(destination, name))
+
+    logging.info(f"Deleted {len(doomed)} old snapshots from {destination}, {len(changed)} manifests updated")
+    return [os.path.join(destination, name) for name in doomed]
+
+def create_snapshot(db_name: str, folders: list, destination: str, pages: int = 256, sleep: float = 0.05) -> str:
+    """ Save in @destination a new snapshot of the database @db_name and of the files in @folders.
+    Only the files changed since the latest snapshot are copied, the others are referenced by the manifest.
+    Returns the path of the new snapshot. """
+
+    base_folder = os.path.dirname(os.path.abspath(db_name))
+    previous = latest_snapshot(destination)
+    previous_files = dict()
+
+    if previous:
+        with open(os.path.join(previous, MANIFEST)) as fi:
+            previous_files = json.load(fi)["files"]
+
+    #the manifest is written last: until then, the snapshot is not considered complete
+    name, snapshot = _new_snapshot(destination)
+
+    backup_database(db_name, os.path.join(snapshot, DATABASE), pages = pages, sleep = sleep)
+
+    files, copied = dict(), 0
+
+    for relpath, size, mtime in _walk(base_folder, folders):
+        old = previous_files.get(relpath)
+
+        if old and old[0] == size and old[1] == mtime:
+            files[relpath] = old
+            continue
+
+        try:
+            copy = os.path.join(snapshot, FILES, relpath)
+            os.makedirs(os.path.dirname(copy), exist_ok = True)
+            shutil.copy2(os.path.join(base_folder, relpath), copy)
+        except FileNotFoundError:
+            #deleted in the meantime
+            continue
+
+        files[relpath] = [size, mtime, file_digest(copy), name]
+        copied += 1
+
+    _write_manifest(snapshot, dict(
+        created = name,
+        database = file_digest(os.path.join(snapshot, DATABASE)),
+        files = files))
+
+    logging.info(f"Backup {snapshot} completed: {copied}/{len(files)} files copied")
+    return snapshot
+
+def verify_snapshot(snapshot: str) -> dict:
+    """ Check the integrity of @snapshot: its database and the copies of its files
+    have to match the checksums of the manifest. Returns the manifest, raises RuntimeError otherwise. """
+
+    destination = os.path.dirname(os.path.abspath(snapshot))
+
+    try:
+        with open(os.path.join(snapshot, MANIFEST)) as fi:
+            manifest = json.load(fi)
+    except FileNotFoundError:
+        raise RuntimeError(f"{snapshot} is not a complete snapshot")
+
+    if file_digest(database := os.path.join(snapshot, DATABASE)) != manifest["database"]:
+        raise RuntimeError(f"Checksum mismatch of {database}")
+
+    check_database(database)
+
+    for relpath, (_, _, checksum, holder) in manifest["files"].items():
+        copy = os.path.join(destination, holder, FILES, relpath)
+
+        if not os.path.exists(copy) or file_digest(copy) != checksum:
+            raise RuntimeError(f"Missing or corrupted copy of {relpath} in {holder}")
+
+    return manifest
+
+def restore_snapshot(snapshot: str, db_name: str):
+    """ Restore the database @db_name and the files next to it from @snapshot, after checking its integrity.
+    The bot must not be running. Files created after the snapshot are left to the orphan sweeper. """
+
+    manifest = verify_snapshot(snapshot)
+    destination = os.path.dirname(os.path.abspath(snapshot))
+    base_folder = os.path.dirname(os.path.abspath(db_name))
+
+    #going through the backup API keeps the WAL of the restored db consistent
+    backup_database(os.path.join(snapshot, DATABASE), db_name, pages = -1, sleep = 0)
+
+    for relpath, (_, _, _, holder) in manifest["files"].items():
+        os.makedirs(os.path.dirname(target := os.path.join(base_folder, relpath)), exist_ok = True)
+        shutil.copy2(os.path.join(destination, holder, FILES, relpath), target)
+
+    check_database(db_name)
+    logging.info(f"Restored {db_name} and {len(manifest['files'])} files from {snapshot}")
+
+def _snapshots(destination: str) -> list:
+    """ Names of the complete snapshots in @destination, from the oldest to the most recent """
+
+    if not os.path.isdir(destination):
+        return list()
+    return sorted(name for name in os.listdir(destination) if os.path.exists(os.path.join(destination, name, MANIFEST)))
+
+def _new_snapshot(destination: str) -> tuple:
+    """ Create the folder of a new snapshot in @destination, returning its name and path.
+    Snapshots taken in the same second get a sequence number, so that they sort in order of creation. """
+
+    os.makedirs(destination, exist_ok = True)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+
+    for sequence in itertools.count():
+        name = f"{timestamp}-{sequence:03d}" if sequence else timestamp
+        try:
+            os.mkdir(snapshot := os.path.join(destination, name))
+            return name, snapshot
+        except FileExistsError:
+            continue
+
+def _write_manifest(snapshot: str, manifest: dict):
+    """ Atomically replace the manifest of @snapshot """
+
+    with open(temporary := os.path.join(snapshot, f"{MANIFEST}.tmp"), "w") as fo:
+        json.dump(manifest, fo)
+    os.replace(temporary, os.path.join(snapshot, MANIFEST))
+
+def _link_or_copy(source: str, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok = True)
+    if os.path.exists(target):
+        os.remove(target)
+
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def _walk(base_folder: str, folders: list):
+    """ Yield the (path relative to @base_folder, size, modification time) of the files in @folders """
+
+    for folder in folders:
+        for root, dirs, filenames in os.walk(folder):
+            relroot = os.path.relpath(root, base_folder)
+            dirs[:] = [d for d in dirs if os.path.join(relroot, d) not in EXCLUDED]
+
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(root, filename))
+                except FileNotFoundError:
+                    continue
+                yield os.path.join(relroot, filename), stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """ Thread-safe dictionary holding at most @maxsize entries.
+    When full, the least recently used entry is evicted.
+    If @ttl is given, entries older than @ttl seconds are considered missing. """
+
+    __MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__data = OrderedDict()         # key -> (value, expiration time)
+        self.__loading = dict()             # key -> [version, loads in flight], bumped by pop and clear
+        self.__lock = threading.Lock()
+        self.__hits = self.__misses = 0
+
+    def get(self, key, default = None):
+        with self.__lock:
+            value = self.__lookup(key)
+
+            if value is self.__MISSING:
+                self.__misses += 1
+                return default
+
+            self.__hits += 1
+            return value
+
+    def get_or_load(self, key, loader):
+        """ Return the value cached for @key; on a miss, the value is computed calling @loader() and cached.
+        The value is not cached if @key is invalidated (pop, clear) while @loader runs, as it may be stale. """
+
+        with self.__lock:
+            if (value := self.__lookup(key)) is not self.__MISSING:
+                self.__hits += 1
+                return value
+
+            self.__misses += 1
+            loading = self.__loading.setdefault(key, [0, 0])
+            loading[1] += 1
+            version = loading[0]
+
+        fresh = False
+
+        try:
+            value = loader()
+            fresh = True
+        finally:
+            with self.__lock:
+                loading[1] -= 1
+                if not loading[1]:
+                    del self.__loading[key]
+                if fresh and loading[0] == version:
+                    self.__store(key, value)
+
+        return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__store(key, value)
+
+    def update(self, items: dict):
+        for key, value in items.items():
+            self.put(key, value)
+
+    def pop(self, key, default = None):
+        with self.__lock:
+            if (loading := self.__loading.get(key)) is not None:
+                loading[0] += 1
+            value, _ = self.__data.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self.__lock:
+            for loading in self.__loading.values():
+                loading[0] += 1
+            self.__data.clear()
+
+    @property
+    def stats(self) -> dict:
+        """ Number of hits, misses and cached entries """
+        return dict(hits = self.__hits, misses = self.__misses, size = len(self.__data))
+
+    def __store(self, key, value):
+        """ Cache @value for @key, evicting the least recently used entries. Call it holding the lock. """
+
+        self.__data[key] = (value, time.monotonic() + self.__ttl if self.__ttl else None)
+        self.__data.move_to_end(key)
+
+        while len(self.__data) > self.__maxsize:
+            self.__data.popitem(last = False)
+
+    def __lookup(self, key):
+        """ Return the value cached for @key, marking it as recently used, or __MISSING. Call it holding the lock. """
+
+        try:
+            value, expiration = self.__data[key]
+        except KeyError:
+            return self.__MISSING
+
+        if expiration is not None and expiration < time.monotonic():
+            del self.__data[key]
+            return self.__MISSING
+
+        self.__data.move_to_end(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        with self.__lock:
+            return self.__lookup(key) is not self.__MISSING
+
+    def __len__(self) -> int:
+        return len(self.__data)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+
+class EngineProfile:
+    """ SQLite tuning applied to every connection opened by the engine.
+    Pragmas left to None keep the SQLite default.
+    If @pool_size is given, connections are kept in a pool of that size and shared between threads. """
+
+    def __init__(self,
+            journal_mode: str = None,
+            synchronous: str = None,
+            mmap_size: int = None,
+            cache_size: int = None,
+            temp_store: str = None,
+            busy_timeout: int = None,
+            pool_size: int = None):
+
+        self.pool_size = pool_size
+        self.pragmas = [
+            (pragma, value) for pragma, value in (
+                ("journal_mode", journal_mode),
+                ("synchronous", synchronous),
+                ("mmap_size", mmap_size),
+                ("cache_size", cache_size),
+                ("temp_store", temp_store),
+                ("busy_timeout", busy_timeout)
+            ) if value is not None]
+
+    @classmethod
+    def default(cls):
+        """ SQLite defaults: rollback journal, no pragmas, no connection pool """
+        return cls()
+
+    @classmethod
+    def wal(cls, pool_size: int = 5, mmap_mb: int = 256, cache_mb: int = 64):
+        """ Write-ahead log, so readers are not blocked by writers,
+        with @mmap_mb MiB of memory-mapped I/O and @cache_mb MiB of page cache per connection """
+        return cls(
+            journal_mode = "WAL",
+            synchronous = "NORMAL",
+            mmap_size = mmap_mb * 2**20,
+            cache_size = -cache_mb * 2**10,     #negative values are KiB
+            temp_store = "MEMORY",
+            busy_timeout = 5000,
+            pool_size = pool_size)
+
+    def __repr__(self):
+        return f"<EngineProfile(pragmas={self.pragmas}, pool_size={self.pool_size})>"
+
+
+def build_engine(db_name: str, profile: EngineProfile = None):
+    """ Create the engine of the SQLite database @db_name, tuned according to @profile """
+
+    profile = profile or EngineProfile.default()
+    args = dict()
+
+    if profile.pool_size:
+        args.update(dict(
+            poolclass = QueuePool,
+            pool_size = profile.pool_size,
+            max_overflow = profile.pool_size,
+            connect_args = dict(check_same_thread = False)))
+
+    engine = create_engine(f"sqlite:///{db_name}", **args)
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in profile.pragmas:
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    return engine
@@ -10,6 +10,7 @@ class Recipe:
             self.__name = recipe_obj.name 
             self.__owner = recipe_obj.owner
             self.__id = recipe_obj.id 
+            self.__global_visibility = bool(recipe_obj.public_flag)
         else: 
             self.__name = name.lower().strip() 
             self.__owner = owner
@@ -74,3 +75,30 @@ class Ingredient:
     
     def __repr__(self):
         return f"{self.name}"
+
+
+
+class Photo:
+    def __init__(self, path: str, file_id: str = None, photo_id: int = None):
+        self.__path = path
+        self.__file_id = file_id
+        self.__id = photo_id
+
+    @property
+    def id(self):
+        return self.__id
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def file_id(self):
+        return self.__file_id
+
+    @file_id.setter
+    def file_id(self, value):
+        self.__file_id = value
+
+    def __repr__(self):
+        return f"{self.path}"
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import threading
+
+
+class IngredientIndex:
+    """ In-memory inverted index mapping every ingredient id to the sorted array
+    of the ids of the recipes containing it (posting list).
+    It also keeps the owner and the privacy of every indexed recipe,
+    in order to restrict the search to the recipes visible to the user. """
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__postings = dict()        # ingredient id -> array of recipe ids
+        self.__ingredients = dict()     # ingredient name -> ingredient id
+        self.__compositions = dict()    # recipe id -> tuple of ingredient ids
+        self.__owners = dict()          # recipe id -> owner
+        self.__public = set()           # ids of the public recipes
+
+    def build(self, ingredients: list, recipes: list, compositions: list):
+        """ Fill the index from scratch given the (id, name) pairs of @ingredients,
+        the (id, owner, public_flag) triples of @recipes and the (recipe id, ingredient id) pairs of @compositions """
+
+        postings, recipe_ingredients = dict(), dict()
+
+        for recipe_id, ingredient_id in sorted(compositions):
+            postings.setdefault(ingredient_id, array("q")).append(recipe_id)
+            recipe_ingredients.setdefault(recipe_id, list()).append(ingredient_id)
+
+        with self.__lock:
+            self.__ingredients = {name: ingredient_id for ingredient_id, name in ingredients}
+            self.__postings = postings
+            self.__compositions = {r_id: tuple(i_ids) for r_id, i_ids in recipe_ingredients.items()}
+            self.__owners = {recipe_id: owner for recipe_id, owner, _ in recipes}
+            self.__public = {recipe_id for recipe_id, _, public_flag in recipes if public_flag}
+
+    def add_recipe(self, recipe_id: int, owner: int, public_flag: bool, ingredients: dict):
+        """ Index the recipe @recipe_id, composed by @ingredients (a dict ingredient name -> ingredient id) """
+
+        with self.__lock:
+            self.__ingredients.update(ingredients)
+            self.__compositions[recipe_id] = tuple(ingredients.values())
+            self.__owners[recipe_id] = owner
+            self.set_privacy(recipe_id, public_flag)
+
+            for ingredient_id in ingredients.values():
+                posting = self.__postings.setdefault(ingredient_id, array("q"))
+                #recipe ids are increasing, so the new id usually goes at the end
+                if not posting or posting[-1] < recipe_id:
+                    posting.append(recipe_id)
+                elif posting[(pos := bisect_left(posting, recipe_id))] != recipe_id:
+                    posting.insert(pos, recipe_id)
+
+    def remove_recipe(self, recipe_id: int):
+        """ Remove the recipe @recipe_id from the index """
+
+        with self.__lock:
+            for ingredient_id in self.__compositions.pop(recipe_id, tuple()):
+                posting = self.__postings[ingredient_id]
+                if (pos := bisect_left(posting, recipe_id)) < len(posting) and posting[pos] == recipe_id:
+                    del posting[pos]
+
+            self.__owners.pop(recipe_id, None)
+            self.__public.discard(recipe_id)
+
+    def set_privacy(self, recipe_id: int, public_flag: bool):
+        with self.__lock:
+            if public_flag:
+                self.__public.add(recipe_id)
+            else:
+                self.__public.discard(recipe_id)
+
+    def ingredient_ids(self, token: str) -> set:
+        """ Return the ids of the ingredients named @token.
+        If there is no such ingredient, the ids of the ingredients whose name contains @token are returned. """
+
+        token = token.lower().strip()
+
+        with self.__lock:
+            if (ingredient_id := self.__ingredients.get(token)) is not None:
+                return {ingredient_id}
+            return {i_id for name, i_id in self.__ingredients.items() if token in name}
+
+    def search(self, tokens: list, user_id: int, all_recipes: bool, match_all: bool = False) -> list:
+        """ Return the ids of the recipes containing the ingredients in @tokens,
+        restricted to the public recipes if @all_recipes is True, to the ones owned by @user_id otherwise.
+        If @match_all is True, recipes have to contain all the ingredients;
+        otherwise the recipes matching more ingredients come first. """
+
+        with self.__lock:
+            matches = [self.__token_recipes(token) for token in tokens if token.strip()]
+
+            if not matches:
+                return list()
+
+            if match_all:
+                matches.sort(key = len)
+                shortest, others = matches[0], matches[1:]
+                results = Counter({
+                    recipe_id: len(matches) for recipe_id in shortest
+                        if all(self.__contains(posting, recipe_id) for posting in others)})
+            else:
+                results = Counter()
+                for posting in matches:
+                    results.update(posting)
+
+            visible = (
+                (lambda recipe_id: recipe_id in self.__public) if all_recipes else
+                (lambda recipe_id: self.__owners.get(recipe_id) == user_id))
+
+            return [
+                recipe_id for recipe_id, _ in sorted(
+                    results.items(), key = lambda item: (-item[1], -item[0]))
+                if visible(recipe_id)]
+
+    def __token_recipes(self, token: str) -> array:
+        """ Return the sorted posting list of the recipes containing any ingredient matching @token """
+
+        postings = [self.__postings.get(i_id, array("q")) for i_id in self.ingredient_ids(token)]
+
+        if len(postings) == 1:
+            return postings[0]
+        return array("q", sorted(set().union(*postings)))
+
+    @staticmethod
+    def __contains(posting: array, recipe_id: int) -> bool:
+        return (pos := bisect_left(posting, recipe_id)) < len(posting) and posting[pos] == recipe_id
@@ -1,40 +1,99 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import create_engine
 from sqlalchemy import (
     and_,
     delete,
-    or_
+    func,
+    or_,
+    text
 )
 from sqlalchemy.orm import sessionmaker
 from db.mappings import (
     Base,  
     Ingredient, 
     IngredientsRecipe, 
+    Photo, 
+    PhotoBlob, 
+    Procedure, 
     Recipe, 
-    User
+    User, 
+    RECIPE_SEARCH_TABLE
 )
+from db.migrations import migrate
+from db.engine import EngineProfile, build_engine
 
 from collections import defaultdict
+import hashlib
+import itertools
 import logging  
 import os, shutil
+import threading
+import time
+import uuid
+import zlib
 
 import db.entities as ent
+import db.backups as backups
+from db.indexes import IngredientIndex
+from db.photos import PhotoDownloader, PhotoProcessor, RETIRED_VARIANTS, VARIANTS, is_variant, variant_path
+from db.caches import LRUCache
 
 
 class DBManager:
-    def __init__(self, db_name: str):
+    #procedures shorter than this (in bytes) are not compressed
+    COMPRESSION_THRESHOLD = 256
+
+    def __init__(self, 
+            db_name: str, 
+            cache_size: int = 4096, 
+            engine_profile: EngineProfile = None, 
+            compress_procedures: bool = True):
         self.__db_name = db_name
-        self.__engine = create_engine(f"sqlite:///{db_name}")
+        self.__compress_procedures = compress_procedures
+        self.__ingredient_ids = LRUCache(cache_size)     # ingredient name -> ingredient id
+        self.__known_users = LRUCache(cache_size)        # user_id -> True
+        self.__search_results = LRUCache(cache_size)     # (search, tokens, scope, params, generation) -> ids
+        #bumped by every write changing search results: cached results of older generations are never used
+        self.__generations = itertools.count(1)
+        self.__write_generation = 0
+        self.__engine = build_engine(db_name, engine_profile)
         Base.metadata.create_all(self.__engine)
+        migrate(self.__engine)
 
         self.__sessionMaker = sessionmaker()
         self.__sessionMaker.configure(bind=self.__engine)
 
+        self.__ingredient_index = IngredientIndex()
+        self.__init_ingredient_index()
+
+    def __init_ingredient_index(self):
+        """ Load the ingredient -> recipes inverted index from the database """
+
+        try:
+            session = self.__sessionMaker()
+            self.__ingredient_index.build(
+                ingredients = session.query(Ingredient.id, Ingredient.name).all(), 
+                recipes = session.query(Recipe.id, Recipe.owner, Recipe.public_flag).all(), 
+                compositions = session.query(IngredientsRecipe.recipeID, IngredientsRecipe.ingredientID).all()
+            )
+        finally:
+            session.close()
+
     @property
     def database_name(self) -> str:
         return self.__db_name
 
+    @property
+    def write_generation(self) -> int:
+        return self.__write_generation
+
+    @property
+    def search_cache_stats(self) -> dict:
+        return self.__search_results.stats
+
+    def __bump_generation(self):
+        self.__write_generation = next(self.__generations)
+
     def set_recipe_privacy(self, recipe_id: int, public_recipe: bool):
         logging.info(f"setting  privacy of recipe {recipe_id} to {public_recipe}")
 
@@ -44,24 +103,55 @@ class DBManager:
                 "public_flag": public_recipe
             })
             session.commit()
+            self.__ingredient_index.set_privacy(recipe_id, public_recipe)
+            self.__bump_generation()
         except:
             logging.info(f"Esploso: set_recipe_privacy({recipe_id}, {public_recipe})")
         finally:
             session.close()
 
-    def __add_user(self, session, user):
-        user = session.query(User).filter(User.user_id == user).first()
+    def __add_user(self, session, user_id: int) -> bool:
+        """ Add the user @user_id to the db if it is not already there. 
+        Returns True if the user has been added. Known users are cached, so they cost no query. """
 
-        if not user: 
-            user = User(user_id = user)
-            session.add(user)
-            session.commit()
+        if user_id in self.__known_users:
+            return False 
+
+        new_user = session.query(User.id).filter(User.user_id == user_id).first() is None
+
+        if new_user: 
+            session.add(User(user_id = user_id))
+            session.flush()
+        
+        return new_user
+
+
+    def __resolve_ingredients(self, session, names: list) -> dict:
+        """ Return a dict mapping every ingredient name in @names to its id, 
+        inserting the missing ingredients with a single bulk insert. 
+        Cached names cost nothing, the others are resolved with one IN query. """
+
+        ingredient_ids = {
+            name: i_id for name in names if (i_id := self.__ingredient_ids.get(name)) is not None}
         
-        return (not user)
+        if (missing := [name for name in names if name not in ingredient_ids]):
+            ingredient_ids.update(
+                session.query(Ingredient.name, Ingredient.id).filter(Ingredient.name.in_(missing)).all())
+
+            if (new_ingredients := [name for name in missing if name not in ingredient_ids]):
+                # insert ingredients not already present and retrieve their ids 
+                session.execute(
+                    Ingredient.__table__.insert().prefix_with("OR IGNORE"), 
+                    [dict(name = name) for name in new_ingredients])
+                ingredient_ids.update(
+                    session.query(Ingredient.name, Ingredient.id).filter(Ingredient.name.in_(new_ingredients)).all())
+        
+        return ingredient_ids
 
 
-    def add_recipe(self, recipe_entity: ent.Recipe):
-        """ Add a new recipe and its ingredient list in the database """
+    def add_recipe(self, recipe_entity: ent.Recipe, recipe_procedure: str = None):
+        """ Add a new recipe, its ingredient list and its procedure @recipe_procedure in the database. 
+        The recipe is indexed for the full-text search together with its procedure. """
 
         new_recipe_id = None 
 
@@ -71,20 +161,9 @@ class DBManager:
             if self.__add_user(session, recipe_entity.owner):
                 logging.info(f"New user ({recipe_entity.owner}) added to the db")
 
-            my_ingredients = list() 
-
             ### add ingredients in db and keeping trace of their id
-            for ingredient in recipe_entity.ingredients:
-                curr_ingredient = session.query(Ingredient).filter(Ingredient.name == ingredient.name).first()
-
-                if not curr_ingredient:
-                    # insert ingredient if it is not already present 
-                    curr_ingredient = Ingredient(name=ingredient.name)
-                    session.add(curr_ingredient)
-                
-                my_ingredients.append(curr_ingredient)
-            else:
-                session.commit() 
+            composition = self.__resolve_ingredients(
+                session, [ingredient.name for ingredient in recipe_entity.ingredients])
 
             ### initialize the new recipe 
             recipe = Recipe(
@@ -93,20 +172,39 @@ class DBManager:
                 public_flag=recipe_entity.visibility
             )
             ### adding ingredient ids to the new recipe
-            for ingredient in my_ingredients:
+            for ingredient_id in composition.values():
                 recipe.ingredients.append(
                     IngredientsRecipe(
-                        ingredientID=ingredient.id, 
+                        ingredientID=ingredient_id, 
                         quantity="q.b."
                     )
                 )
+            ### adding the procedure to the new recipe 
+            if recipe_procedure is not None:
+                recipe.procedure = self.__new_procedure(recipe_procedure)
             ### adding the recipe and its composition to the db 
             session.add(recipe)
+            session.flush()
+            ### indexing the recipe for the full-text search 
+            session.execute(text(
+                f"INSERT INTO {RECIPE_SEARCH_TABLE}(rowid, name, ingredients, procedure) "
+                "VALUES (:id, :name, :ingredients, :procedure)"), dict(
+                    id = recipe.id, 
+                    name = recipe.name, 
+                    ingredients = " ".join(composition), 
+                    procedure = recipe_procedure or ""
+            ))
+            new_recipe_id = recipe.id 
             session.commit()
 
-            logging.info(f"User {recipe.owner} added recipe '{recipe.name}' having id = {recipe.id}")
+            ### ids are cached only once they are committed 
+            self.__known_users.put(recipe_entity.owner, True)
+            self.__ingredient_ids.update(composition)
+            self.__ingredient_index.add_recipe(
+                new_recipe_id, recipe_entity.owner, recipe_entity.visibility, composition)
+            self.__bump_generation()
 
-            new_recipe_id = recipe.id 
+            logging.info(f"User {recipe_entity.owner} added recipe '{recipe_entity.name}' having id = {new_recipe_id}")
 
         except:
             logging.info("Error in add_recipe...")
@@ -118,26 +216,154 @@ class DBManager:
         return new_recipe_id
 
 
+    def export_recipes(self, batch_size: int = 1000):
+        """ Lazily yield every recipe as a dict (name, owner, public, ingredients, procedure), in id order. 
+        Recipes are streamed from the db @batch_size at a time and the ingredients and the procedures 
+        of each batch are loaded with one query each, so memory usage does not depend on the number of recipes. """
+
+        try:
+            session = self.__sessionMaker()
+            recipes = iter(session.query(Recipe.id, Recipe.name, Recipe.owner, Recipe.public_flag).order_by(
+                Recipe.id).execution_options(stream_results = True).yield_per(batch_size))
+
+            while (batch := list(itertools.islice(recipes, batch_size))):
+                recipe_ids, ingredients = [recipe.id for recipe in batch], defaultdict(list)
+
+                for recipe_id, name in session.query(IngredientsRecipe.recipeID, Ingredient.name).join(
+                        Ingredient, Ingredient.id == IngredientsRecipe.ingredientID).filter(
+                        IngredientsRecipe.recipeID.in_(recipe_ids)):
+                    ingredients[recipe_id].append(name)
+                
+                procedures = {
+                    recipe_id: (zlib.decompress(content) if compressed else content).decode("utf-8") 
+                        for recipe_id, compressed, content in session.query(
+                            Procedure.recipeID, Procedure.compressed, Procedure.content).filter(
+                            Procedure.recipeID.in_(recipe_ids))}
+
+                for recipe in batch:
+                    yield dict(
+                        name = recipe.name, 
+                        owner = recipe.owner, 
+                        public = bool(recipe.public_flag), 
+                        ingredients = sorted(ingredients[recipe.id]), 
+                        procedure = procedures.get(recipe.id))
+        finally:
+            session.close()
+
+    def import_recipes(self, records, batch_size: int = 1000) -> tuple:
+        """ Bulk insert the recipes in @records, dicts as the ones yielded by export_recipes. 
+        Every @batch_size recipes are inserted in a single transaction with one executemany per table, 
+        skipping the recipes whose owner already has a recipe with the same name. 
+        Returns the number of imported and skipped recipes. """
+
+        imported = skipped = 0
+        records = iter(records)
+
+        while (batch := list(itertools.islice(records, batch_size))):
+            try:
+                session = self.__sessionMaker()
+                new_recipes = self.__import_batch(session, batch)
+                session.commit()
+            finally:
+                session.close()
+
+            imported += new_recipes
+            skipped += len(batch) - new_recipes
+            logging.info(f"Imported {imported} recipes ({skipped} skipped)")
+
+        #caches and indexes are refreshed once at the end
+        self.__ingredient_ids.clear()
+        self.__known_users.clear()
+        self.__init_ingredient_index()
+        self.__bump_generation()
+
+        return imported, skipped
+
+    def __import_batch(self, session, batch: list) -> int:
+        """ Insert the new recipes of @batch within the transaction of @session. Returns how many they are. """
+
+        recipes = dict()        # (owner, name) -> record, deduplicated 
+        for record in batch:
+            recipes.setdefault((record["owner"], record["name"].lower().strip()), record)
+
+        for owner, name in session.query(Recipe.owner, Recipe.name).filter(
+                Recipe.owner.in_({owner for owner, _ in recipes}), Recipe.name.in_({name for _, name in recipes})):
+            recipes.pop((owner, name), None)
+        
+        if not recipes:
+            return 0
+
+        session.execute(
+            User.__table__.insert().prefix_with("OR IGNORE"), 
+            [dict(user_id = owner) for owner in {owner for owner, _ in recipes}])
+        
+        composition = self.__resolve_ingredients(session, list({
+            name.lower().strip(): None for record in recipes.values() for name in record["ingredients"]}))
+
+        session.execute(Recipe.__table__.insert(), [
+            dict(owner = owner, name = name, public_flag = bool(record.get("public"))) 
+                for (owner, name), record in recipes.items()])
+        
+        #(owner, name) is unique: retrieve the ids of the new recipes 
+        recipe_ids = {
+            (owner, name): r_id for r_id, owner, name in session.query(Recipe.id, Recipe.owner, Recipe.name).filter(
+                Recipe.owner.in_({owner for owner, _ in recipes}), Recipe.name.in_({name for _, name in recipes}))}
+
+        ingredients, procedures, search_rows = list(), list(), list()
+
+        for key, record in recipes.items():
+            recipe_id, names = recipe_ids[key], sorted({name.lower().strip() for name in record["ingredients"]})
+            ingredients.extend(
+                dict(recipeID = recipe_id, ingredientID = composition[name], quantity = "q.b.") for name in names)
+            
+            if (procedure := record.get("procedure")) is not None:
+                row = self.__new_procedure(procedure)
+                procedures.append(dict(recipeID = recipe_id, compressed = row.compressed, content = row.content))
+            
+            search_rows.append(dict(
+                id = recipe_id, name = key[1], ingredients = " ".join(names), procedure = procedure or ""))
+
+        if ingredients:
+            session.execute(IngredientsRecipe.__table__.insert(), ingredients)
+        if procedures:
+            session.execute(Procedure.__table__.insert(), procedures)
+        session.execute(text(
+            f"INSERT INTO {RECIPE_SEARCH_TABLE}(rowid, name, ingredients, procedure) "
+            "VALUES (:id, :name, :ingredients, :procedure)"), search_rows)
+
+        return len(recipes)
+
     def get_recipe_by_id(self, recipe_id: int) -> ent.Recipe:
         """ Retrieve a recipe from the db given its id @recipe_id """
 
         my_recipe = None 
         try:
-            session = self.__sessionMaker() 
-            that_recipe = session.query(Recipe).filter(Recipe.id == recipe_id).first()
-            my_recipe = ent.Recipe(recipe_obj = that_recipe)
-
-            for ingredient in session.query(Ingredient).join(IngredientsRecipe).\
-                              filter(IngredientsRecipe.recipeID == that_recipe.id).all():
-                my_recipe.add_ingredient(ingredient.name)
+            my_recipe = next(iter(self.get_recipes_by_ids([recipe_id])), None)
         except:
             logging.info(f"esploso in get_recipe_by_id({recipe_id}")
-        finally:
-            session.close() 
         
         return my_recipe
 
 
+    def get_recipes_by_ids(self, recipe_ids: list, batch_size: int = 500) -> list:
+        """ Retrieve the recipes having the ids in @recipe_ids, together with their ingredients. 
+        Recipes are returned in the same order of @recipe_ids; missing ids are skipped. 
+        Ids are fetched in batches of @batch_size, each one costing a single query. """
+
+        try:
+            session = self.__sessionMaker() 
+            recipe_ids = list(recipe_ids)
+            recipes = dict() 
+
+            for i in range(0, len(recipe_ids), batch_size):
+                query = session.query(Recipe).filter(Recipe.id.in_(recipe_ids[i:i + batch_size]))
+                recipes.update((recipe.id, recipe) for recipe in self.__hydrate(query))
+
+            return [recipes[r_id] for r_id in recipe_ids if r_id in recipes]
+        finally:
+            session.close()
+
+
     def get_recipes(self, 
             user_id: int, 
             id_only: bool = False, 
@@ -148,23 +374,17 @@ class DBManager:
 
         try:
             session = self.__sessionMaker() 
-            recipes_list = list() 
             query = session.query(Recipe)
 
             query = query.filter(Recipe.public_flag) \
                     if all_recipes else query.filter(Recipe.owner == user_id) 
 
             if id_only:
-                for my_recipe in query.all():
-                    recipes_list.append((my_recipe.id, my_recipe.public_flag))
+                recipes_list = [
+                    (recipe_id, public_flag) for recipe_id, public_flag in 
+                        query.with_entities(Recipe.id, Recipe.public_flag).order_by(Recipe.id)]
             else:
-                for my_recipe in query.all():
-                    curr_recipe = ent.Recipe(recipe_obj = my_recipe)
-                    recipes_list.append(curr_recipe)
-
-                    for ingredient in session.query(Ingredient).join(IngredientsRecipe).\
-                                    filter(IngredientsRecipe.recipeID == my_recipe.id).all():
-                        curr_recipe.add_ingredient(ingredient.name)
+                recipes_list = self.__hydrate(query)
             
             logging.info(f"User {user_id} retrieved {len(recipes_list)} -- {'global' if all_recipes else 'local'} search.")
 
@@ -175,6 +395,116 @@ class DBManager:
         finally:
             session.close()
 
+
+    def count_recipes(self, user_id: int, all_recipes: bool = False) -> int:
+        """ Count the public recipes if @all_recipes is True, the ones belonging to @user_id otherwise """
+
+        try:
+            session = self.__sessionMaker() 
+            return self.__scope(session.query(Recipe.id), user_id, all_recipes).count()
+        finally:
+            session.close()
+
+
+    def get_recipe_ids_page(self, 
+            user_id: int, 
+            all_recipes: bool = False, 
+            after_id: int = None, 
+            before_id: int = None, 
+            limit: int = 20) -> list:
+        """ Keyset pagination over the recipes sorted by id: returns the ids of (at most) @limit recipes 
+        following @after_id or preceding @before_id, in increasing order. 
+        Recipes are the public ones if @all_recipes is True, the ones belonging to @user_id otherwise. """
+
+        try:
+            session = self.__sessionMaker() 
+            query = self.__scope(session.query(Recipe.id), user_id, all_recipes)
+
+            if before_id is not None:
+                query = query.filter(Recipe.id < before_id).order_by(Recipe.id.desc())
+                return [recipe_id for recipe_id, in query.limit(limit)][::-1]
+
+            if after_id is not None:
+                query = query.filter(Recipe.id > after_id)
+            
+            return [recipe_id for recipe_id, in query.order_by(Recipe.id).limit(limit)]
+        finally:
+            session.close()
+
+
+    def browse_recipes(self, 
+            user_id: int, 
+            all_recipes: bool = False, 
+            cursor: int = None, 
+            backwards: bool = False, 
+            position: int = None):
+        """ Stateless keyset browsing over the recipes sorted by id (scoped as in get_recipe_ids_page):
+        returns the id of the recipe following @cursor (preceding it if @backwards), its position and
+        the number of recipes, or None if there is no such recipe. With no @cursor, the first recipe is returned. 
+        If the @position of @cursor is given, the new one is just the next (previous) position: 
+        it is counted only if unknown or if the cursor recipe has been deleted. """
+
+        try:
+            session = self.__sessionMaker()
+            query = self.__scope(session.query(Recipe.id), user_id, all_recipes)
+
+            if cursor is None:
+                ids, position = [recipe_id for recipe_id, in query.order_by(Recipe.id).limit(1)], 0
+            else:
+                #the cursor recipe itself tells whether it still exists
+                query = query.filter(Recipe.id <= cursor).order_by(Recipe.id.desc()) if backwards else \
+                    query.filter(Recipe.id >= cursor).order_by(Recipe.id)
+                ids = [recipe_id for recipe_id, in query.limit(2)]
+
+                if ids and ids[0] == cursor:
+                    ids = ids[1:]
+                else:
+                    position = None
+
+            if not ids:
+                return None
+
+            #the counts are answered by the (owner, id) and (public_flag, id) indexes
+            counter = self.__scope(session.query(func.count(Recipe.id)), user_id, all_recipes)
+            total = counter.scalar()
+
+            if position is None:
+                position = counter.filter(Recipe.id < ids[0]).scalar()
+            elif cursor is not None:
+                #recipes added or deleted elsewhere shift the position, which is kept in range
+                position = min(max(position + (-1 if backwards else 1), 0), total - 1)
+
+            return ids[0], position, total
+        finally:
+            session.close()
+
+
+    @staticmethod
+    def __scope(query, user_id: int, all_recipes: bool):
+        """ Restrict @query to the public recipes if @all_recipes is True, to the ones of @user_id otherwise """
+
+        return query.filter(Recipe.public_flag == True) \
+                if all_recipes else query.filter(Recipe.owner == user_id) 
+
+
+    def __hydrate(self, query) -> list:
+        """ Build the recipe entities selected by @query (a query over Recipe) 
+        along with their ingredients, using a single joined query. """
+
+        recipes = dict() 
+        query = query.add_columns(Ingredient.name) \
+            .outerjoin(IngredientsRecipe, IngredientsRecipe.recipeID == Recipe.id) \
+            .outerjoin(Ingredient, Ingredient.id == IngredientsRecipe.ingredientID) \
+            .order_by(Recipe.id)
+
+        for recipe, ingredient_name in query:
+            if (curr_recipe := recipes.get(recipe.id)) is None:
+                curr_recipe = recipes[recipe.id] = ent.Recipe(recipe_obj = recipe)
+            if ingredient_name is not None:
+                curr_recipe.add_ingredient(ingredient_name)
+
+        return list(recipes.values())
+
     
 
     def check_recipe_availability(self, 
@@ -204,6 +534,8 @@ class DBManager:
             if my_recipe:
                 my_recipe.public_flag = (not my_recipe.public_flag)
                 session.commit()
+                self.__ingredient_index.set_privacy(recipe_id, my_recipe.public_flag)
+                self.__bump_generation()
 
                 logging.info(f"Privacy for recipe {recipe_id} toggled.")
                 return my_recipe.public_flag
@@ -243,8 +575,16 @@ class DBManager:
 
             if qresult:
                 recipe_id = qresult.id 
+                #release the photo blobs referenced by the recipe
+                if (blobs := [dict(hash = blob) for blob, in session.query(Photo.blob).filter(
+                        Photo.recipeID == recipe_id, Photo.blob.isnot(None))]):
+                    session.execute(text("UPDATE PhotoBlob SET refcount = refcount - 1 WHERE hash = :hash"), blobs)
                 session.delete(qresult)
+                session.execute(text(
+                    f"DELETE FROM {RECIPE_SEARCH_TABLE} WHERE rowid = :id"), dict(id = recipe_id))
                 session.commit()
+                self.__ingredient_index.remove_recipe(recipe_id)
+                self.__bump_generation()
 
                 logging.info(f"Recipe named {qresult.name} successfully deleted.")
                 return recipe_id
@@ -276,22 +616,31 @@ class DBManager:
             session.close() 
     
 
-    def search_recipes(self, tokens: list, user_id: int, all_recipes: bool) -> list:
-        #TODO - sort by score 
-        """ Returns the list of recipe's id matching 1+ tokens """
+    def search_recipes(self, tokens: list, user_id: int, all_recipes: bool, limit: int = 50) -> list:
+        """ Returns the list of recipe's id matching 1+ tokens, sorted by relevance (BM25). 
+        Tokens are matched as prefixes against recipe names, ingredients and procedures. 
+        At most @limit ids are returned. """
+
+        return self.__cached_search(
+            "fulltext", tokens, user_id, all_recipes, (limit, ), 
+            lambda tokens: self.__search_fulltext(tokens, user_id, all_recipes, limit))
+
+    def __search_fulltext(self, tokens: list, user_id: int, all_recipes: bool, limit: int) -> list:
+        if not (match_expression := self.__match_expression(tokens)):
+            return list() 
+
         try:
             session = self.__sessionMaker()
-            all_results = set()
 
             logging.info(f"User {user_id} is searching in {'public' if all_recipes else 'mine'} recipes")
-            partial_query = session.query(Recipe).filter(Recipe.public_flag == True) \
-                            if all_recipes else \
-                            session.query(Recipe).filter(Recipe.owner == user_id)
-            
-            for token in tokens:
-                results = partial_query.filter(Recipe.name.like(f"%{token}%")).all()
-                all_results.update([recipe.id for recipe in results])
-                logging.info(f"Results for user {user_id} for token {token}: {results}")
+            query = (
+                f"SELECT r.id FROM {RECIPE_SEARCH_TABLE} s JOIN Recipe r ON r.id = s.rowid "
+                f"WHERE {RECIPE_SEARCH_TABLE} MATCH :match AND "
+                f"{'r.public_flag' if all_recipes else 'r.owner = :user_id'} "
+                f"ORDER BY bm25({RECIPE_SEARCH_TABLE}) LIMIT :limit"
+            )
+            all_results = [row[0] for row in session.execute(text(query), dict(
+                match = match_expression, user_id = user_id, limit = limit))]
             
             logging.info(f"All search results for user {user_id}: {all_results}")
             return all_results
@@ -301,11 +650,197 @@ class DBManager:
         finally:
             session.close() 
 
+    @staticmethod
+    def __match_expression(tokens: list) -> str:
+        """ Build a FTS5 query matching any of @tokens, each one quoted and used as prefix """
+
+        phrases = [token.replace('"', '""') for token in tokens if token.strip()]
+        return " OR ".join(f'"{phrase}"*' for phrase in phrases)
+
+
+    def search_by_ingredients(self, 
+            tokens: list, 
+            user_id: int, 
+            all_recipes: bool, 
+            match_all: bool = False, 
+            limit: int = 50) -> list:
+        """ Returns the list of recipe's id containing the ingredients in @tokens, 
+        using the in-memory ingredient index. 
+        If @match_all is True, only recipes containing every ingredient are returned, 
+        otherwise recipes matching more ingredients come first. At most @limit ids are returned. """
+
+        logging.info(f"User {user_id} is searching by ingredients in {'public' if all_recipes else 'mine'} recipes")
+        results = self.__cached_search(
+            "ingredients", tokens, user_id, all_recipes, (match_all, limit), 
+            lambda tokens: self.__ingredient_index.search(tokens, user_id, all_recipes, match_all)[:limit])
+        logging.info(f"All search results for user {user_id}: {results}")
+
+        return results
+
+    def __cached_search(self, kind: str, tokens: list, user_id: int, all_recipes: bool, params: tuple, search) -> list:
+        """ Return the results of @search(normalized tokens) through the search result cache. 
+        Results are keyed by the normalized token set, the scope (the user only when searching among its own recipes),
+        the search parameters @params and the current write generation. """
+
+        normalized = tuple(sorted({token.lower().strip() for token in tokens} - {""}))
+        key = (kind, normalized, None if all_recipes else user_id, params, self.__write_generation)
+
+        return list(self.__search_results.get_or_load(key, lambda: search(list(normalized))))
 
     def search_by_hashtag(self, hashtag_list: list):
         return list()
 
 
+    def get_procedure(self, recipe_id: int) -> str:
+        """ Return the procedure of the recipe @recipe_id, None if it is missing """
+
+        try:
+            session = self.__sessionMaker()
+            if (procedure := session.query(Procedure).filter(Procedure.recipeID == recipe_id).first()):
+                content = zlib.decompress(procedure.content) if procedure.compressed else procedure.content
+                return content.decode("utf-8")
+        finally:
+            session.close()
+
+    def import_procedures(self, procedures: dict) -> list:
+        """ Store the procedures in @procedures (a dict recipe id -> procedure) of the recipes without one, 
+        indexing them for the full-text search. 
+        Returns the ids of the existing recipes, i.e. the ones whose procedure is now in the db. """
+
+        try:
+            session = self.__sessionMaker()
+            existing = {r_id for r_id, in session.query(Recipe.id).filter(Recipe.id.in_(list(procedures)))}
+            stored = {r_id for r_id, in session.query(Procedure.recipeID).filter(Procedure.recipeID.in_(list(existing)))}
+
+            for recipe_id in existing - stored:
+                procedure = self.__new_procedure(procedures[recipe_id])
+                procedure.recipeID = recipe_id
+                session.add(procedure)
+                session.execute(text(
+                    f"UPDATE {RECIPE_SEARCH_TABLE} SET procedure = :procedure WHERE rowid = :id"), 
+                    dict(id = recipe_id, procedure = procedures[recipe_id]))
+            
+            session.commit()
+            self.__bump_generation()
+
+            return sorted(existing)
+        finally:
+            session.close()
+
+    def __new_procedure(self, recipe_procedure: str) -> Procedure:
+        """ Build the Procedure row of @recipe_procedure, compressing it if it is worth it """
+
+        content = recipe_procedure.encode("utf-8")
+
+        if self.__compress_procedures and len(content) >= self.COMPRESSION_THRESHOLD:
+            if len(compressed := zlib.compress(content, 9)) < len(content):
+                return Procedure(compressed = True, content = compressed)
+        
+        return Procedure(compressed = False, content = content)
+
+    def add_photos(self, recipe_id: int, photos: list) -> list:
+        """ Append to the photo manifest of the recipe @recipe_id the photos in @photos, 
+        a list of (path, telegram file_id) pairs. Returns the ids of the new photos. """
+
+        try:
+            session = self.__sessionMaker()
+            last_position = session.query(func.max(Photo.position)).filter(Photo.recipeID == recipe_id).scalar() or 0
+
+            session.add_all((new_photos := [
+                Photo(recipeID = recipe_id, position = position, path = path, file_id = file_id) 
+                    for position, (path, file_id) in enumerate(photos, last_position + 1)]))
+            session.flush()
+            photo_ids = [photo.id for photo in new_photos]
+            session.commit()
+
+            return photo_ids
+        finally:
+            session.close()
+
+    def delete_photos(self, photo_ids: list):
+        """ Remove the photos @photo_ids from their manifests (e.g. photos whose download failed) """
+
+        try:
+            session = self.__sessionMaker()
+            session.query(Photo).filter(Photo.id.in_(list(photo_ids))).delete(synchronize_session = False)
+            session.commit()
+        finally:
+            session.close()
+
+    def attach_photo_blob(self, photo_id: int, blob_hash: str, path: str) -> bool:
+        """ Point the photo @photo_id to the blob @blob_hash (stored at @path), incrementing its reference count. 
+        Returns False if the photo does not exist anymore (e.g. its recipe has been deleted). """
+
+        try:
+            session = self.__sessionMaker()
+            if not session.query(Photo).filter(Photo.id == photo_id).update(
+                    {"blob": blob_hash, "path": path}, synchronize_session = False):
+                session.rollback()
+                return False 
+
+            session.execute(PhotoBlob.__table__.insert().prefix_with("OR IGNORE"), dict(hash = blob_hash, refcount = 0))
+            session.query(PhotoBlob).filter(PhotoBlob.hash == blob_hash).update(
+                {"refcount": PhotoBlob.refcount + 1}, synchronize_session = False)
+            session.commit()
+
+            return True
+        finally:
+            session.close()
+
+    def collect_unreferenced_blobs(self) -> list:
+        """ Forget the photo blobs no more referenced by any photo and return their hashes: 
+        their files can be deleted. """
+
+        try:
+            session = self.__sessionMaker()
+            unreferenced = [blob for blob, in session.query(PhotoBlob.hash).filter(PhotoBlob.refcount <= 0)]
+            released = [
+                blob for blob in unreferenced if session.query(PhotoBlob).filter(
+                    PhotoBlob.hash == blob, PhotoBlob.refcount <= 0).delete(synchronize_session = False)]
+            session.commit()
+
+            return released
+        finally:
+            session.close()
+
+    def existing_recipes(self, recipe_ids: list) -> set:
+        """ Return the ids in @recipe_ids of the recipes still in the db """
+
+        try:
+            session = self.__sessionMaker()
+            return {r_id for r_id, in session.query(Recipe.id).filter(Recipe.id.in_(list(recipe_ids)))}
+        finally:
+            session.close()
+
+    def existing_blobs(self, hashes: list) -> set:
+        """ Return the hashes in @hashes of the photo blobs still in the db """
+
+        try:
+            session = self.__sessionMaker()
+            return {blob for blob, in session.query(PhotoBlob.hash).filter(PhotoBlob.hash.in_(list(hashes)))}
+        finally:
+            session.close()
+
+    def get_photos(self, recipe_id: int) -> list:
+        """ Return the photo manifest of the recipe @recipe_id, i.e. its photos sorted by position """
+
+        try:
+            session = self.__sessionMaker()
+            return [
+                ent.Photo(path = photo.path, file_id = photo.file_id, photo_id = photo.id) 
+                    for photo in session.query(Photo).filter(Photo.recipeID == recipe_id).order_by(Photo.position)]
+        finally:
+            session.close()
+
+    def set_photo_file_id(self, photo_id: int, file_id: str):
+        try:
+            session = self.__sessionMaker()
+            session.query(Photo).filter(Photo.id == photo_id).update({"file_id": file_id})
+            session.commit()
+        finally:
+            session.close()
+
+
 class FSManager:
     def __init__(self, procedure_folder: str, photo_folder: str):
         self.__procedure_folder = procedure_folder
@@ -315,47 +850,126 @@ class FSManager:
             if not os.path.exists(dest_folder):
                 os.mkdir(dest_folder)
     
-    def persist_procedure(self, recipe_obj: ent.Recipe, recipe_procedure: str):
-        filepath = self.__filename(recipe_obj)
+    def new_photo_path(self) -> str:
+        """ Return a temporary path (relative to the photo folder) where to download a new photo, 
+        before moving it in the blob store """
 
-        with open(filepath, "w") as fo:
-            fo.write(recipe_procedure)
+        os.makedirs(os.path.join(self.__photo_folder, "tmp"), exist_ok = True)
+        return os.path.join("tmp", f"{uuid.uuid4().hex}.jpg")
 
-    def persist_photos(self, recipe_obj: ent.Recipe, photo_list: list):
-        if photo_list:
-            photo_folder = self.__foldername(recipe_obj = recipe_obj)
+    def store_blob(self, path: str) -> tuple:
+        """ Move the photo @path (relative to the photo folder) in the content-addressed blob store, 
+        i.e. in blobs/<h[:2]>/<h[2:4]>/<h>.jpg, where h is the sha256 of the file content. 
+        If the same content is already stored, the file is just removed. 
+        Returns the hash, the path of the blob (relative to the photo folder) and whether the blob is new. """
 
-            if not os.path.exists(photo_folder):
-                os.mkdir(photo_folder)
+        full_path, digest = self.photo_path(path), hashlib.sha256()
 
-            for index, photo in enumerate(photo_list, 1):
-                filename = f"photo_{index}.jpg"
-                photo.download(os.path.join(photo_folder, filename))
+        with open(full_path, "rb") as fi:
+            for chunk in iter(lambda: fi.read(2**16), b""):
+                digest.update(chunk)
+        
+        blob_hash = digest.hexdigest()
+        blob_path = self.__blob_path(blob_hash)
 
+        if (new_blob := not os.path.exists(self.photo_path(blob_path))):
+            os.makedirs(os.path.dirname(self.photo_path(blob_path)), exist_ok = True)
+            os.replace(full_path, self.photo_path(blob_path))
+        else:
+            os.remove(full_path)
+        
+        return blob_hash, blob_path, new_blob
 
-    def get_procedure(self, recipe_obj: ent.Recipe) -> str:
-        """ Try to retrieve the procedure of @recipe_obj recipe from file. """
+    def delete_blob(self, blob_hash: str):
+        """ Delete the blob @blob_hash and its variants """
 
-        filepath = self.__filename(recipe_obj)
-        fcontent = None 
+        blob_path = self.photo_path(self.__blob_path(blob_hash))
 
-        try:
-            with open(filepath) as fi:
-                fcontent = fi.read()
-        except FileNotFoundError:
-            pass
+        for path in [blob_path] + [variant_path(blob_path, variant) for variant in (*VARIANTS, *RETIRED_VARIANTS)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def scan(self):
+        """ Lazily walk the procedure and photo folders, yielding a (kind, key, path) triple for every 
+        - procedure file ("procedure", recipe id) 
+        - legacy photo folder ("photos", recipe id) 
+        - blob of the store and its variants ("blob", hash) 
+        - temporary download ("tmp", None) """
+
+        for entry in os.scandir(self.__procedure_folder):
+            user_id, _, recipe_id = os.path.splitext(entry.name)[0].partition("_")
+            if entry.is_file() and user_id.isdigit() and recipe_id.isdigit():
+                yield "procedure", int(recipe_id), entry.path
+
+        for entry in os.scandir(self.__photo_folder):
+            user_id, _, recipe_id = entry.name.partition("_")
+            if entry.is_dir() and user_id.isdigit() and recipe_id.isdigit():
+                yield "photos", int(recipe_id), entry.path
+
+        for entry in self.__scan_tree(os.path.join(self.__photo_folder, "blobs")):
+            yield "blob", entry.name.partition(".")[0], entry.path
         
-        return fcontent
+        for entry in self.__scan_tree(os.path.join(self.__photo_folder, "tmp")):
+            yield "tmp", None, entry.path
+
+    @staticmethod
+    def __scan_tree(folder: str):
+        """ Yield the files under @folder, visiting it depth-first """
+
+        if not os.path.isdir(folder):
+            return 
+
+        for entry in os.scandir(folder):
+            if entry.is_dir():
+                yield from FSManager.__scan_tree(entry.path)
+            else:
+                yield entry
+
+    @staticmethod
+    def __blob_path(blob_hash: str) -> str:
+        return os.path.join("blobs", blob_hash[:2], blob_hash[2:4], f"{blob_hash}.jpg")
+
+
+    def procedure_files(self) -> dict:
+        """ Return the procedure files written before procedures were stored in the db, 
+        as a dict recipe id -> (owner id, file path) """
+
+        files = dict() 
+
+        for filename in os.listdir(self.__procedure_folder):
+            user_id, _, recipe_id = os.path.splitext(filename)[0].partition("_")
+
+            if filename.endswith(".txt") and user_id.isdigit() and recipe_id.isdigit():
+                files[int(recipe_id)] = (int(user_id), os.path.join(self.__procedure_folder, filename))
+        
+        return files
 
     def get_photos(self, recipe_obj: ent.Recipe) -> list:
-        """ Retrive all the photos associated to recipe_obj """
+        """ Retrive all the photos associated to recipe_obj, as paths relative to the photo folder """
         foldername = self.__foldername(recipe_obj, recipe_obj.owner, recipe_obj.id)
         if os.path.exists(foldername):
             return [
-                os.path.join(foldername, photoname)
-                    for photoname in os.listdir(foldername)]
+                os.path.join(os.path.basename(foldername), photoname)
+                    for photoname in sorted(os.listdir(foldername), key = self.__photo_number) 
+                    if not is_variant(photoname)]
             
         return list() 
+
+    def photo_path(self, path: str, variant: str = None) -> str:
+        """ Return the full path of the photo @path, relative to the photo folder. 
+        If the @variant of the photo exists, its path is returned instead. """
+
+        full_path = os.path.join(self.__photo_folder, path)
+
+        if variant and os.path.exists(variant_full_path := variant_path(full_path, variant)):
+            return variant_full_path
+        return full_path
+
+    @staticmethod
+    def __photo_number(photoname: str) -> tuple:
+        """ Sort key of photo_<N>.jpg filenames: by N, then by name """
+        number = os.path.splitext(photoname)[0].rpartition("_")[2]
+        return (int(number) if number.isdigit() else float("inf"), photoname)
         
     
     def delete_procedure(self, recipe_obj: ent.Recipe = None, user_id: int = None, recipe_id: int = None):
@@ -401,14 +1015,48 @@ class FSManager:
         raise RuntimeError("Cannot obtain univocal identifier: missing data (user_id or recipe_id)")
 
 class PersistencyManager:
-    def __init__(self, db_manager: DBManager):
+    def __init__(self, 
+            db_manager: DBManager, 
+            photo_downloader: PhotoDownloader = None, 
+            photo_processor: PhotoProcessor = None, 
+            cache_size: int = 2048, 
+            cache_ttl: float = 600):
         self.__base_folder = os.path.dirname(db_manager.database_name)
         self.__dbmanager = db_manager
+        self.__photo_downloader = photo_downloader
+        self.__photo_processor = photo_processor
+        #serializes the blob store updates (new references vs deletion of unreferenced blobs)
+        self.__blob_lock = threading.Lock()
+        #recipes, procedures and photo lists shared between users, keyed by (kind, recipe id)
+        self.__cache = LRUCache(cache_size, ttl = cache_ttl)
 
         procedure_folder = os.path.join(self.__base_folder, "procedures")
         photo_folder = os.path.join(self.__base_folder, "img")
 
+        self.__folders = (procedure_folder, photo_folder)
         self.__fsmanager = FSManager(procedure_folder, photo_folder)
+        self.__import_procedure_files()
+
+    def __import_procedure_files(self, batch_size: int = 500):
+        """ One-shot migration of the procedure files in the db. Imported files are deleted. """
+
+        if not (files := self.__fsmanager.procedure_files()):
+            return
+
+        recipe_ids, imported = sorted(files), 0
+        logging.info(f"Importing {len(recipe_ids)} procedure files in the db")
+
+        for i in range(0, len(recipe_ids), batch_size):
+            procedures = dict() 
+            for recipe_id in recipe_ids[i:i + batch_size]:
+                with open(files[recipe_id][1], encoding = "utf-8") as fi:
+                    procedures[recipe_id] = fi.read()
+            
+            for recipe_id in self.__dbmanager.import_procedures(procedures):
+                self.__fsmanager.delete_procedure(user_id = files[recipe_id][0], recipe_id = recipe_id)
+                imported += 1
+
+        logging.info(f"{imported} procedure files imported in the db")
     
     @property
     def db_manager(self):
@@ -417,33 +1065,221 @@ class PersistencyManager:
     @property
     def fs_manager(self):
         return self.__fsmanager
+
+    @property
+    def cache_stats(self) -> dict:
+        return self.__cache.stats
     
 
-    def add_recipe(self, recipe_obj: ent.Recipe, recipe_procedure: str, recipe_photos: list = list()):
-        new_recipe_id = self.db_manager.add_recipe(recipe_obj)
+    def add_recipe(self, 
+            recipe_obj: ent.Recipe, 
+            recipe_procedure: str, 
+            recipe_photos: list = list(), 
+            on_photos_saved = None):
+        """ Save the recipe with its procedure and its photos, given as telegram file_ids. 
+        Photos are added to the manifest right away (so they can be sent by file_id) 
+        and downloaded in background: @on_photos_saved is called with the list of the failed downloads, 
+        which are removed from the manifest. 
+        Downloaded photos are moved in the content-addressed blob store 
+        and the variants of the new blobs are generated by the photo processor. 
+        Without a photo downloader, photos cannot be stored and are discarded. """
+
+        new_recipe_id = self.db_manager.add_recipe(recipe_obj, recipe_procedure)
+
+        if new_recipe_id is not None and recipe_photos and not self.__photo_downloader:
+            logging.warning(f"No photo downloader: {len(recipe_photos)} photos of recipe #{new_recipe_id} discarded")
+            if on_photos_saved:
+                on_photos_saved(list(recipe_photos))
+
+        elif new_recipe_id is not None and recipe_photos: 
+            paths = [self.fs_manager.new_photo_path() for _ in recipe_photos]
+            photo_ids = self.db_manager.add_photos(new_recipe_id, list(zip(paths, recipe_photos)))
+            jobs = [(file_id, self.fs_manager.photo_path(path)) for path, file_id in zip(paths, recipe_photos)]
+
+            def photos_downloaded(failed: list):
+                #the rows of the failed downloads would point to files never written
+                if (failed_ids := [photo_id for photo_id, job in zip(photo_ids, jobs) if job in failed]):
+                    self.db_manager.delete_photos(failed_ids)
+                    self.__invalidate(new_recipe_id, "photos")
+
+                new_blobs = [
+                    self.__store_photo(new_recipe_id, photo_id, path) 
+                        for photo_id, path, job in zip(photo_ids, paths, jobs) if job not in failed]
+                
+                if self.__photo_processor:
+                    self.__photo_processor.process([
+                        self.fs_manager.photo_path(blob_path) for blob_path in new_blobs if blob_path])
+                if on_photos_saved:
+                    on_photos_saved(failed)
 
-        if new_recipe_id is not None: 
-            self.fs_manager.persist_procedure(recipe_obj, recipe_procedure)
-            self.fs_manager.persist_photos(recipe_obj, recipe_photos)
+            self.__photo_downloader.download(jobs, photos_downloaded)
 
         return new_recipe_id
     
-    def get_recipe(self, user_id: int, recipe_name: str = None, recipe_id: int = None):
-        #recipe_obj = self.__dbmanager.
-        raise NotImplementedError()
+    def get_recipe(self, recipe_id: int) -> ent.Recipe:
+        """ Retrieve the recipe @recipe_id (with its ingredients) through the shared cache """
+        return self.__cache.get_or_load(
+            ("recipe", recipe_id), lambda: self.__dbmanager.get_recipe_by_id(recipe_id))
+
+    def get_procedure(self, recipe_obj: ent.Recipe) -> str:
+        return self.__cache.get_or_load(
+            ("procedure", recipe_obj.id), lambda: self.__dbmanager.get_procedure(recipe_obj.id))
+
+    def get_photos(self, recipe_obj: ent.Recipe) -> list:
+        """ Return the photo manifest of @recipe_obj (a list of entities.Photo) through the shared cache """
+
+        def load_manifest():
+            if not (photos := self.__dbmanager.get_photos(recipe_obj.id)) and (paths := self.__fsmanager.get_photos(recipe_obj)):
+                #photos saved before the manifest existed: add them to the manifest and generate their variants 
+                #(until then, the original files are sent)
+                self.__dbmanager.add_photos(recipe_obj.id, [(path, None) for path in paths])
+                photos = self.__dbmanager.get_photos(recipe_obj.id)
+
+                if self.__photo_processor:
+                    self.__photo_processor.process([self.__fsmanager.photo_path(path) for path in paths])
+            return photos
+
+        return self.__cache.get_or_load(("photos", recipe_obj.id), load_manifest)
+
+    def photo_path(self, photo: ent.Photo, variant: str = None) -> str:
+        return self.__fsmanager.photo_path(photo.path, variant)
+
+    def has_photo_file(self, photo: ent.Photo) -> bool:
+        """ True if the file of @photo is on disk, so that it can be uploaded """
+        return os.path.exists(self.photo_path(photo))
+
+    def set_photo_file_id(self, photo: ent.Photo, file_id: str):
+        """ Remember the telegram @file_id of @photo, so that it can be sent again without uploading it """
+        self.__dbmanager.set_photo_file_id(photo.id, file_id)
+        photo.file_id = file_id
     
-    def delete_recipe(self, user_id: int, recipe_name: str = None, recipe_id: int = None):
+    def delete_recipe(self, user_id: int, recipe_name: str = None, recipe_id: int = None) -> int:
+        """ Delete the recipe from db and file system. Returns the deleted recipe's id, None otherwise. """
+
         #try to delete recipe from db 
         id_rec = self.__dbmanager.delete_recipe(user_id = user_id, by_id = recipe_id, by_name = recipe_name)
 
         if id_rec:
             logging.info(f"Recipe #{id_rec} successfully deleted.")
-            self.__fsmanager.delete_procedure(user_id = user_id, recipe_id = id_rec)
+            self.__invalidate(id_rec)
             self.__fsmanager.delete_photos(user_id = user_id, recipe_id = id_rec)
+            self.collect_blobs()
 
-            return True 
+            return id_rec 
+
+    def collect_blobs(self) -> int:
+        """ Delete the photo blobs no more referenced by any recipe. Returns how many blobs have been deleted. """
+
+        with self.__blob_lock:
+            released = self.__dbmanager.collect_unreferenced_blobs()
+            for blob_hash in released:
+                self.__fsmanager.delete_blob(blob_hash)
+        
+        return len(released)
+
+    def scan_files(self):
+        """ Lazily walk the stored files, see FSManager.scan """
+        return self.__fsmanager.scan()
+
+    def sweep_orphans(self, entries: list, tmp_grace: float = 3600) -> int:
+        """ Delete the files in @entries, a batch of (kind, key, path) triples yielded by scan_files, 
+        which do not belong to any recipe in the db. 
+        Temporary downloads are deleted if older than @tmp_grace seconds. 
+        Returns how many files and folders have been deleted. """
+
+        by_kind = defaultdict(list)
+        for kind, key, path in entries:
+            by_kind[kind].append((key, path))
+
+        orphans = list() 
+
+        if (recipe_files := by_kind["procedure"] + by_kind["photos"]):
+            existing = self.__dbmanager.existing_recipes({r_id for r_id, _ in recipe_files})
+            orphans.extend(path for r_id, path in recipe_files if r_id not in existing)
+        
+        orphans.extend(
+            path for _, path in by_kind["tmp"] if self.__older_than(path, tmp_grace))
+
+        removed = self.__remove(orphans)
+
+        if by_kind["blob"]:
+            #a blob is moved in the store before being registered in the db: check it holding the lock
+            with self.__blob_lock:
+                existing = self.__dbmanager.existing_blobs({blob for blob, _ in by_kind["blob"]})
+                removed += self.__remove(path for blob, path in by_kind["blob"] if blob not in existing)
+
+        return removed
+
+    @staticmethod
+    def __older_than(path: str, seconds: float) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) > seconds
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def __remove(paths) -> int:
+        removed = 0
+
+        for path in paths:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+                logging.info(f"Removed orphan {path}")
+            except FileNotFoundError:
+                pass
+
+        return removed
+
+    def __store_photo(self, recipe_id: int, photo_id: int, path: str) -> str:
+        """ Move the downloaded photo @path in the blob store and point the photo @photo_id to its blob. 
+        Returns the path of the blob if it is new, None otherwise. """
+
+        try:
+            with self.__blob_lock:
+                blob_hash, blob_path, new_blob = self.__fsmanager.store_blob(path)
+
+                if not self.__dbmanager.attach_photo_blob(photo_id, blob_hash, blob_path):
+                    #recipe deleted in the meantime
+                    if new_blob:
+                        self.__fsmanager.delete_blob(blob_hash)
+                    return None
+        except Exception as e:
+            logging.warning(f"Cannot store photo #{photo_id} ({path}): {e}")
+            #the temporary file is left to the orphan sweeper: the photo cannot point to it
+            self.__dbmanager.delete_photos([photo_id])
+            return None 
+        finally:
+            self.__invalidate(recipe_id, "photos")
+
+        return blob_path if new_blob else None 
+
+    def toggle_privacy(self, user_id: int, recipe_id: int) -> bool:
+        public_flag = self.__dbmanager.toggle_privacy(user_id, recipe_id)
+        self.__invalidate(recipe_id, "recipe")
+        return public_flag
+
+    def set_recipe_privacy(self, recipe_id: int, public_recipe: bool):
+        self.__dbmanager.set_recipe_privacy(recipe_id, public_recipe)
+        self.__invalidate(recipe_id, "recipe")
+
+    def __invalidate(self, recipe_id: int, *kinds):
+        """ Drop the cached data of @recipe_id: only the given @kinds, or all of them """
+        for kind in (kinds or ("recipe", "procedure", "photos")):
+            self.__cache.pop((kind, recipe_id))
     
-    def backup(self):
-        #db tables in excel file 
-        raise NotImplementedError()
+    def backup(self, destination: str, keep: int = 0, pages: int = 256, sleep: float = 0.05) -> str:
+        """ Save in @destination an online snapshot of the db and of the procedure and photo folders, 
+        copying only the files changed since the previous snapshot. 
+        The db is copied @pages pages at a time, sleeping @sleep seconds between steps. 
+        If @keep is positive, only the @keep most recent snapshots are kept. 
+        Returns the path of the snapshot. """
+
+        snapshot = backups.create_snapshot(
+            self.__dbmanager.database_name, self.__folders, destination, pages = pages, sleep = sleep)
+        backups.prune_snapshots(destination, keep)
+        return snapshot
         
\ No newline at end of file
@@ -4,16 +4,25 @@ from sqlalchemy import (
     Boolean,
     Column, 
     ForeignKey,
+    Index, 
     Integer, 
+    LargeBinary, 
     PrimaryKeyConstraint,
     Sequence,
-    String, 
-    UniqueConstraint
+    String
 )
 
 
 Base = declarative_base()
 
+
+#full-text index over recipe names, ingredient names and procedures (rowid = Recipe.id)
+RECIPE_SEARCH_TABLE = "RecipeSearch"
+RECIPE_SEARCH_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RECIPE_SEARCH_TABLE} USING fts5("
+    "name, ingredients, procedure, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
 class User(Base):
     __tablename__ = "User"
 
@@ -47,9 +56,17 @@ class Recipe(Base):
     procedure_file = Column(String, nullable=True, default=None)
     # date_add = Column(String, nullable=True)
 
-    UniqueConstraint(owner, name)
+    __table_args__ = (
+        #recipe names are unique per user (lookup by name, availability check)
+        Index("ix_recipe_owner_name", owner, name, unique=True), 
+        #user's recipes and public recipes, sorted by id 
+        Index("ix_recipe_owner_id", owner, id), 
+        Index("ix_recipe_public_id", public_flag, id), 
+    )
 
     ingredients = relationship("IngredientsRecipe", cascade="all,delete", backref="recipe")
+    photos = relationship("Photo", cascade="all,delete", backref="recipe")
+    procedure = relationship("Procedure", cascade="all,delete", uselist=False, backref="recipe")
 
 
     def __repr__(self):
@@ -64,6 +81,54 @@ class IngredientsRecipe(Base):
     quantity = Column(String)
     PrimaryKeyConstraint(recipeID, ingredientID)
 
+    __table_args__ = (
+        #recipes containing a given ingredient 
+        Index("ix_ingredients_recipe_ingredient", ingredientID, recipeID), 
+    )
+
     def __repr__(self):
         return f"<IngredientRecipe(id_rec={self.recipeID}, id_ingr={self.ingredientID})>"
 
+
+
+
+class Procedure(Base):
+    __tablename__ = "Procedure"
+
+    recipeID = Column(Integer, ForeignKey("Recipe.id"), primary_key=True)
+    compressed = Column(Boolean, nullable=False, default=False)     #zlib compressed content
+    content = Column(LargeBinary, nullable=False)                   #utf-8 text 
+
+    def __repr__(self):
+        return f"<Procedure(recipe={self.recipeID}, compressed={self.compressed}, size={len(self.content)})>"
+
+
+class Photo(Base):
+    __tablename__ = "Photo"
+
+    id = Column(Integer, Sequence("photo_id_seq"), primary_key=True)
+    recipeID = Column(Integer, ForeignKey("Recipe.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    path = Column(String, nullable=False)               #relative to the photo folder
+    file_id = Column(String, nullable=True)             #telegram file_id, to send the photo again without uploading it
+    blob = Column(String, ForeignKey("PhotoBlob.hash"), nullable=True)   #content of the photo, once downloaded
+
+    __table_args__ = (
+        #ordered photos of a recipe
+        Index("ix_photo_recipe_position", recipeID, position), 
+        Index("ix_photo_blob", blob), 
+    )
+
+    def __repr__(self):
+        return f"<Photo(id={self.id}, recipe={self.recipeID}, position={self.position}, path='{self.path}')>"
+
+
+
+class PhotoBlob(Base):
+    __tablename__ = "PhotoBlob"
+
+    hash = Column(String, primary_key=True)             #sha256 of the file content
+    refcount = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<PhotoBlob(hash={self.hash}, refcount={self.refcount})>"
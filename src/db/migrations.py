@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import text
+import logging
+
+from db.mappings import (
+    Base, 
+    RECIPE_SEARCH_DDL, 
+    RECIPE_SEARCH_TABLE
+)
+
+
+def create_search_index(conn):
+    """ Create the full-text index of the recipes, filling it with names and ingredients of the stored recipes """
+
+    conn.execute(text(RECIPE_SEARCH_DDL))
+
+    if not conn.execute(text(f"SELECT count(*) FROM {RECIPE_SEARCH_TABLE}")).scalar():
+        conn.execute(text(
+            f"INSERT INTO {RECIPE_SEARCH_TABLE}(rowid, name, ingredients, procedure) "
+            "SELECT r.id, r.name, ("
+                "SELECT group_concat(i.name, ' ') FROM IngredientsRecipe ir "
+                "JOIN Ingredient i ON i.id = ir.ingredientID WHERE ir.recipeID = r.id"
+            "), '' FROM Recipe r"
+        ))
+
+def create_indexes(conn):
+    """ Create the indexes declared in the mappings. 
+    Duplicated recipe names of the same user are renamed (appending the recipe id) 
+    before creating the unique index on (owner, name). """
+
+    conn.execute(text(
+        "UPDATE Recipe SET name = name || ' (' || id || ')' "
+        "WHERE id NOT IN (SELECT min(id) FROM Recipe GROUP BY owner, name)"
+    ))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind = conn, checkfirst = True)
+
+
+def add_photo_blobs(conn):
+    """ Link the photo manifest to the content-addressed photo store """
+
+    if "blob" not in [column[1] for column in conn.execute(text("PRAGMA table_info(Photo)"))]:
+        conn.execute(text("ALTER TABLE Photo ADD COLUMN blob VARCHAR REFERENCES PhotoBlob(hash)"))
+    
+    create_indexes(conn)
+
+
+#(schema version, description, migration function) - append new migrations at the end
+MIGRATIONS = [
+    (1, "full-text search index", create_search_index), 
+    (2, "secondary indexes and unique recipe names", create_indexes), 
+    (3, "content-addressed photo store", add_photo_blobs), 
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def migrate(engine) -> int:
+    """ Apply to the database the migrations newer than its schema version, 
+    each one in its own transaction. Returns the resulting schema version. """
+
+    with engine.connect() as conn:
+        version = schema_version(conn)
+
+    for target, description, migration in MIGRATIONS:
+        if target > version:
+            logging.info(f"Migrating database from version {version} to {target}: {description}")
+
+            with engine.begin() as conn:
+                migration(conn)
+                conn.execute(text(f"PRAGMA user_version = {target}"))
+            version = target
+
+    return version
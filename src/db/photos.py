@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import multiprocessing
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None 
+
+
+#variant name -> (max width/height in pixels, format, quality)
+VARIANTS = dict(
+    display = (1280, "JPEG", 80),       #sent when the photo has to be uploaded
+)
+VARIANT_EXTENSIONS = dict(JPEG = "jpg")
+#variants no more generated, whose files can still be around: variant name -> extension
+RETIRED_VARIANTS = dict(thumb = "webp")
+
+
+def variant_path(path: str, variant: str) -> str:
+    """ Return the path of the @variant of the photo @path, e.g. photo_1.jpg -> photo_1.display.jpg """
+    root, _ = os.path.splitext(path)
+    extension = RETIRED_VARIANTS[variant] if variant in RETIRED_VARIANTS else VARIANT_EXTENSIONS[VARIANTS[variant][1]]
+    return f"{root}.{variant}.{extension}"
+
+def is_variant(path: str) -> bool:
+    variant = os.path.splitext(os.path.splitext(path)[0])[1][1:]
+    return variant in VARIANTS or variant in RETIRED_VARIANTS
+
+def make_variants(path: str) -> list:
+    """ Save the resized and recompressed variants of the photo @path next to it. Returns their paths. """
+
+    created = list() 
+
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    for variant, (max_size, image_format, quality) in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_size, max_size))
+        resized.save((destination := variant_path(path, variant)), image_format, quality = quality, optimize = True)
+        created.append(destination)
+    
+    return created
+
+
+class PhotoDownloader:
+    """ Downloads telegram photos in background, using a bounded pool of @max_workers threads """
+
+    def __init__(self, bot, max_workers: int = 4):
+        self.__bot = bot
+        self.__executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "photo-download")
+
+    def download(self, jobs: list, on_done = None):
+        """ Download in parallel the (file_id, destination path) pairs in @jobs.
+        When every download is over, @on_done is called with the list of the failed jobs. """
+
+        if not jobs:
+            if on_done:
+                on_done(list())
+            return
+
+        lock, remaining, failed = threading.Lock(), [len(jobs)], list()
+
+        def job_done(job, future):
+            if (error := future.exception()) is not None:
+                logging.warning(f"Cannot download photo {job[0]} to {job[1]}: {error}")
+
+            with lock:
+                if error is not None:
+                    failed.append(job)
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+
+            if finished:
+                logging.info(f"Downloaded {len(jobs) - len(failed)}/{len(jobs)} photos")
+                if on_done:
+                    on_done(failed)
+
+        for job in jobs:
+            future = self.__executor.submit(self.__download, *job)
+            future.add_done_callback(lambda future, job = job: job_done(job, future))
+
+    def shutdown(self, wait: bool = True):
+        self.__executor.shutdown(wait = wait)
+
+    def __download(self, file_id: str, path: str):
+        self.__bot.get_file(file_id).download(custom_path = path)
+
+
+class PhotoProcessor:
+    """ Generates the variants of the downloaded photos in a pool of @max_workers processes,
+    so that image decoding and encoding do not load the bot threads.
+    If Pillow is not installed, photos are left as they are. """
+
+    def __init__(self, max_workers: int = 2):
+        self.__executor = None 
+
+        if Image is None:
+            logging.warning("Pillow is not installed: photo variants will not be generated")
+        else:
+            self.__executor = ProcessPoolExecutor(
+                max_workers = max_workers, mp_context = multiprocessing.get_context("spawn"))
+
+    def process(self, paths: list):
+        """ Generate in background the variants of the photos in @paths """
+
+        if self.__executor is None:
+            return
+
+        for path in paths:
+            future = self.__executor.submit(make_variants, path)
+            future.add_done_callback(lambda future, path = path: self.__log(path, future))
+
+    def shutdown(self, wait: bool = True):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait = wait)
+
+    @staticmethod
+    def __log(path: str, future):
+        if (error := future.exception()) is not None:
+            logging.warning(f"Cannot create the variants of {path}: {error}")
+        else:
+            logging.info(f"Created variants of {path}: {future.result()}")
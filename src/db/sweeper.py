@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import logging
+import threading
+import time
+
+
+class OrphanSweeper:
+    """ Reconciles the procedure and photo folders of @manager (a PersistencyManager) with the db,
+    deleting the files left behind by deleted recipes and interrupted downloads.
+    The folders are visited incrementally: every step examines batches of @batch_size files
+    until @time_budget seconds have elapsed, so that it can be scheduled periodically on the
+    bot's JobQueue without stalling the handlers. A new pass starts once the previous one is over. """
+
+    def __init__(self, manager, batch_size: int = 64, time_budget: float = 0.05):
+        self.__manager = manager
+        self.__batch_size = batch_size
+        self.__time_budget = time_budget
+        self.__lock = threading.Lock()
+        self.__entries = None       #files of the current pass still to be examined
+        self.__removed = 0          #files removed in the current pass
+
+    def step(self) -> int:
+        """ Examine the files of the current pass until the time budget is exhausted.
+        Returns how many files have been removed. """
+
+        if not self.__lock.acquire(blocking = False):
+            return 0
+
+        try:
+            if self.__entries is None:
+                self.__entries = self.__manager.scan_files()
+                self.__removed = self.__manager.collect_blobs()
+
+            deadline, removed = time.monotonic() + self.__time_budget, 0
+
+            while time.monotonic() < deadline:
+                if not (batch := list(itertools.islice(self.__entries, self.__batch_size))):
+                    logging.info(f"Orphan sweep completed: {self.__removed + removed} files removed")
+                    self.__entries = None
+                    break
+
+                removed += self.__manager.sweep_orphans(batch)
+
+            self.__removed += removed
+            return removed
+        except Exception as e:
+            logging.warning(f"Orphan sweep interrupted: {e}")
+            self.__entries = None
+            return 0
+        finally:
+            self.__lock.release()
+
+    def __call__(self, context = None):
+        """ JobQueue callback """
+        self.step()
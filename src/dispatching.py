@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from queue import Queue
+import threading
+
+from telegram import Update
+from telegram.ext import BasePersistence, Defaults, Dispatcher, ExtBot, JobQueue, Updater
+from telegram.utils.request import Request
+
+from outbox import BottomTrackingBot
+from throttling import ThrottledBot, Throttler
+
+
+class TrackingBot(BottomTrackingBot, ExtBot):
+    pass
+
+class ThrottledTrackingBot(BottomTrackingBot, ThrottledBot):
+    pass
+
+
+class ChatDispatcher(Dispatcher):
+    """ Dispatcher running the handlers of different chats in parallel on a pool of @chat_workers threads.
+    The updates of the same chat are handled one at a time, in order of arrival,
+    so conversation states, user_data and the VizManager of a chat are never touched concurrently.
+    Updates without a chat are handled by the dispatcher thread, as usual. """
+
+    def __init__(self, *args, chat_workers: int = 8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__executor = ThreadPoolExecutor(max_workers = chat_workers, thread_name_prefix = "chat")
+        self.__lock = threading.Lock()
+        self.__pending = dict()         # chat id -> updates waiting for the worker of the chat
+
+    @property
+    def pending_updates(self) -> int:
+        """ Number of updates waiting for their chat to be free """
+        with self.__lock:
+            return sum(len(updates) for updates in self.__pending.values())
+
+    def process_update(self, update: object):
+        if not isinstance(update, Update) or update.effective_chat is None:
+            return super().process_update(update)
+
+        chat_id = update.effective_chat.id
+
+        with self.__lock:
+            if (updates := self.__pending.get(chat_id)) is not None:
+                #a worker is already handling this chat: it will handle the update too
+                updates.append(update)
+                return
+            self.__pending[chat_id] = deque([update])
+
+        self.__executor.submit(self.__handle_chat, chat_id)
+
+    def stop(self):
+        super().stop()
+        self.__executor.shutdown(wait = True)
+
+    def __handle_chat(self, chat_id: int):
+        """ Handle the pending updates of @chat_id in order, until there are no more """
+
+        while True:
+            with self.__lock:
+                if not (updates := self.__pending[chat_id]):
+                    del self.__pending[chat_id]
+                    return
+                update = updates.popleft()
+
+            try:
+                super().process_update(update)
+            except Exception:
+                logging.exception(f"Cannot handle update {update.update_id} of chat {chat_id}")
+
+
+def build_updater(
+        token: str,
+        workers: int = 4,
+        chat_workers: int = 8,
+        defaults: Defaults = None,
+        base_url: str = None,
+        base_file_url: str = None, 
+        persistence: BasePersistence = None, 
+        throttler: Throttler = None, 
+        extra_threads: int = 0) -> Updater:
+    """ Create an Updater whose dispatcher is a ChatDispatcher with @chat_workers threads,
+    besides the @workers threads running the run_async callbacks.
+    @extra_threads is the number of other threads sharing the bot (e.g. the photo downloaders).
+    If @throttler is given, the calls to the chats are rate limited by it.
+    The bot keeps track of the bottom message of every chat (see outbox.BottomTrackingBot). """
+
+    #a connection for every thread that can call the Bot API at the same time
+    #(workers, chat workers, dispatcher, updater, job queue, main thread and the extra threads)
+    request = Request(con_pool_size = workers + chat_workers + 4 + extra_threads)
+    bot_args = dict(base_file_url = base_file_url, request = request, defaults = defaults)
+    bot = TrackingBot(token, base_url, **bot_args) if throttler is None else ThrottledTrackingBot(
+        token, base_url, throttler = throttler, **bot_args)
+    job_queue = JobQueue()
+    dispatcher = ChatDispatcher(
+        bot, Queue(), workers = workers, job_queue = job_queue, persistence = persistence, 
+        chat_workers = chat_workers)
+    job_queue.set_dispatcher(dispatcher)
+    bot.dispatcher = dispatcher
+
+    return Updater(dispatcher = dispatcher, workers = None)
@@ -24,6 +24,8 @@ from db.entities import Ingredient, Recipe
 from statements import RecipeInsertionStatements as stm 
 import keyboardz as kb 
 from states import ChatState, DataEntry as de, OperationToDo as ToDo
+from outbox import outbox
+from callbacks import callback_state
 
 
 # Enable logging
@@ -65,10 +67,8 @@ def init_new_recipe(update: Update, context: CallbackContext) -> ChatState:
     logging.info(f"User {user.first_name} -- init new recipe: {update.message.text}")
 
     #remove keyboard from previous message 
-    context.bot.edit_message_reply_markup(
-        chat_id = context.user_data[de.CHAT_ID],
-        message_id = context.user_data[de.LAST].message_id
-    )
+    box = outbox(context)
+    box.strip_keyboard()
 
     args = dict(recipe_name = recipe_name, recipe_owner = user.id)
     if not db_manager.check_recipe_availability(**args):
@@ -78,15 +78,14 @@ def init_new_recipe(update: Update, context: CallbackContext) -> ChatState:
         text = (
             "Hai già memorizzato una ricetta con questo nome!\n"
             "Inviami un altro nome!")
-        context.user_data[de.LAST] = update.message.reply_text(
-            text = text, reply_markup = kb.cancel_keyboard)
+        box.send(text = text, reply_markup = kb.cancel_keyboard)
+        box.flush()
         return ChatState.SELECTING_NAME
 
     recipe = context.user_data[de.RECIPE] = Recipe(name=recipe_name, owner=user.id)
     text = stm.request_more_information(recipe)
-    context.user_data[de.LAST] = update.message.reply_text(
-        text = text,  
-        reply_markup = kb.insert_keyboard)
+    box.send(text = text, reply_markup = kb.insert_keyboard)
+    box.flush()
 
     return ChatState.SELECTING_ACTION
 
@@ -113,12 +112,10 @@ def add_recipe_method(update: Update, context: CallbackContext) -> ChatState:
 #add the new ingredients to the current new recipe
 def save_ingredients(update: Update, context: CallbackContext) -> ChatState:
     logger.info("Ingredienti salvati :)")
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, 
-        message_id = context.user_data[de.LAST].message_id)
+    box.strip_keyboard()
 
     #add acquired ingredients to the current recipe 
     context.user_data[de.RECIPE].add_ingredient_list(
@@ -126,21 +123,18 @@ def save_ingredients(update: Update, context: CallbackContext) -> ChatState:
     context.user_data[de.INGREDIENT_LIST_BUFFER].clear() 
     logger.info("Ingredienti salvati :)")
 
-    context.user_data[de.LAST] = context.bot.send_message(
+    box.send(
         text = stm.request_more_information(context.user_data.get(de.RECIPE)),
-        chat_id = chat_id, 
         reply_markup = kb.insert_keyboard)
+    box.flush()
 
     return ChatState.SELECTING_LEVEL
 
 #ad the recipe's description to the current new recipe 
 def save_recipe_method(update: Update, context: CallbackContext) -> ChatState:
     update.callback_query.answer()
-    chat_id = context.user_data[de.CHAT_ID]
-
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, 
-        message_id = context.user_data[de.LAST].message_id)
+    box = outbox(context)
+    box.strip_keyboard()
 
     logging.info("Procedimento ricetta e foto salvate :) ")
     recipe_description = "\n".join(context.user_data.get(de.RECIPE_DESCRIPTION_BUFFER))
@@ -148,65 +142,59 @@ def save_recipe_method(update: Update, context: CallbackContext) -> ChatState:
     context.user_data[de.RECIPE_DESCRIPTION_BUFFER].clear() 
     context.user_data[de.RECIPE_METHOD] = recipe_description
 
-    context.user_data[de.LAST] = context.bot.send_message(
+    box.send(
         text = stm.request_more_information(context.user_data.get(de.RECIPE)),
-        chat_id = chat_id, 
         reply_markup = kb.insert_keyboard)
+    box.flush()
 
     return ChatState.SELECTING_LEVEL
 
 #discard the new ingredients 
 def discard_ingredients(update: Update, context: CallbackContext) -> ChatState:
     logging.info("I tuoi ingredienti sono stati buttati al macero")
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, 
-        message_id = context.user_data[de.LAST].message_id)
+    box.strip_keyboard()
     
     context.user_data[de.INGREDIENT_LIST_BUFFER].clear() 
 
-    context.user_data[de.LAST] = context.bot.send_message(
+    box.send(
         text = stm.request_more_information(context.user_data.get(de.RECIPE)),
-        chat_id = chat_id, 
         reply_markup = kb.insert_keyboard)
+    box.flush()
 
     return ChatState.SELECTING_LEVEL
 
 #discard the recipe's description provided by the user 
 def discard_recipe_method(update: Update, context: CallbackContext) -> ChatState:
     logging.info("Procedimento ricetta buttato a casino")
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, 
-        message_id = context.user_data[de.LAST].message_id)    
+    box.strip_keyboard()
     
     context.user_data[de.RECIPE_DESCRIPTION_BUFFER].clear() 
 
-    context.user_data[de.LAST] = context.bot.send_message(
+    box.send(
         text = stm.discarded_recipe_method_message(context.user_data[de.RECIPE]), 
-        chat_id = chat_id, 
         reply_markup = kb.insert_keyboard)
+    box.flush()
 
     return ChatState.SELECTING_LEVEL
 
 #save the current recipe in the database 
 def save_recipe(update: Update, context: CallbackContext) -> ChatState:
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box.strip_keyboard()
     
     logging.info("Vediamo se la ricetta è salvabile.")
 
     recipe = context.user_data.get(de.RECIPE)
     args = dict(
         text = stm.save_recipe_confirm(recipe), 
-        chat_id = chat_id, 
         reply_markup = kb.privacy_keyboard
     )
 
@@ -230,22 +218,23 @@ def save_recipe(update: Update, context: CallbackContext) -> ChatState:
 
         context.user_data[de.TODO].todo(todo)
         context.user_data[de.INPUT] = what_input
-        context.user_data[de.LAST] = context.bot.send_message(**args)
+        box.send(**args)
+        box.flush()
         logger.info("Moving to MISSING_INFO state")
         return ChatState.MISSING_INFO
 
-    context.user_data[de.LAST] = context.bot.send_message(**args)
+    box.send(**args)
+    box.flush()
     context.user_data[de.OPERATION] = ChatState.SAVE_RECIPE
 
     return ChatState.ASK_CONFIRM
 
 #saving missing info, either ingredients and/or recipe method
 def save_missing_data(update: Update, context: CallbackContext) -> ChatState:
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box.strip_keyboard()
     
     logging.info("APPOSTO")
     todo_list = context.user_data.get(de.TODO)
@@ -269,24 +258,20 @@ def save_missing_data(update: Update, context: CallbackContext) -> ChatState:
     else:
         raise RuntimeError("Unexpected todo => {todo}")
 
-    context.user_data[de.LAST] = context.bot.send_message(
-        text = text, 
-        chat_id = context.user_data[de.CHAT_ID], 
-        reply_markup = kb.insert_keyboard
-    )
+    box.send(text = text, reply_markup = kb.insert_keyboard)
+    box.flush()
 
     return ChatState.SELECTING_ACTION
 
 #discarding missing info, either ingredients and/or recipe method
 def discard_missing_data(update: Update, context: CallbackContext) -> ChatState:
     logging.info("NON APPOSTO")
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box.strip_keyboard()
     
-    args = dict(chat_id = chat_id, reply_markup = kb.insert_keyboard)
+    args = dict(reply_markup = kb.insert_keyboard)
     todo_list = context.user_data.get(de.TODO)
 
     if (task_todo := todo_list.what_i_have_todo()) is ChatState.INGREDIENTS:
@@ -299,27 +284,27 @@ def discard_missing_data(update: Update, context: CallbackContext) -> ChatState:
         todo_list.recipe_done() 
         context.user_data[de.RECIPE_DESCRIPTION_BUFFER].clear() 
 
-    context.user_data[de.LAST] = context.bot.send_message(**args)
+    box.send(**args)
+    box.flush()
 
     return ChatState.SELECTING_ACTION
 
 #cancel the current recipe from session 
 def cancel_recipe(update: Update, context: CallbackContext) -> ChatState:
     logging.info("Sarebbe bello annullare la ricetta....")
-    chat_id = context.user_data[de.CHAT_ID]
+    box = outbox(context)
 
     update.callback_query.answer()
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box.strip_keyboard()
 
     args = dict(
         text = stm.cancel_recipe_confirm(context.user_data.get(de.RECIPE)), 
-        chat_id = chat_id, 
         reply_markup = kb.do_it_keyboard(
             do_it_msg = "Sì, cancella", dont_do_it_msg = "Noo, torna indietro")
     )
 
-    context.user_data[de.LAST] = context.bot.send_message(**args)
+    box.send(**args)
+    box.flush()
     context.user_data[de.OPERATION] = ChatState.DELETE_RECIPE #actually this is cancel, not delete
 
     return ChatState.ASK_CONFIRM
@@ -330,8 +315,8 @@ def confirm_operation(update: Update, context: CallbackContext) -> ChatState:
     update.callback_query.answer()
     recipe_obj = context.user_data.get(de.RECIPE)
 
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box = outbox(context)
+    box.strip_keyboard()
 
     operation = context.user_data.get(de.OPERATION)
     if operation not in (ChatState.DELETE_RECIPE, ChatState.SAVE_RECIPE):
@@ -342,35 +327,39 @@ def confirm_operation(update: Update, context: CallbackContext) -> ChatState:
 
     if operation == ChatState.SAVE_RECIPE:
         text = stm.saved_recipe(recipe_obj)
-        recipe_obj.visibility = (update.callback_query.data == str(ChatState.SAVE_AS_PUBLIC))
+        recipe_obj.visibility = (callback_state(update) is ChatState.SAVE_AS_PUBLIC)
 
         logger.info(f"My recipe is {recipe_obj}")
 
+        def photos_saved(failed: list):
+            if failed:
+                context.bot.send_message(
+                    text = stm.unsaved_photos(recipe_obj, len(failed)), chat_id = chat_id)
+
         context.bot_data.get(de.MANAGER).add_recipe(
             recipe_obj = recipe_obj, 
             recipe_procedure = context.user_data.get(de.RECIPE_METHOD), 
-            recipe_photos = context.user_data.get(de.PHOTOS)
+            recipe_photos = context.user_data.get(de.PHOTOS), 
+            on_photos_saved = photos_saved
         )
 
         logger.info("New recipe has been saved in the db")
 
-    context.bot.send_message(text=text, chat_id=chat_id)
+    box.send(text = text)
+    box.send(text = stm.keep_going(), reply_markup = kb.main_keyboard)
 
     #clear session 
     context.user_data.clear() 
     context.user_data[de.CHAT_ID] = chat_id
-    context.user_data[de.LAST] = context.bot.send_message(
-        text = stm.keep_going(), chat_id = chat_id, reply_markup = kb.main_keyboard)
+    box.flush()
     
     return ChatState.SELECTING_LEVEL
 
 #cancel salient operations (save recipe / discard recipe)
 def abort_operation(update: Update, context: CallbackContext) -> ChatState:
-    chat_id = context.user_data[de.CHAT_ID]
     update.callback_query.answer()
-
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box = outbox(context)
+    box.strip_keyboard()
 
     if (recipe := context.user_data.get(de.RECIPE)):
         #the uses presses cancel during recipe creation
@@ -383,8 +372,8 @@ def abort_operation(update: Update, context: CallbackContext) -> ChatState:
         keyboard = kb.cancel_keyboard
         return_value = ChatState.SELECTING_NAME
 
-    context.user_data[de.LAST] = context.bot.send_message(
-        text = text, chat_id = chat_id, reply_markup = keyboard)
+    box.send(text = text, reply_markup = keyboard)
+    box.flush()
 
     return return_value
 
@@ -415,6 +404,5 @@ def save_input(update: Update, context: CallbackContext) -> ChatState:
 def add_photo(update: Update, context: CallbackContext) -> ChatState:
     logging.info("che bella foto")
     #update.message.reply_text("Bella foto!!")
-    context.user_data[de.PHOTOS].append(
-        context.bot.get_file( update.message.photo[-1].file_id )
-    )
+    #only the file_id is kept: photos are downloaded in background once the recipe is saved
+    context.user_data[de.PHOTOS].append(update.message.photo[-1].file_id)
@@ -1,114 +1,134 @@
 #-*- coding: utf-8 -*-
 
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from emoji import emojize
 from states import ChatState
+from callbacks import encode
 
 
 ##### Insert recipe keyboards 
 
 main_keyboard = InlineKeyboardMarkup([
     [
-        InlineKeyboardButton(text="Nuova ricetta", callback_data=str(ChatState.NEW_RECIPE_REQUEST)), 
-        InlineKeyboardButton(text="Sfoglia ricette", callback_data=str(ChatState.VIEW_RECIPES))
+        InlineKeyboardButton(text="Nuova ricetta", callback_data=encode(ChatState.NEW_RECIPE_REQUEST)), 
+        InlineKeyboardButton(text="Sfoglia ricette", callback_data=encode(ChatState.VIEW_RECIPES))
     ], [
-        InlineKeyboardButton(text="Cerca!!", callback_data=str(ChatState.SEARCH_FOR_RECIPES)), 
-        InlineKeyboardButton(text="Un ghigno", callback_data=str(ChatState.QUIT_CRINGETTE))
+        InlineKeyboardButton(text="Cerca!!", callback_data=encode(ChatState.SEARCH_FOR_RECIPES)), 
+        InlineKeyboardButton(text="Un ghigno", callback_data=encode(ChatState.QUIT_CRINGETTE))
     ]
 ])
 
 insert_keyboard = InlineKeyboardMarkup([
     [
-        InlineKeyboardButton(text="Ingredienti", callback_data=str(ChatState.INGREDIENTS)),
-        InlineKeyboardButton(text="Scrivi ricetta", callback_data=str(ChatState.OBTAINING_RECIPE))
+        InlineKeyboardButton(text="Ingredienti", callback_data=encode(ChatState.INGREDIENTS)),
+        InlineKeyboardButton(text="Scrivi ricetta", callback_data=encode(ChatState.OBTAINING_RECIPE))
     ], 
     [
-        InlineKeyboardButton(text="Salva", callback_data=str(ChatState.SAVE_RECIPE)), 
-        InlineKeyboardButton(text="Annulla", callback_data=str(ChatState.DELETE_RECIPE))
+        InlineKeyboardButton(text="Salva", callback_data=encode(ChatState.SAVE_RECIPE)), 
+        InlineKeyboardButton(text="Annulla", callback_data=encode(ChatState.DELETE_RECIPE))
     ]
 ])
 
 privacy_keyboard = InlineKeyboardMarkup([
     [
-        InlineKeyboardButton(text="Pubblica", callback_data=str(ChatState.SAVE_AS_PUBLIC)), 
-        InlineKeyboardButton(text="Privata", callback_data=str(ChatState.SAVE_AS_PRIVATE))
+        InlineKeyboardButton(text="Pubblica", callback_data=encode(ChatState.SAVE_AS_PUBLIC)), 
+        InlineKeyboardButton(text="Privata", callback_data=encode(ChatState.SAVE_AS_PRIVATE))
     ], 
     [
-        InlineKeyboardButton(text="Indietro", callback_data=str(ChatState.DONT_DO_IT))
+        InlineKeyboardButton(text="Indietro", callback_data=encode(ChatState.DONT_DO_IT))
     ]
 ])
 
-def confirm_cancel_keyboard(which_keyboard: ChatState = None):
-    keys = {
+#confirm / cancel keyboards, built once 
+confirm_cancel_keyboards = {
+    which_keyboard: InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(text="Ho finito!", callback_data=encode(save)),
+            InlineKeyboardButton(text="Annulla!!", callback_data=encode(cancel))
+        ]
+    ]) for which_keyboard, (save, cancel) in {
         ChatState.RECIPE:       (ChatState.SAVE_RECIPE_METHOD, ChatState.DELETE_RECIPE_METHOD), 
         ChatState.INGREDIENTS:  (ChatState.SAVE_INGREDIENTS, ChatState.DELETE_INGREDIENTS), 
         None:                   (ChatState.SAVE_DATA, ChatState.DELETE_DATA)
-    }
+    }.items()
+}
 
-    if not (cc_kb := keys.get(which_keyboard)):
+def confirm_cancel_keyboard(which_keyboard: ChatState = None):
+    if not (cc_kb := confirm_cancel_keyboards.get(which_keyboard)):
         raise Exception(
             "which_keyboard argument must be either "
             f"{ChatState.RECIPE} or {ChatState.INGREDIENTS} instead of {which_keyboard}.")
 
-    save, cancel = cc_kb
-    return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton(text="Ho finito!", callback_data=str(save)),
-            InlineKeyboardButton(text="Annulla!!", callback_data=str(cancel))
-        ]
-    ])
+    return cc_kb
 
 
 cancel_keyboard = InlineKeyboardMarkup.from_button(
     InlineKeyboardButton(
-        text="Annulla", callback_data=str(ChatState.DELETE_RECIPE))
+        text="Annulla", callback_data=encode(ChatState.DELETE_RECIPE))
 )
 
 ok_keyboard = InlineKeyboardMarkup.from_button(
     InlineKeyboardButton(
-        text = "Ok", callback_data=str(ChatState.OK)
+        text = "Ok", callback_data=encode(ChatState.OK)
     )
 )
 
 
+#the messages are constants of the handlers: a keyboard for each pair is built once 
+@lru_cache(maxsize = 32)
 def do_it_keyboard(do_it_msg: str, dont_do_it_msg: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[
-        InlineKeyboardButton(text=do_it_msg, callback_data=str(ChatState.DO_IT)), 
-        InlineKeyboardButton(text=dont_do_it_msg, callback_data=str(ChatState.DONT_DO_IT))
+        InlineKeyboardButton(text=do_it_msg, callback_data=encode(ChatState.DO_IT)), 
+        InlineKeyboardButton(text=dont_do_it_msg, callback_data=encode(ChatState.DONT_DO_IT))
     ]])
 
 
 which_recipes2see = InlineKeyboardMarkup([
     [
-        InlineKeyboardButton("Tutte!!", callback_data=str(ChatState.VIEW_ALL)), 
-        InlineKeyboardButton("Solo le mie!", callback_data=str(ChatState.VIEW_MINE))
+        InlineKeyboardButton("Tutte!!", callback_data=encode(ChatState.VIEW_ALL)), 
+        InlineKeyboardButton("Solo le mie!", callback_data=encode(ChatState.VIEW_MINE))
     ], 
     [
-        InlineKeyboardButton("Indietro", callback_data=str(ChatState.COME_BACK))
+        InlineKeyboardButton("Indietro", callback_data=encode(ChatState.COME_BACK))
     ]
 ])
 
 search_keyboard = InlineKeyboardMarkup([
-    [InlineKeyboardButton(text="Cerca per nome", callback_data=str(ChatState.SEARCH_BY_INGREDIENT))], 
-#     [InlineKeyboardButton(text="Cerca per hashtag", callback_data=str(ChatState.SEARCH_BY_HASHTAG))], 
-    [InlineKeyboardButton(text="Torna al menù principale", callback_data=str(ChatState.QUIT_SEARCH))]
+    [InlineKeyboardButton(text="Cerca per nome", callback_data=encode(ChatState.SEARCH_BY_NAME))], 
+    [InlineKeyboardButton(text="Cerca per ingredienti", callback_data=encode(ChatState.SEARCH_BY_INGREDIENT))], 
+#     [InlineKeyboardButton(text="Cerca per hashtag", callback_data=encode(ChatState.SEARCH_BY_HASHTAG))], 
+    [InlineKeyboardButton(text="Torna al menù principale", callback_data=encode(ChatState.QUIT_SEARCH))]
 ])
 
 
 
 class VizKB:
+    """ Keyboard of the recipe visualization. The rows of each (mode, searching) pair are emojized once 
+    and the keyboards of the four navigation shapes (none, prev, next, both) are built once as well: 
+    only the prev / next buttons carrying a payload are built on each render. """
+
+    #(viz_mode, searching) -> (navigation rows by shape, action row, quit row, keyboards by shape)
+    __layouts = dict()
+
     def __init__(self, viz_mode: ChatState, searching=False):
         if viz_mode not in (ChatState.VIEW_MINE, ChatState.VIEW_ALL):
             raise RuntimeError(f"Invalid viz_mode: {viz_mode}")
-    
-        self.__prev = ("Prev", ChatState.VIEW_PREV)
-        self.__next = ("Next", ChatState.VIEW_NEXT)
-        self.__actions = [
+
+        if (layout := VizKB.__layouts.get((viz_mode, searching))) is None:
+            layout = VizKB.__layouts[(viz_mode, searching)] = VizKB.__layout(viz_mode, searching)
+        self.__moves, self.__actions, self.__quit, self.__keyboards = layout
+
+    @staticmethod
+    def __layout(viz_mode: ChatState, searching: bool) -> tuple:
+        prev_key = ("Prev", ChatState.VIEW_PREV)
+        next_key = ("Next", ChatState.VIEW_NEXT)
+        actions = [
             #default actions
             ("Mostra ricetta", ChatState.VIEW_RECIPE_METHOD), 
             ("Mostra foto", ChatState.VIEW_RECIPE_PHOTOS)
         ]
-        self.__actions.extend([
+        actions.extend([
             #personal actions
         #    ("Modifica", ChatState.EDIT_RECIPE),  ##TODO 
             ("Cancella", ChatState.DELETE_RECIPE)]       
@@ -116,35 +136,39 @@ class VizKB:
             #actions for other people's recipes
             ("Preferiti", ChatState.SAVE_BOOKMARK)]
         )
-        self.__quit = [
+        quit_keys = [
             ("Indietro", ChatState.COME_BACK if searching else ChatState.COME_BACK), 
             ("Chiudi", ChatState.QUIT_SEARCH if searching else ChatState.QUIT_VIZ)
         ]
-    
-        
-    
-    def render(self, curr_index, max_index) -> InlineKeyboardMarkup: 
-        def render_buttons(keys: list) -> list:
-            return [
-                InlineKeyboardButton(
-                    text=emojize(text, use_aliases=True), callback_data=str(cbd)) 
-                for text, cbd in keys
-            ]
-
-        if curr_index == max_index == 0:
-            moves = list() 
-        elif curr_index == 0:
-            moves = [self.__next]
-        elif curr_index == max_index:
-            moves = [self.__prev]
-        else:
-            moves = [self.__prev, self.__next]
-
-        return InlineKeyboardMarkup([
-            render_buttons(moves), 
-            render_buttons(self.__actions), 
-            render_buttons(self.__quit)
-        ])
+        #navigation shape -> buttons, as texts emojized once
+        moves = {
+            (False, False): [], 
+            (False, True): [next_key], 
+            (True, False): [prev_key], 
+            (True, True): [prev_key, next_key]
+        }
+
+        def emojized(keys: list) -> list:
+            return [(emojize(text, use_aliases=True), cbd) for text, cbd in keys]
+
+        moves = {shape: emojized(keys) for shape, keys in moves.items()}
+        actions, quit_keys = VizKB.__buttons(emojized(actions)), VizKB.__buttons(emojized(quit_keys))
+        keyboards = {
+            shape: InlineKeyboardMarkup([VizKB.__buttons(keys), actions, quit_keys]) for shape, keys in moves.items()}
+
+        return moves, actions, quit_keys, keyboards
+
+    @staticmethod
+    def __buttons(keys: list, payload: tuple = ()) -> list:
+        return [InlineKeyboardButton(text=text, callback_data=encode(cbd, *payload)) for text, cbd in keys]
+
+    def render(self, curr_index, max_index, payload: tuple = ()) -> InlineKeyboardMarkup: 
+        """ Keyboard of the @curr_index-th recipe out of @max_index + 1. 
+        The prev / next buttons carry @payload, if given """
 
+        shape = (curr_index > 0, curr_index < max_index)
 
+        if not payload or not any(shape):
+            return self.__keyboards[shape]
 
+        return InlineKeyboardMarkup([self.__buttons(self.__moves[shape], payload), self.__actions, self.__quit])
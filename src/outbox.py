@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from telegram import Message
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext
+
+from states import DataEntry as de
+
+
+class Outbox:
+    """ Collects the changes a handler wants to make to the chat and applies them with flush(),
+    merging the redundant ones so that as few Bot API calls as possible are made:
+    - removing the keyboard of the bottom message of the chat and sending a new message
+      becomes a single edit of that message;
+    - a message sent and then edited in the same update is sent directly in its final form;
+    - removing the keyboard of a message and then editing or deleting it is just the edit or the deletion;
+    - editing the same message twice is just the last edit.
+    Messages default to the last message of the conversation (DataEntry.LAST),
+    which becomes the last message sent or edited once the outbox is flushed. """
+
+    def __init__(self, context: CallbackContext):
+        self.__context = context
+        self.__chat_id = context.user_data.get(de.CHAT_ID)
+        self.__last = context.user_data.get(de.LAST)    #Message, or pending operation that will produce it
+        self.__operations = list()
+
+    def strip_keyboard(self, message: Message = None):
+        """ Remove the inline keyboard of @message """
+
+        if isinstance(target := self.__target(message), dict):
+            target["args"]["reply_markup"] = None
+        elif (operation := self.__pending(target)) is None:
+            self.__operations.append(dict(kind = "strip", message = target, args = dict()))
+        elif operation["kind"] == "edit":
+            operation["args"]["reply_markup"] = None
+
+    def delete(self, message: Message = None):
+        target = self.__target(message)
+        self.__operations = [
+            operation for operation in self.__operations if operation["message"] is not target]
+        self.__operations.append(dict(kind = "delete", message = target, args = dict()))
+
+    def edit(self, text: str, message: Message = None, **kwargs):
+        """ Replace the text and the keyboard of @message """
+
+        #no keyboard unless given, as editing a message drops its keyboard
+        args = dict(text = text, **{"reply_markup": None, **kwargs})
+
+        if isinstance(target := self.__target(message), dict):
+            #the message has not been sent yet: send it edited
+            target["args"].update(args)
+            self.__last = target
+            return
+
+        if (operation := self.__pending(target)) is None:
+            operation = dict(kind = "edit", message = target, args = args)
+            self.__operations.append(operation)
+        else:
+            operation.update(kind = "edit", args = args)
+
+        self.__last = operation
+
+    def send(self, text: str, **kwargs):
+        """ Send a new message at the bottom of the chat """
+
+        args = dict(text = text, **kwargs)
+        last = self.__operations[-1] if self.__operations else None
+
+        if last and last["kind"] == "strip" and self.__at_bottom(last["message"]) and not any(
+                operation["kind"] == "send" for operation in self.__operations):
+            #the message is the bottom one: writing there looks the same as sending a new message
+            last.update(kind = "edit", args = args, merged = True)
+            self.__last = last
+            return
+
+        self.__last = dict(kind = "send", message = None, args = args)
+        self.__operations.append(self.__last)
+
+    def flush(self) -> Message:
+        """ Make the Bot API calls and return the last message sent or edited,
+        which is stored as the last message of the conversation """
+
+        operations, self.__operations = self.__operations, list()
+        last = None
+
+        for operation in operations:
+            message = operation["message"]
+
+            if operation["kind"] == "strip":
+                self.__bot.edit_message_reply_markup(chat_id = self.__chat_id, message_id = message.message_id)
+            elif operation["kind"] == "delete":
+                self.__bot.delete_message(chat_id = self.__chat_id, message_id = message.message_id)
+            elif operation["kind"] == "send":
+                last = operation["result"] = self.__send(**operation["args"])
+            elif not operation.get("merged"):
+                last = operation["result"] = self.__bot.edit_message_text(
+                    chat_id = self.__chat_id, message_id = message.message_id, **operation["args"])
+            else:
+                try:
+                    last = operation["result"] = self.__bot.edit_message_text(
+                        chat_id = self.__chat_id, message_id = message.message_id, **operation["args"])
+                except BadRequest as e:
+                    if "not modified" in e.message:
+                        #the message already shows what would have been sent
+                        last = operation["result"] = message
+                        continue
+                    #e.g. the message is a photo: make the calls that have been merged
+                    logging.debug(f"Cannot edit message {message.message_id} instead of sending a new one: {e}")
+                    self.__bot.edit_message_reply_markup(chat_id = self.__chat_id, message_id = message.message_id)
+                    last = operation["result"] = self.__send(**operation["args"])
+
+        if isinstance(self.__last, dict):
+            self.__last = self.__last.get("result", last)
+        if isinstance(last, Message):
+            self.__context.user_data[de.LAST] = last
+
+        return last
+
+    @property
+    def __bot(self):
+        return self.__context.bot
+
+    def __send(self, **kwargs) -> Message:
+        message = self.__context.bot.send_message(chat_id = self.__chat_id, **kwargs)
+        self.__context.chat_data[de.BOTTOM] = message.message_id
+        return message
+
+    def __target(self, message: Message):
+        """ The message to change: @message, or the last one """
+        return self.__last if message is None else message
+
+    def __pending(self, message: Message) -> dict:
+        """ The operation already queued on @message, if any """
+
+        for operation in self.__operations:
+            if operation["message"] is message and operation["kind"] in ("strip", "edit"):
+                return operation
+
+    def __at_bottom(self, message: Message) -> bool:
+        """ True if no message has been sent to the chat after @message """
+
+        bottom = self.__context.chat_data.get(de.BOTTOM)
+        return bottom is not None and message.message_id >= bottom
+
+
+def outbox(context: CallbackContext) -> Outbox:
+    """ Return the outbox of the update being handled """
+
+    if (box := getattr(context, "outbox", None)) is None:
+        box = context.outbox = Outbox(context)
+    return box
+
+class BottomTrackingBot:
+    """ Bot mixin: every message the bot sends to a chat, through the outbox or not
+    (photos, albums, notices sent by background jobs...), becomes the bottom message
+    of the chat in the chat_data of @dispatcher, set once the dispatcher is created """
+
+    dispatcher = None
+
+    def _post(self, endpoint: str, data: dict = None, *args, **kwargs):
+        result = super()._post(endpoint, data, *args, **kwargs)
+
+        if self.dispatcher is not None and endpoint.startswith("send"):
+            #a message, or the list of messages of an album
+            messages = [
+                message for message in (result if isinstance(result, list) else [result]) 
+                    if isinstance(message, dict) and "message_id" in message]
+
+            if messages:
+                chat_data = self.dispatcher.chat_data[messages[0]["chat"]["id"]]
+                chat_data[de.BOTTOM] = max(
+                    chat_data.get(de.BOTTOM, 0), *(message["message_id"] for message in messages))
+
+        return result
+
+
+def track_bottom(update, context: CallbackContext):
+    """ Remember the id of the latest message the user sent, which is now at the bottom of the chat """
+
+    if (message := update.effective_message) is not None and update.effective_chat is not None:
+        context.chat_data[de.BOTTOM] = max(context.chat_data.get(de.BOTTOM, 0), message.message_id)
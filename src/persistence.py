@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+from datetime import datetime, timezone
+import enum
+import json
+import logging
+import sqlite3
+import threading
+
+from telegram import Chat, Message
+from telegram.ext import BasePersistence
+
+import db.entities as ent
+from states import ChatState, DataEntry, OperationToDo
+
+
+ENUMS = {cls.__name__: cls for cls in (ChatState, DataEntry)}
+#plain classes saved as their attributes
+OBJECTS = {cls.__name__: cls for cls in (OperationToDo,)}
+
+
+class SessionPersistence(BasePersistence):
+    """ Keeps the conversation states and the user_data of every user in the SQLite database @filename,
+    so that conversations survive a restart. Sessions are stored in a compact form:
+    messages are reduced to their ids (the VizManager is kept as its cursor, see view.viz_manager).
+    Changed sessions are written by flush(), to be called periodically: updates only touch memory. """
+
+    def __init__(self, filename: str):
+        super().__init__(store_user_data = True, store_chat_data = False, store_bot_data = False)
+        self.__lock = threading.Lock()
+        self.__stored = dict()      # (kind, key) -> serialized value, as in the db or as it will be after the flush
+        self.__dirty = dict()       # (kind, key) -> serialized value to write, None to delete
+
+        self.__connection = sqlite3.connect(filename, check_same_thread = False)
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS Session ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (kind, key)) WITHOUT ROWID")
+
+        for kind, key, value in self.__connection.execute("SELECT kind, key, value FROM Session"):
+            self.__stored[(kind, key)] = value
+
+        logging.info(f"{len(self.__stored)} sessions loaded from {filename}")
+
+    #sessions hold no Bot instances: skip the deep copies BasePersistence makes to replace them
+    @classmethod
+    def replace_bot(cls, obj: object) -> object:
+        return obj
+
+    def insert_bot(self, obj: object) -> object:
+        return obj
+
+    def get_user_data(self) -> defaultdict:
+        user_data = defaultdict(dict)
+
+        for (kind, key), value in self.__loaded("user"):
+            user_data[int(key)] = self.__decode(json.loads(value))
+
+        return user_data
+
+    def get_conversations(self, name: str) -> dict:
+        return {
+            tuple(json.loads(key)): self.__decode(json.loads(value))
+                for (_, key), value in self.__loaded(f"conversation:{name}")}
+
+    def update_user_data(self, user_id: int, data: dict):
+        self.__update("user", str(user_id), data or None)
+
+    def update_conversation(self, name: str, key: tuple, new_state: object):
+        self.__update(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    def get_chat_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_bot_data(self) -> dict:
+        return dict()
+
+    def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    def update_bot_data(self, data: dict):
+        pass
+
+    def flush(self):
+        """ Write the changed sessions in a single transaction """
+
+        with self.__lock:
+            if not (dirty := self.__dirty):
+                return
+            self.__dirty = dict()
+
+            with self.__connection:
+                self.__connection.executemany(
+                    "INSERT OR REPLACE INTO Session (kind, key, value) VALUES (?, ?, ?)",
+                    [(kind, key, value) for (kind, key), value in dirty.items() if value is not None])
+                self.__connection.executemany(
+                    "DELETE FROM Session WHERE kind = ? AND key = ?",
+                    [(kind, key) for (kind, key), value in dirty.items() if value is None])
+
+        logging.debug(f"{len(dirty)} sessions flushed")
+
+    def __loaded(self, kind: str) -> list:
+        with self.__lock:
+            return [(k, value) for k, value in self.__stored.items() if k[0] == kind]
+
+    def __update(self, kind: str, key: str, data: object):
+        """ Serialize @data and mark it to be written if it changed. None deletes the session. """
+
+        value = None if data is None else json.dumps(self.__encode(data), separators = (",", ":"))
+
+        with self.__lock:
+            if self.__stored.get((kind, key)) == value:
+                return
+
+            if value is None:
+                del self.__stored[(kind, key)]
+            else:
+                self.__stored[(kind, key)] = value
+            self.__dirty[(kind, key)] = value
+
+    def __encode(self, obj: object):
+        """ Return a JSON-serializable form of @obj: JSON objects only appear as tagged values """
+
+        if obj is None or isinstance(obj, (bool, int, float, str)) and not isinstance(obj, enum.Enum):
+            return obj
+        if isinstance(obj, list):
+            return [self.__encode(item) for item in obj]
+        if isinstance(obj, (set, tuple)):
+            return {"$": type(obj).__name__, "v": [self.__encode(item) for item in obj]}
+        if isinstance(obj, dict):
+            return {"$": "dict", "v": self.__encode_items(obj)}
+        if isinstance(obj, enum.Enum) and type(obj).__name__ in ENUMS:
+            return {"$": type(obj).__name__, "v": obj.name}
+        if isinstance(obj, Message):
+            return {"$": "message", "v": [obj.chat_id, obj.message_id, int(obj.date.timestamp())]}
+        if isinstance(obj, ent.Recipe):
+            return {"$": "recipe", "v": [
+                obj.name, obj.owner, obj.id, obj.visibility, [i.name for i in obj.ingredients]]}
+        if type(obj).__name__ in OBJECTS:
+            return {"$": "object", "v": [type(obj).__name__, self.__encode(vars(obj))]}
+
+        raise TypeError(f"Cannot store {type(obj).__name__} objects in the session")
+
+    def __encode_items(self, obj: dict) -> list:
+        """ Encode the items of @obj, skipping the ones that cannot be stored """
+
+        items = list()
+
+        for key, value in obj.items():
+            try:
+                items.append([self.__encode(key), self.__encode(value)])
+            except TypeError as e:
+                logging.warning(f"{e}: {key} is not saved")
+
+        return items
+
+    def __decode(self, obj: object):
+        if isinstance(obj, list):
+            return [self.__decode(item) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+
+        tag, value = obj["$"], obj["v"]
+
+        if tag == "dict":
+            return {self.__decode(key): self.__decode(item) for key, item in value}
+        if tag in ("set", "tuple"):
+            return (set if tag == "set" else tuple)(self.__decode(item) for item in value)
+        if tag in ENUMS:
+            return ENUMS[tag][value]
+        if tag == "message":
+            chat_id, message_id, date = value
+            return Message(
+                message_id, datetime.fromtimestamp(date, timezone.utc), Chat(chat_id, Chat.PRIVATE), bot = self.bot)
+        if tag == "recipe":
+            name, owner, recipe_id, visibility, ingredients = value
+            recipe = ent.Recipe(name = name, owner = owner).add_ingredient_list(ingredients)
+            recipe.id, recipe.visibility = recipe_id, visibility
+            return recipe
+        if tag == "object":
+            instance = OBJECTS[value[0]].__new__(OBJECTS[value[0]])
+            instance.__dict__.update(self.__decode(value[1]))
+            return instance
+
+        raise ValueError(f"Unknown session value {tag}")
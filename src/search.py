@@ -28,6 +28,8 @@ from states import (
     DataEntry as de
 )
 from db.managers import DBManager, PersistencyManager
+from outbox import outbox
+from callbacks import callback_state, encode
 
 
 # Enable logging
@@ -61,14 +63,13 @@ def init_search(update: Update, context: CallbackContext) -> ChatState:
     update.callback_query.answer() 
 
     if not (search_type := context.user_data.get(de.SEARCH_TYPE)):
-        search_type = update.callback_query.data
+        search_type = str(callback_state(update))
         context.user_data[de.SEARCH_TYPE] = search_type #nb. storing str(enum) instead of enum
 
-    text = (
-        "Inserisci i nomi degli ingredienti" 
-        if search_type == str(ChatState.SEARCH_BY_INGREDIENT) else 
-        "Inserisci gli hashtag "
-    )
+    text = {
+        str(ChatState.SEARCH_BY_NAME): "Inserisci le parole da cercare", 
+        str(ChatState.SEARCH_BY_INGREDIENT): "Inserisci i nomi degli ingredienti"
+    }.get(search_type, "Inserisci gli hashtag ")
 
     update.callback_query.edit_message_text(
         text = text, 
@@ -80,26 +81,26 @@ def init_search(update: Update, context: CallbackContext) -> ChatState:
 
 def do_search(update: Update, context: CallbackContext) -> ChatState:
     update.callback_query.answer() 
-    update.callback_query.edit_message_reply_markup()
-    chat_id = context.user_data.get(de.CHAT_ID)
+    box = outbox(context)
+    box.strip_keyboard(update.callback_query.message)
 
     if not context.user_data.get(de.BUFFER):
         text = "non hai mandato nessun termine di ricerca...coglione"
-        context.user_data[de.LAST] = context.bot.send_message(
+        box.send(
             text=text, 
-            chat_id = chat_id, 
             reply_markup = kb.confirm_cancel_keyboard()
         )
+        box.flush()
         return ChatState.INPUT_TIME
         
     #process tokens
     context.user_data[de.SEARCH_TOKENS] = tokens = process_received_tokens(update, context)
     logger.info(f"Received tokens: {tokens}")
 
-    context.user_data[de.LAST] = context.bot.send_message(
+    box.send(
         text=f"Effettuo la ricerca con questi termini: {tokens}\nSono corretti?", 
-        chat_id = chat_id, 
         reply_markup = kb.do_it_keyboard(do_it_msg="Giusti, vai", dont_do_it_msg="Noo, modifica"))
+    box.flush()
 
     return ChatState.WAIT_CONFIRM 
 
@@ -119,37 +120,34 @@ def perform_search(update: Update, context: CallbackContext) -> ChatState:
             message_id = context.user_data.get(de.LAST).message_id, 
             reply_markup = InlineKeyboardMarkup.from_button(
                 InlineKeyboardButton(
-                    text = "Ok", callback_data=str(ChatState.QUIT_SEARCH)))
+                    text = "Ok", callback_data=encode(ChatState.QUIT_SEARCH)))
         )
         return ChatState.WAIT_CONFIRM
 
 
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data.get(de.LAST).message_id)
+    #the keyboard is replaced by the one of the recipe in visualize_recipes
+    outbox(context).strip_keyboard()
 
     viz = view.VizManager(
         user_id = chat_id, recipe_ids = list(recipe_ids), 
         manager = context.bot_data.get(de.MANAGER), 
         viz_mode = ChatState.VIEW_ALL, 
         searching = True)
-    context.user_data.update({
-        de.WHICH_VIEW: ChatState.VIEW_ALL, 
-        de.VIZ: viz
-    })
+    context.user_data[de.WHICH_VIEW] = ChatState.VIEW_ALL
+    view.save_viz(context, viz)
     logger.info(f"init {viz}")
 
-    return view.visualize_recipes(update, context)
+    return view.visualize_recipes(update, context, viz)
 
 def indecisive_search(update: Update, context: CallbackContext) -> ChatState:
     logger.info("trying to quit")
-    chat_id = context.user_data.get(de.CHAT_ID)
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data.get(de.LAST).message_id)
-    context.user_data[de.LAST] = context.bot.send_message(
-        chat_id = chat_id, 
+    box = outbox(context)
+    box.strip_keyboard()
+    box.send(
         text = "Beh, che vuoi fare?", 
         reply_markup = kb.search_keyboard
     )
+    box.flush()
     #clear search type 
     del context.user_data[de.SEARCH_TYPE]
 
@@ -190,7 +188,7 @@ def process_received_tokens(update: Update, context: CallbackContext) -> list:
         for message in data:
             tokens.extend(message.split(" "))
 
-    elif search_type == str(ChatState.SEARCH_BY_INGREDIENT):
+    elif search_type in (str(ChatState.SEARCH_BY_NAME), str(ChatState.SEARCH_BY_INGREDIENT)):
         for message in data:
             tokens.extend([s.lower() for text in message.split(",") if (s := text.strip())])
 
@@ -211,6 +209,14 @@ def get_recipes(update: Update, context: CallbackContext) -> list:
         raise NotImplementedError("todo - search by hashtag")
 
     elif search_type == str(ChatState.SEARCH_BY_INGREDIENT):
+        recipes_id = context.bot_data.get(de.MANAGER).db_manager.search_by_ingredients(
+            user_data.get(de.SEARCH_TOKENS), 
+            user_data.get(de.CHAT_ID),
+            True
+        )
+        logger.info(f"Trovate ricette: {recipes_id}")
+
+    elif search_type == str(ChatState.SEARCH_BY_NAME):
         recipes_id = context.bot_data.get(de.MANAGER).db_manager.search_recipes(
             user_data.get(de.SEARCH_TOKENS), 
             user_data.get(de.CHAT_ID),
@@ -1,96 +1,115 @@
 #-*- coding: utf-8 -*-
 
-import enum 
+import enum
 from emoji import emojize
 from db.entities import Ingredient, Recipe
 
+
+def template(text: str) -> str:
+    """ Emojize @text once, at import. Parameterized texts are then filled in with fill """
+    return emojize(text, use_aliases=True)
+
+def fill(text: str, **values) -> str:
+    """ Fill the template @text with @values, emojized as when the whole message was emojized
+    (user and recipe names can hold aliases too): only the values that can hold one are emojized """
+
+    return text.format(**{
+        key: emojize(value, use_aliases=True) if isinstance(value, str) and ":" in value else value 
+        for key, value in values.items()})
+
+
 class Statements:
+    WELCOME = template(
+        "Ciao, {user_name}!\n"
+        "Cringette è il bot che ti aiuterà a tenere a portata di tap le tue ricette di cucina! :yum:\n"
+        "È in uno stadio di sviluppo <i>alpha</i>, ciò significa che potrebbero verificarsi comportamenti non previsti.\n"
+        "Per interagire con Cringette, puoi utilizzare la tastiera personalizzata o i comandi.\n"
+        "Tappa su /help per visualizzare i comandi supportati!\n\n"
+        "Che vuoi fare?")
+    MAIN_MESSAGE = template("Ciao, {user_name}!\nChe vuoi fare?")
+    HELPER = template(
+        "<b>Comandi supportati:</b>\n\n"
+    #    "• /nuova - aggiungi una ricetta\n"
+        # "• /view - scorri le tue ricette o quelle degli altri utenti\n"
+        # "• /search - cerca (per parole, hashtag...) tra le tue ricette o quelle degli altri utenti\n"
+        "• /help - visualizza questo messaggio di aiuto\n"
+        "• /stop - annulla il comando in corso\n"
+        "\nAltre funzionalità sono in via di sviluppo! :smile:")
+
     @classmethod
     def welcome(cls, user_name):
-        message = (
-            f"Ciao, {user_name}!\n"
-            "Cringette è il bot che ti aiuterà a tenere a portata di tap le tue ricette di cucina! :yum:\n"
-            "È in uno stadio di sviluppo <i>alpha</i>, ciò significa che potrebbero verificarsi comportamenti non previsti.\n"
-            "Per interagire con Cringette, puoi utilizzare la tastiera personalizzata o i comandi.\n"
-            "Tappa su /help per visualizzare i comandi supportati!\n\n"
-            "Che vuoi fare?"
-        )
-        return emojize(message, use_aliases=True)
-    
+        return fill(cls.WELCOME, user_name = user_name)
+
     @classmethod
     def main_message(cls, user_name):
-        message = f"Ciao, {user_name}!\nChe vuoi fare?"
-        return emojize(message, use_aliases=True)
-    
+        return fill(cls.MAIN_MESSAGE, user_name = user_name)
+
     @classmethod
     def helper(cls):
-        message = (
-            "<b>Comandi supportati:</b>\n\n"
-        #    "• /nuova - aggiungi una ricetta\n"
-            # "• /view - scorri le tue ricette o quelle degli altri utenti\n"
-            # "• /search - cerca (per parole, hashtag...) tra le tue ricette o quelle degli altri utenti\n"
-            "• /help - visualizza questo messaggio di aiuto\n"
-            "• /stop - annulla il comando in corso\n"
-            "\nAltre funzionalità sono in via di sviluppo! :smile:"
-        )
-        return emojize(message, use_aliases=True)
-
-
-
+        return cls.HELPER
+
+
+
+
+class RecipeInsertionStatements:
+    REQUEST_RECIPE_NAME = template("Molto bene! Come si chiama la ricetta?")
+    REQUEST_INGREDIENTS = template(
+        "Sono pronto! Inviami la lista degli ingredienti!\n\n"
+        "NB. Puoi inviarmi un ingrediente alla volta, "
+        "o se preferisci puoi scrivere più ingredienti in un unico messaggio, "
+        "separandoli con delle virgole e/o con delle andate a capo!\n")
+    REQUEST_MORE_INFORMATION = template("{recipe}\nMolto bene! Dimmi di più sulla tua nuova ricetta!")
+    REQUEST_RECIPE_METHOD = template(
+        "{username}, ci siamo quasi!\n"
+        "Inviami il procedimento per cucinare questa deliziosa ricetta, e anche qualche foto se vuoi!")
+    BREATHARIANISM_RECIPE = template(
+        "Zio, non mi hai mandato nessun ingrediente!!\n"
+        "Non sono ammesse ricette respiriane, quindi dimmi gli ingredienti o vai a fare in culo. :angry:")
+    UNDESCRIBED_RECIPE = template("manca la ricetta, pirla.")
+    SAVE_RECIPE_CONFIRM = template("{recipe}\n • Sei sicuro sicuro di voler salvare questa merdosissima ricetta?")
+    CANCEL_RECIPE_CONFIRM = template("{prefix} • Sei sicuro sicuro di voler cancellare questa merdosissima ricetta?")
+    VIZ_RECIPE = "Ricetta: {name}\nIngredienti: {ingredients}\n"
+    DISCARDED_RECIPE_METHOD = template(
+        "{recipe}Molto bene, ho cancellato quello che mi avevi scritto (stronzate)!\nFai qualcosa!")
+    CANCELED_RECIPE = template("Inserimento ricetta {name} annullata.")
+    SAVED_RECIPE = template("Ricetta {name} salvata con (in)successo nel database")
+    UNSAVED_PHOTOS = template("Non sono riuscito a salvare {num_photos} foto della ricetta {name} :pensive:")
+    KEEP_GOING = template("E ora che intenzioni hai di bello?")
+    ASK_AGAIN_FOR_RECIPE_NAME = template("Riprendiamo da dove eravamo rimasti... Come si chiama la ricetta?")
+    CANCELED_OPERATION = template("Operazione annullata! E ora che intenzioni hai di bello?")
 
-class RecipeInsertionStatements:    
     @classmethod
     def request_recipe_name(cls):
-        return emojize("Molto bene! Come si chiama la ricetta?", use_aliases=True)
+        return cls.REQUEST_RECIPE_NAME
 
     @classmethod
     def request_ingredients(cls):
-        message = (
-            "Sono pronto! Inviami la lista degli ingredienti!\n\n"
-            "NB. Puoi inviarmi un ingrediente alla volta, "
-            "o se preferisci puoi scrivere più ingredienti in un unico messaggio, "
-            "separandoli con delle virgole e/o con delle andate a capo!\n")
-        return emojize(message, use_aliases=True)
-    
+        return cls.REQUEST_INGREDIENTS
+
     @classmethod
     def request_more_information(cls, recipe: Recipe):
-        message = (
-            f"{cls.viz_recipe(recipe)}\n"
-            "Molto bene! Dimmi di più sulla tua nuova ricetta!"   
-        )
-        
-        return emojize(message, use_aliases=True)
+        return fill(cls.REQUEST_MORE_INFORMATION, recipe = cls.viz_recipe(recipe))
 
     @classmethod
     def request_recipe_method(cls, username):
-        message = (
-            f"{username}, ci siamo quasi!\n"
-            "Inviami il procedimento per cucinare questa deliziosa ricetta, e anche qualche foto se vuoi!")
-        return emojize(message, use_aliases=True)
+        return fill(cls.REQUEST_RECIPE_METHOD, username = username)
 
     @classmethod
     def breatharianism_recipe(cls):
-        message = (
-            "Zio, non mi hai mandato nessun ingrediente!!\n"
-            "Non sono ammesse ricette respiriane, quindi dimmi gli ingredienti o vai a fare in culo. :angry:")
-        return emojize(message, use_aliases=True)
+        return cls.BREATHARIANISM_RECIPE
 
     @classmethod
     def undescribed_recipe(cls):
-        message = "manca la ricetta, pirla."
-        return emojize(message, use_aliases=True)
+        return cls.UNDESCRIBED_RECIPE
 
 
     @classmethod
     def save_recipe_confirm(cls, recipe):
-        message = f"{cls.viz_recipe(recipe)}\n • Sei sicuro sicuro di voler salvare questa merdosissima ricetta?"
-        return emojize(message, use_aliases=True)
+        return fill(cls.SAVE_RECIPE_CONFIRM, recipe = cls.viz_recipe(recipe))
 
     @classmethod
     def cancel_recipe_confirm(cls, recipe):
-        prefix = str(recipe.name) if recipe else ""
-        message = (f"{prefix} • Sei sicuro sicuro di voler cancellare questa merdosissima ricetta?")
-        return emojize(message, use_aliases=True)
+        return fill(cls.CANCEL_RECIPE_CONFIRM, prefix = str(recipe.name) if recipe else "")
 
 
     @classmethod
@@ -99,55 +118,49 @@ class RecipeInsertionStatements:
             ", ".join([str(ingr) for ingr in recipe.ingredients])
             if recipe.ingredients else "al momento nessuno."
         )
-        message = (
-            f"Ricetta: {recipe.name}\n"
-            f"Ingredienti: {ingredients}\n"
-        )
+        return cls.VIZ_RECIPE.format(name = recipe.name, ingredients = ingredients)
 
-        return message
-    
     @classmethod
     def discarded_recipe_method_message(cls, recipe):
-        message = (
-            f"{cls.viz_recipe(recipe)}"
-            "Molto bene, ho cancellato quello che mi avevi scritto (stronzate)!\nFai qualcosa!")
-        return emojize(message, use_aliases=True)
-    
+        return fill(cls.DISCARDED_RECIPE_METHOD, recipe = cls.viz_recipe(recipe))
+
     @classmethod
     def canceled_recipe(cls, recipe):
-        message = f"Inserimento ricetta {recipe.name if recipe else ''} annullata."
-        return emojize(message, use_aliases=True)
-    
+        return fill(cls.CANCELED_RECIPE, name = recipe.name if recipe else '')
+
     @classmethod
     def saved_recipe(cls, recipe):
-        message = f"Ricetta {recipe.name} salvata con (in)successo nel database"
-        return emojize(message, use_aliases=True)
-    
+        return fill(cls.SAVED_RECIPE, name = recipe.name)
+
+    @classmethod
+    def unsaved_photos(cls, recipe, num_photos):
+        return fill(cls.UNSAVED_PHOTOS, num_photos = num_photos, name = recipe.name)
+
     @classmethod
     def keep_going(cls):
-        message = "E ora che intenzioni hai di bello?"
-        return emojize(message, use_aliases=True)
-    
+        return cls.KEEP_GOING
+
     @classmethod
     def ask_again_for_recipe_name(cls):
-        message = "Riprendiamo da dove eravamo rimasti... Come si chiama la ricetta?"
-        return emojize(message, use_aliases=True)
-    
+        return cls.ASK_AGAIN_FOR_RECIPE_NAME
+
     @classmethod
     def canceled_operation_lets_continue(cls):
-        message = "Operazione annullata! E ora che intenzioni hai di bello?"
-        return emojize(message, use_aliases=True)
+        return cls.CANCELED_OPERATION
 
 
 class RecipeVisualisationStatements:
+    RECIPE_IN_LIST = template(
+        "<b>{name}</b>\n\n"
+        "Ingredienti:\n"
+        "• {ingredients}\n\n"
+        "Ricetta {num_curr_recipe}/{num_max_recipe}")
+
     @classmethod
     def view_recipe_in_list(clf, recipe, num_curr_recipe, num_max_recipe):
         ingredients = sorted([i.name.capitalize() for i in recipe.ingredients])
-        ingredients = "\n• ".join(ingredients)
-        message = (
-            f"<b>{recipe.name.capitalize()}</b>\n\n"
-            "Ingredienti:\n"
-            f"• {ingredients}\n\n"
-            f"Ricetta {num_curr_recipe}/{num_max_recipe}"
-        )
-        return emojize(message, use_aliases=True)
\ No newline at end of file
+        return fill(clf.RECIPE_IN_LIST, 
+            name = recipe.name.capitalize(),
+            ingredients = "\n• ".join(ingredients),
+            num_curr_recipe = num_curr_recipe,
+            num_max_recipe = num_max_recipe)
@@ -3,6 +3,7 @@
 import enum 
 from telegram.ext import ConversationHandler
 
+#the buttons carry the states as the fixed codes of callbacks.CODES, which new states have to be added to
 class ChatState(enum.Enum):
     #main operations
     NEW_RECIPE_REQUEST = enum.auto()
@@ -56,6 +57,7 @@ class ChatState(enum.Enum):
     WHICH_SEARCH = enum.auto()
     SEARCH_BY_HASHTAG = enum.auto()
     SEARCH_BY_INGREDIENT = enum.auto()
+    SEARCH_BY_NAME = enum.auto()
     INPUT_TIME = enum.auto()
 
     
@@ -105,6 +107,7 @@ class OperationToDo:
 
 class DataEntry(enum.Enum):
     LAST = enum.auto()          #last message id 
+    BOTTOM = enum.auto()        #id of the latest message of the chat (chat_data)
     CHAT_ID = enum.auto()       #current chat id 
     MANAGER = enum.auto()       #persistency manager 
     RECIPE = enum.auto()        #current recipe during creation phase 
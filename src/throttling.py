@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+
+class TokenBucket:
+    """ Allows @rate calls per second on average, with bursts of at most @capacity calls """
+
+    def __init__(self, rate: float, capacity: float):
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__updated = time.monotonic()
+        self.__paused_until = 0
+
+    def reserve(self, now: float, tokens: float = 1) -> float:
+        """ Take @tokens tokens, returning how many seconds the caller has to wait before using them.
+        Tokens can be borrowed from the future: callers queue up behind the previous reservations. """
+
+        #@now can be in the future (a reservation made after waiting for another bucket)
+        elapsed = max(now - self.__updated, 0)
+        self.__tokens = min(self.__capacity, self.__tokens + elapsed * self.__rate) - tokens
+        self.__updated = max(now, self.__updated)
+        return max(-self.__tokens / self.__rate, self.__paused_until - now, 0)
+
+    def pause(self, now: float, seconds: float):
+        """ Make every reservation wait at least until @seconds have elapsed """
+        self.__paused_until = max(self.__paused_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        """ True if the bucket would be full: forgetting it changes nothing """
+        return (self.__tokens + max(now - self.__updated, 0) * self.__rate >= self.__capacity 
+            and self.__paused_until <= now)
+
+
+class Throttler:
+    """ Spaces out the Bot API calls directed to chats, so that they stay within
+    @global_rate calls per second overall (bursts of @global_burst) and
+    @chat_rate calls per second per chat (bursts of @chat_burst).
+    Callers wait in the calling thread for their turn. Calls failing with RetryAfter
+    pause the chat and are retried up to @max_retries times, backing off exponentially. """
+
+    #forget the buckets of inactive chats every that many calls
+    CLEANUP_EVERY = 1024
+
+    def __init__(self,
+            global_rate: float = 30,
+            global_burst: float = 30,
+            chat_rate: float = 1,
+            chat_burst: float = 5,
+            max_retries: int = 3,
+            backoff: float = 1):
+        self.__chat_rate, self.__chat_burst = chat_rate, chat_burst
+        self.__max_retries = max_retries
+        self.__backoff = backoff
+        self.__lock = threading.Lock()
+        self.__global = TokenBucket(global_rate, global_burst)
+        self.__chats = dict()       # chat id -> TokenBucket
+        self.__calls = self.__waiting = self.__delayed = self.__retries = 0
+        self.__wait_time = self.__max_wait = 0.0
+
+    @property
+    def stats(self) -> dict:
+        """ Number of calls, calls waiting for their turn (queue depth), calls delayed,
+        RetryAfter retries, total and longest wait in seconds """
+
+        with self.__lock:
+            return dict(
+                calls = self.__calls,
+                queue_depth = self.__waiting,
+                delayed = self.__delayed,
+                retries = self.__retries,
+                wait_time = round(self.__wait_time, 3),
+                max_wait = round(self.__max_wait, 3))
+
+    def call(self, chat_id, function, tokens: float = 1):
+        """ Call @function once the chat @chat_id and the bot have @tokens tokens available """
+
+        for attempt in range(self.__max_retries + 1):
+            self.__wait_turn(chat_id, tokens)
+
+            try:
+                return function()
+            except RetryAfter as e:
+                if attempt == self.__max_retries:
+                    raise
+
+                delay = max(e.retry_after, self.__backoff * 2**attempt)
+                logging.warning(f"Flood limit hit sending to chat {chat_id}: retrying in {delay} s")
+
+                with self.__lock:
+                    self.__retries += 1
+                    self.__bucket(chat_id).pause(time.monotonic(), delay)
+
+    def __wait_turn(self, chat_id, tokens: float):
+        with self.__lock:
+            now = time.monotonic()
+            self.__calls += 1
+            #the chat turn first, then the global one: a busy chat does not hold global tokens
+            wait = self.__bucket(chat_id).reserve(now, tokens)
+            wait = max(wait, self.__global.reserve(now + wait, tokens))
+
+            if self.__calls % self.CLEANUP_EVERY == 0:
+                self.__chats = {c_id: b for c_id, b in self.__chats.items() if not b.idle(now)}
+
+            if wait <= 0:
+                return
+
+            self.__waiting += 1
+            self.__delayed += 1
+            self.__wait_time += wait
+            self.__max_wait = max(self.__max_wait, wait)
+
+        try:
+            time.sleep(wait)
+        finally:
+            with self.__lock:
+                self.__waiting -= 1
+
+    def __bucket(self, chat_id) -> TokenBucket:
+        if (bucket := self.__chats.get(chat_id)) is None:
+            bucket = self.__chats[chat_id] = TokenBucket(self.__chat_rate, self.__chat_burst)
+        return bucket
+
+
+class ThrottledBot(ExtBot):
+    """ Bot whose calls directed to a chat go through @throttler """
+
+    def __init__(self, *args, throttler: Throttler = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__throttler = throttler or Throttler()
+
+    @property
+    def throttler(self) -> Throttler:
+        return self.__throttler
+
+    def _post(self, endpoint: str, data: dict = None, *args, **kwargs):
+        if not data or data.get("chat_id") is None:
+            return super()._post(endpoint, data, *args, **kwargs)
+
+        #an album counts as one message per photo
+        tokens = len(data["media"]) if endpoint == "sendMediaGroup" else 1
+
+        return self.__throttler.call(
+            data["chat_id"], lambda: super(ThrottledBot, self)._post(endpoint, data, *args, **kwargs), tokens)
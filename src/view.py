@@ -1,7 +1,9 @@
 #-*- coding: utf-8 -*-
 
+from contextlib import ExitStack
 from pathlib import Path 
 import logging
+import zlib
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -11,6 +13,7 @@ from telegram import (
     ParseMode, 
     InputMediaPhoto
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Updater,
     CommandHandler,
@@ -28,6 +31,8 @@ from states import (
     DataEntry as de
 )
 from db.managers import DBManager, PersistencyManager
+from outbox import outbox
+from callbacks import callback_state
 
 
 # Enable logging
@@ -36,60 +41,167 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+#scopes of the stateless browsing, as carried by the prev / next buttons
+SCOPES = {ChatState.VIEW_MINE: "m", ChatState.VIEW_ALL: "a"}
+
 
 class VizManager:
+    """ Keeps track of the recipes a user is browsing. 
+    If @recipe_ids is given (e.g. search results) the user browses those recipes, 
+    otherwise the user's (or the public) recipes are fetched from the db 
+    a window of @window_size ids at a time, using keyset pagination. 
+    If @load_window is False, the first window is not fetched: the caller moves the VizManager (see from_cursor). """
+
     def __init__(self, 
-        user_id: int, recipe_ids: list, 
-        manager: PersistencyManager, viz_mode: ChatState, searching = False):
+        user_id: int, manager: PersistencyManager, viz_mode: ChatState, 
+        recipe_ids: list = None, searching = False, window_size: int = 20, load_window: bool = True):
 
         self.__manager = manager
         self.__user = user_id
-        # self.__recipes, self.__privacies = zip(*recipe_ids)
-        self.__privacies = None
-        try:
-            self.__recipes, self.__privacies = zip(*recipe_ids)
-            self.__recipes = list(self.__recipes)
-        except TypeError:
-            self.__recipes = recipe_ids
-
-        self.__cache = dict()
+        self.__viz_mode = viz_mode
+        self.__searching = searching
+        self.__browsing = recipe_ids is None
+        self.__all_recipes = viz_mode is ChatState.VIEW_ALL
+        self.__window_size = window_size
+
+        if recipe_ids is None:
+            db_manager = manager.db_manager
+            self.__total = db_manager.count_recipes(user_id, self.__all_recipes)
+            self.__recipes = db_manager.get_recipe_ids_page(
+                user_id, self.__all_recipes, limit = window_size) if self.__total and load_window else list()
+        else:
+            self.__recipes = list(recipe_ids)
+            self.__total = len(self.__recipes)
+
         self.__kb = kb.VizKB(viz_mode = viz_mode, searching=searching)
 
+        self.__offset = 0           #position of the first recipe of the window
         self.__pointer = 0
 
+    @classmethod
+    def from_cursor(cls, cursor: dict, manager: PersistencyManager):
+        """ Rebuild the VizManager whose cursor is @cursor """
+
+        #the window is fetched around the current recipe by __move_to
+        viz = cls(
+            cursor["user"], manager, ChatState[cursor["mode"]], 
+            recipe_ids = cursor["recipes"], searching = cursor["searching"], window_size = cursor["window_size"], 
+            load_window = False)
+        viz.__move_to(cursor["pointer"], cursor["current"])
+        return viz
+
+    @property
+    def cursor(self) -> dict:
+        """ Compact form of the browsing state: the current recipe and its position, 
+        plus the browsed ids when they are not fetched from the db """
+
+        current = self.__recipes[self.__pointer - self.__offset] if self.__total else None
+
+        return dict(
+            user = self.__user, 
+            mode = self.__viz_mode.name, 
+            searching = self.__searching, 
+            window_size = self.__window_size, 
+            pointer = self.__pointer, 
+            current = current, 
+            recipes = None if self.__browsing else list(self.__recipes))
+
+    @staticmethod
+    def browsing_cursor(user_id: int, viz_mode: ChatState, pointer: int, recipe_id: int, window_size: int = 20) -> dict:
+        """ Cursor of a VizManager browsing the recipes of @viz_mode, pointing to @recipe_id (the @pointer-th one) """
+
+        return dict(
+            user = user_id, mode = viz_mode.name, searching = False, window_size = window_size, 
+            pointer = pointer, current = recipe_id, recipes = None)
+
+    def __move_to(self, pointer: int, recipe_id: int):
+        """ Point to the recipe @recipe_id, which is the @pointer-th one """
+
+        if not self.__total:
+            return
+        if recipe_id is None:
+            #no recipe when the cursor was saved: start from the first one
+            self.__pointer = 0
+            if self.__browsing:
+                self.__load_window()
+            return
+
+        self.__pointer = min(pointer, self.__total - 1)
+
+        if not self.__browsing:
+            self.__offset = 0
+        elif (window := self.__manager.db_manager.get_recipe_ids_page(
+                self.__user, self.__all_recipes, after_id = recipe_id - 1, limit = self.__window_size)):
+            #the window starts from the recipe, or from the following one if it has been deleted
+            self.__recipes, self.__offset = window, self.__pointer
+            self.__total = max(self.__total, self.__offset + len(window))
+        else:
+            #recipe and following ones deleted in the meantime: point to the last recipe
+            self.__pointer = self.__total - 1
+            self.__load_window(before_id = recipe_id)
+
     @property
     def current(self):
-        if not (rcp := self.__cache.get((i := self.__pointer))):
-            #domanda: a che serve avere le privacy delle ricette se poi la recupero da qua?
-            self.__cache[i] = rcp = self.__manager.db_manager.get_recipe_by_id(self.__recipes[i])
-        return rcp 
+        return self.__manager.get_recipe(self.__recipes[self.__pointer - self.__offset])
 
     @property 
     def num_recipes(self) -> int:
-        return len(self.__recipes)
+        return self.__total
 
     def go_next(self) -> int:
-        self.__pointer += 1 
+        if self.__pointer + 1 < self.__total:
+            self.__pointer += 1 
+            if self.__pointer - self.__offset >= len(self.__recipes):
+                self.__load_window(after_id = self.__recipes[-1])
         return 0 
     
     def go_previous(self) -> int:
-        self.__pointer -= 1 
+        if self.__pointer > 0:
+            self.__pointer -= 1 
+            if self.__pointer < self.__offset:
+                self.__load_window(before_id = self.__recipes[0])
         return 0 
     
     def delete_recipe(self) -> int:
-        args = dict(user_id = self.__user, by_id = self.current.id)
-        if (r_id := self.__manager.db_manager.delete_recipe(**args)):
+        args = dict(user_id = self.__user, recipe_id = self.current.id)
+        if (r_id := self.__manager.delete_recipe(**args)):
             logger.info(f"User {self.__user} deleted recipe #{r_id}")
 
-            del self.__cache[self.__pointer]
-            del self.__recipes[self.__pointer]
+            del self.__recipes[self.__pointer - self.__offset]
+            self.__total -= 1
             self.__pointer = self.__pointer - 1 if self.__pointer else 0
 
+            if self.__total and self.__pointer < self.__offset:
+                self.__load_window(before_id = r_id)
+            elif self.__total and not self.__recipes:
+                self.__load_window(after_id = r_id)
+
         return r_id
 
+    def __load_window(self, after_id: int = None, before_id: int = None):
+        """ Replace the current window with the one following @after_id or preceding @before_id, 
+        so that the recipe pointed by the pointer is either its first or its last recipe. """
+
+        window = self.__manager.db_manager.get_recipe_ids_page(
+            self.__user, self.__all_recipes, 
+            after_id = after_id, before_id = before_id, limit = self.__window_size)
+        
+        if not window:
+            #recipes deleted in the meantime: stay on the current window
+            self.__total = self.__offset + len(self.__recipes)
+            self.__pointer = min(max(self.__pointer, self.__offset), self.__total - 1)
+            return
+
+        self.__recipes = window 
+        self.__offset = self.__pointer if before_id is None else max(self.__pointer - len(window) + 1, 0)
+
 
     def render_kb(self) -> InlineKeyboardMarkup:
-        return self.__kb.render(self.__pointer, self.num_recipes - 1) 
+        #when browsing, prev / next work without the VizManager: see browse
+        payload = browse_payload(
+            self.__viz_mode, self.__user, self.__recipes[self.__pointer - self.__offset], self.__pointer
+        ) if self.__browsing else ()
+        return self.__kb.render(self.__pointer, self.num_recipes - 1, payload) 
     
     def render_recipe(self) -> str:
         return viz_stm.view_recipe_in_list(
@@ -99,6 +211,26 @@ class VizManager:
         )
 
 
+def filter_hash(viz_mode: ChatState, user_id: int) -> str:
+    """ Digest of the recipes browsed in @viz_mode by @user_id: the public ones, or the ones of the user """
+
+    owner = user_id if viz_mode is ChatState.VIEW_MINE else ""
+    return f"{zlib.crc32(f'{SCOPES[viz_mode]}:{owner}'.encode()):08x}"
+
+def browse_payload(viz_mode: ChatState, user_id: int, recipe_id: int, position: int) -> tuple:
+    """ Payload of the prev / next buttons of the recipe @recipe_id, the @position-th one: 
+    scope, cursor, position and filter hash """
+    return SCOPES[viz_mode], recipe_id, position, filter_hash(viz_mode, user_id)
+
+def viz_manager(context: CallbackContext) -> VizManager:
+    """ Return the VizManager of the user, rebuilt from the cursor kept in user_data. 
+    The user_data only holds the cursor: store it back with save_viz after moving the VizManager. """
+    return VizManager.from_cursor(context.user_data[de.VIZ], context.bot_data[de.MANAGER])
+
+def save_viz(context: CallbackContext, viz: VizManager):
+    context.user_data[de.VIZ] = viz.cursor
+
+
 def init_visualization(update: Update, context: CallbackContext) -> ChatState:
     text = "Procediamo! Quali ricette vuoi vedere?"
     args = dict(text=text, reply_markup=kb.which_recipes2see)    
@@ -129,80 +261,68 @@ def init_view_recipes(update: Update, context: CallbackContext) -> ChatState:
     chat_id = user_data.get(de.CHAT_ID)
 
     which_view = (
-        ChatState.VIEW_MINE if update.callback_query.data == str(ChatState.VIEW_MINE)
+        ChatState.VIEW_MINE if callback_state(update) is ChatState.VIEW_MINE
         else ChatState.VIEW_ALL)
 
-    id_recipes = context.bot_data[de.MANAGER].db_manager.get_recipes(
-        user_id = chat_id,  
-        id_only = True, 
-        all_recipes = which_view is ChatState.VIEW_ALL)
+    viz = VizManager(
+        user_id = chat_id, 
+        manager = context.bot_data.get(de.MANAGER), 
+        viz_mode = which_view)
 
-    if not id_recipes:
-        context.bot.edit_message_reply_markup(
-            chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
-        user_data[de.LAST] = context.bot.send_message(
+    if not viz.num_recipes:
+        box = outbox(context)
+        box.strip_keyboard()
+        box.send(
             text = "Non ho trovato nessuna ricetta coi criteri da te inseriti :( ", 
-            chat_id = chat_id, 
             reply_markup = kb.main_keyboard
         )
+        box.flush()
         return ChatState.SELECTING_LEVEL 
 
-    args = dict(
-        user_id = chat_id, recipe_ids = id_recipes, 
-        manager = context.bot_data.get(de.MANAGER), 
-        viz_mode = which_view)
-    user_data.update({
-        de.WHICH_VIEW: which_view, 
-        de.VIZ: VizManager(**args)})
+    user_data[de.WHICH_VIEW] = which_view
+    save_viz(context, viz)
 
-    return visualize_recipes(update, context)
+    return visualize_recipes(update, context, viz)
 
 #visualize stuff 
-def visualize_recipes(update: Update, context: CallbackContext) -> ChatState:
-    user_data = context.user_data
-    chat_id, message, viz = [user_data.get(e) for e in (de.CHAT_ID, de.LAST, de.VIZ)] 
-    # context.bot.edit_message_reply_markup(
-    #     chat_id = chat_id, message_id = user_data[de.LAST].message_id)
-  #  user_data[de.LAST] = context.bot.send_message(
+def visualize_recipes(update: Update, context: CallbackContext, viz: VizManager = None) -> ChatState:
+    """ Show the current recipe of @viz (default: the VizManager of the user) in the last message, 
+    along with the changes the caller queued in the outbox """
+
+    box, viz = outbox(context), viz or viz_manager(context)
 
     if viz.num_recipes == 0:
-        context.bot.edit_message_text(
+        box.edit(
             text = "Non c'è più nessuna ricetta da visualizzare! Scegli che fare.", 
-            chat_id = chat_id, 
-            message_id = message.message_id, 
             reply_markup = kb.main_keyboard
         )
+        box.flush()
         return ChatState.SELECTING_LEVEL
 
-    context.bot.edit_message_text(
-        text = viz.render_recipe(), 
-        chat_id = chat_id,
-        message_id = message.message_id,
-        reply_markup = viz.render_kb())
+    box.edit(text = viz.render_recipe(), reply_markup = viz.render_kb())
+    box.flush()
 
     return ChatState.SELECTING_ACTION   
 
 def back2visualization(update: Update, context: CallbackContext) -> ChatState:
-    chat_id = context.user_data.get(de.CHAT_ID)
-    message_id = context.user_data.get(de.LAST).message_id
+    box = outbox(context)
 
     try:
         del context.user_data[de.SHOWING_PHOTOS]
-        context.bot.delete_message(chat_id = chat_id, message_id = message_id)
+        box.delete()
     except KeyError:
-        context.bot.edit_message_reply_markup(
-            chat_id = chat_id, message_id = message_id)
+        box.strip_keyboard()
     finally:
-        context.user_data[de.LAST] = context.bot.send_message(
-            text="loading :)", chat_id = chat_id)
+        #the recipe is shown in this message by visualize_recipes
+        box.send(text="loading :)")
     return visualize_recipes(update, context)
 
 
 def visualize_recipe_method(update: Update, context: CallbackContext) -> ChatState:
-    recipe = context.user_data.get(de.VIZ).current
+    recipe = viz_manager(context).current
     text = (
         f"Procedimento per <b>{recipe.name}</b>\n\n"
-        f"{context.bot_data.get(de.MANAGER).fs_manager.get_procedure(recipe)}"
+        f"{context.bot_data.get(de.MANAGER).get_procedure(recipe)}"
     )
     context.bot.edit_message_text(
         text = text,
@@ -215,53 +335,46 @@ def visualize_recipe_method(update: Update, context: CallbackContext) -> ChatSta
 
 def visualize_recipe_photos(update: Update, context: CallbackContext) -> ChatState:
     user_data = context.user_data
-    recipe = user_data.get(de.VIZ).current
-    photos = context.bot_data.get(de.MANAGER).fs_manager.get_photos(recipe)
+    recipe, manager = viz_manager(context).current, context.bot_data.get(de.MANAGER)
+    #photos whose file is missing can only be sent by file_id
+    photos = [photo for photo in manager.get_photos(recipe) if photo.file_id or manager.has_photo_file(photo)]
     message_id = user_data.get(de.LAST).message_id
     chat_id = user_data.get(de.CHAT_ID)
-    args = dict(
-        chat_id = chat_id
-    )
 
     if not photos:
         #no photos: edit previous message 
-        function = context.bot.edit_message_text
-        args.update(dict(
+        context.bot.edit_message_text(
             text = "Non ci sono foto per questa ricetta :(",
+            chat_id = chat_id, 
             message_id = message_id,
             reply_markup = kb.ok_keyboard
-        ))
-    else:
-        context.bot.delete_message(
-            chat_id = chat_id, message_id = message_id)
-        #there is at least one photo: process all photos
-        my_media = [open(photo, "rb") for photo in photos[1:]]
-        first_photo = open(photos[0], "rb")
-        caption = str(recipe.name.capitalize())
-        
-        if len(photos) == 1:
-            #just one photo - send the photo and the ok keyboard 
-            function = context.bot.send_photo
-            args.update(dict(
-                photo = first_photo, 
-                caption = caption, 
-                reply_markup = kb.ok_keyboard))
-        else:
-            #multiple photos - send an album, unfortunately with no keyboard
-            user_data[de.SHOWING_PHOTOS] = True
-            function = context.bot.send_media_group
-            media = [InputMediaPhoto(photo) for photo in my_media]
-            #the caption must be in the first photo 
-            media.insert(0, InputMediaPhoto(first_photo, caption = caption))
-            
-            args.update(dict(media = media))
+        )
+        return ChatState.WAIT_CONFIRM
+
+    context.bot.delete_message(
+        chat_id = chat_id, message_id = message_id)
+    
+    try:
+        #send the photos already known by telegram by file_id 
+        result = send_photos(context, chat_id, recipe, photos)
+    except BadRequest as e:
+        #file_id rejected: upload the photos from disk, skipping the ones whose file is missing
+        logger.info(f"Cannot send photos of recipe #{recipe.id} by file_id: {e}")
+        if (photos := [photo for photo in photos if manager.has_photo_file(photo)]):
+            result = send_photos(context, chat_id, recipe, photos, use_file_ids = False)
 
-    #send photo(s) or edit previous message with no photo(s) :(
-    if (result := function(**args)) and len(photos) == 1:
+    if not photos:
+        #the message has been deleted: send a new one
+        user_data[de.LAST] = context.bot.send_message(
+            chat_id = chat_id, 
+            text = "Non riesco a mandarti le foto di questa ricetta :(",
+            reply_markup = kb.ok_keyboard)
+    elif len(photos) == 1:
         #save message id if I am sending a photo with reply keyboard
         user_data[de.LAST] = result
-    elif user_data.get(de.SHOWING_PHOTOS):
+    else:
         #show the ok keyboard if I am sending multiple photos
+        user_data[de.SHOWING_PHOTOS] = True
         user_data[de.LAST] = context.bot.send_message(
             chat_id = chat_id, 
             text = "Sono proprio delle belle foto, vero? Dai, torniamo di là?", 
@@ -269,50 +382,135 @@ def visualize_recipe_photos(update: Update, context: CallbackContext) -> ChatSta
 
     return ChatState.WAIT_CONFIRM
 
+def send_photos(context: CallbackContext, chat_id: int, recipe, photos: list, use_file_ids: bool = True):
+    """ Send the @photos of @recipe: a single photo with the ok keyboard, or an album. 
+    Photos are sent by telegram file_id when known (and @use_file_ids is True), uploading the file otherwise. 
+    The file_ids of the uploaded photos are stored for the next time. """
+
+    manager = context.bot_data.get(de.MANAGER)
+    caption = str(recipe.name.capitalize())
+
+    with ExitStack() as files:
+        media = [
+            photo.file_id if use_file_ids and photo.file_id else 
+                files.enter_context(open(manager.photo_path(photo, variant = "display"), "rb")) 
+            for photo in photos]
+
+        if len(photos) == 1:
+            #just one photo - send the photo and the ok keyboard 
+            result = context.bot.send_photo(
+                chat_id = chat_id, photo = media[0], caption = caption, reply_markup = kb.ok_keyboard)
+            messages = [result]
+        else:
+            #multiple photos - send an album, unfortunately with no keyboard
+            #the caption must be in the first photo 
+            result = messages = context.bot.send_media_group(
+                chat_id = chat_id, 
+                media = [
+                    InputMediaPhoto(item, caption = caption if index == 0 else None) 
+                        for index, item in enumerate(media)])
+
+    for photo, message in zip(photos, messages):
+        if message.photo and not (use_file_ids and photo.file_id):
+            manager.set_photo_file_id(photo, message.photo[-1].file_id)
+
+    return result
+
 ### actions
 def prev_next(update: Update, context: CallbackContext) -> ChatState: 
-    query, viz = update.callback_query, context.user_data.get(de.VIZ)
+    if context.args:
+        return browse(update, context)
+
+    query, viz = update.callback_query, viz_manager(context)
     query.answer()
     move_function = (
-        viz.go_previous if query.data == str(ChatState.VIEW_PREV) else viz.go_next)
+        viz.go_previous if callback_state(update) is ChatState.VIEW_PREV else viz.go_next)
     move_function()
-    return visualize_recipes(update, context)
+    save_viz(context, viz)
+    return visualize_recipes(update, context, viz)
+
+def browse(update: Update, context: CallbackContext) -> ChatState:
+    """ Show the recipe following (or preceding) the one whose prev / next button has been pressed.
+    The button carries the scope, the recipe id, its position and the filter hash: the page is rebuilt 
+    from the keyset index without the VizManager, and only the cursor of the recipe shown is kept for the other actions. 
+    Buttons sent before the position was added carry no position, which is then counted. """
+
+    query, chat_id = update.callback_query, update.effective_chat.id
+
+    try:
+        if len(context.args) not in (3, 4):
+            raise ValueError(f"{len(context.args)} values")
+        scope, cursor, *position, digest = context.args
+        cursor, position = int(cursor), int(position[0]) if position else None
+        viz_mode = next((mode for mode, code in SCOPES.items() if code == scope), None)
+    except ValueError:
+        #malformed payload
+        viz_mode = None
+
+    if viz_mode is None or digest != filter_hash(viz_mode, chat_id):
+        query.answer(text = "Questo pulsante non è più valido :(", show_alert = True)
+        return None
+
+    query.answer()
+    manager, all_recipes = context.bot_data[de.MANAGER], viz_mode is ChatState.VIEW_ALL
+    page = manager.db_manager.browse_recipes(
+        chat_id, all_recipes, cursor, backwards = callback_state(update) is ChatState.VIEW_PREV, position = position)
+
+    if page is None:
+        #no recipe after the cursor anymore: start over
+        page = manager.db_manager.browse_recipes(chat_id, all_recipes)
+
+    context.user_data[de.VIZ] = None if page is None else VizManager.browsing_cursor(
+        chat_id, viz_mode, page[1], page[0])
+    box = outbox(context)
+
+    if page is None:
+        box.edit(
+            text = "Non c'è più nessuna ricetta da visualizzare! Scegli che fare.", 
+            reply_markup = kb.main_keyboard, 
+            message = query.message)
+        box.flush()
+        return ChatState.SELECTING_LEVEL
+
+    recipe_id, position, total = page
+    box.edit(
+        text = viz_stm.view_recipe_in_list(
+            recipe = manager.get_recipe(recipe_id), num_curr_recipe = position + 1, num_max_recipe = total), 
+        reply_markup = kb.VizKB(viz_mode).render(position, total - 1, browse_payload(viz_mode, chat_id, recipe_id, position)), 
+        message = query.message)
+    box.flush()
+
+    return ChatState.SELECTING_ACTION
 
 def edit(update: Update, context: CallbackContext) -> ChatState:
     return visualize_recipes(update, context)
 
 def delete(update: Update, context: CallbackContext) -> ChatState:
-    chat_id = context.user_data.get(de.CHAT_ID)
-    context.bot.edit_message_reply_markup(
-        chat_id = chat_id, message_id = context.user_data[de.LAST].message_id)
+    box = outbox(context)
+    box.strip_keyboard()
     args = dict(
         text = "Sei sicuro di voler cancellare questa ricetta?", 
-        chat_id = chat_id, 
         reply_markup = kb.do_it_keyboard("Sì, cancella", "Noooo, scherzavo")
     )
-    context.user_data[de.LAST] = context.bot.send_message(**args)
+    box.send(**args)
+    box.flush()
     return ChatState.CONFIRM_DELETE_RECIPE
 
 def perform_delete_operation(update: Update, context: CallbackContext) -> ChatState:
     update.callback_query.answer() 
-    user_data = context.user_data
-    chat_id, viz = user_data.get(de.CHAT_ID), user_data.get(de.VIZ)
+    box, viz = outbox(context), viz_manager(context)
     text = "Cancellazione annullata. Torniamo a dove eravamo rimasti..."
 
-    if update.callback_query.data == str(ChatState.DO_IT):
+    if callback_state(update) is ChatState.DO_IT:
         text = f"Ho cancellato la ricetta <b>{viz.current.name}</b> :)"
         viz.delete_recipe()
+        save_viz(context, viz)
     
-    args = dict(
-        text = text, 
-        chat_id = chat_id, 
-        message_id = context.user_data.get(de.LAST).message_id)
-    context.bot.edit_message_text(**args)
-    context.user_data[de.LAST] = context.bot.send_message(
-        text = ":)", chat_id = chat_id
-    )
+    box.edit(text = text)
+    #the recipe is shown in this message by visualize_recipes
+    box.send(text = ":)")
 
-    return visualize_recipes(update, context)
+    return visualize_recipes(update, context, viz)
 
 
 